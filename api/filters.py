@@ -1,22 +1,78 @@
+import datetime
 import django_filters
+from django.utils import timezone
 from transactions.models import Deposit, Withdrawal
 
 
-class DepositFilter(django_filters.FilterSet):
-    day = django_filters.NumberFilter(field_name='timestamp__day', label='Day')
-    month = django_filters.NumberFilter(field_name='timestamp__month', label='Month')
-    year = django_filters.NumberFilter(field_name='timestamp__year', label='Year')
+class TimestampRangeFilterSet(django_filters.FilterSet):
+    """
+    day, month and year are combined into a single half-open range
+    `timestamp >= start AND timestamp < end` computed in the current timezone,
+    so the lookup can use the timestamp indexes instead of extracting parts of every row.
+    a missing month or year defaults to the current one e.g ?day=5 is the 5th of this month
+    """
+    day = django_filters.NumberFilter(method='filter_calendar', label='Day')
+    month = django_filters.NumberFilter(method='filter_calendar', label='Month')
+    year = django_filters.NumberFilter(method='filter_calendar', label='Year')
+    amount_min = django_filters.NumberFilter(field_name='amount', lookup_expr='gte', label='Minimum amount')
+    amount_max = django_filters.NumberFilter(field_name='amount', lookup_expr='lte', label='Maximum amount')
+
+    def filter_calendar(self, queryset, name, value):
+        # day, month and year are applied together in filter_queryset
+        return queryset
+
+    def calendar_range(self):
+        """returns the (start, end) datetimes selected by day/month/year, or None"""
+        data = self.form.cleaned_data
+        day, month, year = (data.get(name) for name in ('day', 'month', 'year'))
+        if day is None and month is None and year is None:
+            return None
+
+        today = timezone.localdate()
+        year = int(year) if year is not None else today.year
+        if month is None and day is None:
+            start, end = datetime.date(year, 1, 1), datetime.date(year + 1, 1, 1)
+        else:
+            month = int(month) if month is not None else today.month
+            if day is None:
+                start = datetime.date(year, month, 1)
+                end = datetime.date(year + month // 12, month % 12 + 1, 1)
+            else:
+                start = datetime.date(year, month, int(day))
+                end = start + datetime.timedelta(days=1)
+
+        tz = timezone.get_current_timezone()
+        return (timezone.make_aware(datetime.datetime.combine(start, datetime.time.min), tz),
+                timezone.make_aware(datetime.datetime.combine(end, datetime.time.min), tz))
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        try:
+            period = self.calendar_range()
+        except (ValueError, OverflowError):
+            # e.g month=13 or day=31 in a 30 day month
+            return queryset.none()
+        if period:
+            queryset = queryset.filter(timestamp__gte=period[0], timestamp__lt=period[1])
+        return queryset
+
+
+# `from` is a python keyword so it can't be declared in the class body
+TimestampRangeFilterSet.declared_filters['from'] = TimestampRangeFilterSet.base_filters['from'] = \
+    django_filters.IsoDateTimeFilter(field_name='timestamp', lookup_expr='gte', label='From')
+TimestampRangeFilterSet.declared_filters['to'] = TimestampRangeFilterSet.base_filters['to'] = \
+    django_filters.IsoDateTimeFilter(field_name='timestamp', lookup_expr='lt', label='To (exclusive)')
+
+
+class DepositFilter(TimestampRangeFilterSet):
 
     class Meta:
         model = Deposit
-        fields = ['day', 'month', 'year']
+        fields = ['day', 'month', 'year', 'from', 'to', 'amount_min', 'amount_max']
 
 
-class WithdrawalFilter(django_filters.FilterSet):
-    day = django_filters.NumberFilter(field_name='timestamp__day', label='Day')
-    month = django_filters.NumberFilter(field_name='timestamp__month', label='Month')
-    year = django_filters.NumberFilter(field_name='timestamp__year', label='Year')
+class WithdrawalFilter(TimestampRangeFilterSet):
 
     class Meta:
         model = Withdrawal
-        fields = ['day', 'month', 'year']
+        fields = ['day', 'month', 'year', 'from', 'to', 'amount_min', 'amount_max']
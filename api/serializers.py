@@ -1,16 +1,17 @@
 from rest_framework import serializers
 from transactions.models import Balance, Deposit, Withdrawal, AccountSummary
 from decimal import Decimal
+from base.metrics import TimedSerializerMixin
 
 
-class BalanceSerializer(serializers.ModelSerializer):
+class BalanceSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Balance
         fields = ['id', 'user', 'amount']
         read_only_fields = ['id', 'user', 'amount']
 
 
-class DepositSerializer(serializers.ModelSerializer):
+class DepositSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Deposit
         fields = ['id', 'user', 'amount', 'is_verified', 'timestamp']
@@ -31,7 +32,7 @@ class DepositSerializer(serializers.ModelSerializer):
         return data
 
 
-class WithdrawalSerializer(serializers.ModelSerializer):
+class WithdrawalSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Withdrawal
         fields = ['id', 'user', 'amount', 'is_verified', 'timestamp']
@@ -48,8 +49,38 @@ class WithdrawalSerializer(serializers.ModelSerializer):
         return data
 
 
-class AccountSummarySerializer(serializers.ModelSerializer):
+class AccountSummarySerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = AccountSummary
-        fields = ['id', 'user', 'profit_loss', 'opened_position', 'margin', 'free_margin', 'margin_level']
-        read_only_fields = ['id', 'user']
+        fields = ['id', 'user', 'balance', 'profit_loss', 'equity', 'opened_position', 'margin', 'free_margin',
+                  'margin_level']
+        read_only_fields = fields
+
+
+class StatementQuerySerializer(TimedSerializerMixin, serializers.Serializer):
+    period = serializers.ChoiceField(choices=['day', 'week', 'month'], default='day')
+
+    def get_fields(self):
+        fields = super().get_fields()
+        # `from` is a python keyword so it can't be declared in the class body
+        fields['from'] = serializers.DateTimeField(required=False, help_text='start of the range')
+        fields['to'] = serializers.DateTimeField(required=False, help_text='end of the range (exclusive)')
+        return fields
+
+    def validate(self, data):
+        if data.get('from') and data.get('to') and data['from'] >= data['to']:
+            raise serializers.ValidationError({'error': '`from` must be before `to`.'})
+        return data
+
+
+class StatementSerializer(TimedSerializerMixin, serializers.Serializer):
+    period = serializers.DateTimeField()
+    deposits_verified = serializers.DecimalField(max_digits=20, decimal_places=2)
+    deposits_verified_count = serializers.IntegerField()
+    deposits_pending = serializers.DecimalField(max_digits=20, decimal_places=2)
+    deposits_pending_count = serializers.IntegerField()
+    withdrawals_verified = serializers.DecimalField(max_digits=20, decimal_places=2)
+    withdrawals_verified_count = serializers.IntegerField()
+    withdrawals_pending = serializers.DecimalField(max_digits=20, decimal_places=2)
+    withdrawals_pending_count = serializers.IntegerField()
+    net_flow = serializers.DecimalField(max_digits=20, decimal_places=2)
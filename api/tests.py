@@ -1,3 +1,330 @@
-from django.test import TestCase
+import datetime
+from decimal import Decimal
+from unittest import mock, skipUnless
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from django.contrib.auth import get_user_model
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from transactions.models import Deposit, Withdrawal, Balance, AccountSummary
+from transactions import ledger
+from base.db_router import ReplicaRouter, use_replica, pin_to_primary
+from base.metrics import QueryBudgetExceeded
+from base.testing import enforce_query_budgets, capture_requests
+from .filters import DepositFilter
+from .views import DepositViewSet
 
-# Create your tests here.
+User = get_user_model()
+
+
+class BalanceCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email="trader@example.com", password="password123")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_balance_poll_is_served_from_cache_until_it_changes(self):
+        response = self.client.get("/api/balance/")
+        self.assertEqual(response.data, {"id": None, "user": self.user.id, "amount": 0})
+
+        with self.assertNumQueries(0):
+            self.client.get("/api/balance/")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ledger.verify_deposit(Deposit.objects.create(user=self.user, amount=Decimal("25.00")))
+
+        response = self.client.get("/api/balance/")
+        self.assertEqual(response.data[0]["amount"], "25.00")
+
+    def test_account_summary_poll_is_served_from_cache_until_it_changes(self):
+        summary = AccountSummary.objects.create(user=self.user, margin=Decimal("10.00"))
+        response = self.client.get("/api/account-summaries/")
+        self.assertEqual(response.data["count"], 1)
+        self.assertEqual(response.data["results"][0]["margin"], "10.00")
+
+        with self.assertNumQueries(0):
+            self.client.get("/api/account-summaries/")
+
+        summary.margin = Decimal("20.00")
+        with self.captureOnCommitCallbacks(execute=True):
+            summary.save()
+        response = self.client.get("/api/account-summaries/")
+        self.assertEqual(response.data["results"][0]["margin"], "20.00")
+
+
+class HistoryPaginationTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(email="trader@example.com", password="password123")
+        self.deposits = [Deposit.objects.create(user=self.user, amount=Decimal(i + 1)) for i in range(25)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_cursor_pages_walk_the_whole_history(self):
+        ids = []
+        url = "/api/deposits/?page_size=10"
+        while url:
+            response = self.client.get(url)
+            self.assertNotIn("count", response.data)
+            ids += [row["id"] for row in response.data["results"]]
+            url = response.data["next"]
+
+        expected = sorted(self.deposits, key=lambda deposit: (deposit.timestamp, deposit.id), reverse=True)
+        self.assertEqual(ids, [deposit.id for deposit in expected])
+
+    @override_settings(MAX_PAGE_SIZE=10)
+    def test_count_is_opt_in_and_page_size_is_capped(self):
+        response = self.client.get("/api/deposits/?with_count=true&page_size=1000")
+        self.assertEqual(response.data["count"], 25)
+        self.assertEqual(len(response.data["results"]), 10)
+
+        response = self.client.get("/api/deposits/?page_size=5")
+        self.assertEqual(len(response.data["results"]), 5)
+
+
+class TimestampRangeFilterTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(email="trader@example.com", password="password123")
+        tz = timezone.get_current_timezone()
+        self.times = [
+            datetime.datetime(2025, 1, 31, 23, 30, tzinfo=tz),
+            datetime.datetime(2025, 2, 1, 0, 30, tzinfo=tz),
+            datetime.datetime(2025, 2, 14, 12, 0, tzinfo=tz),
+            datetime.datetime(2026, 1, 1, 0, 0, tzinfo=tz),
+        ]
+        for i, moment in enumerate(self.times):
+            deposit = Deposit.objects.create(user=self.user, amount=Decimal(10 * (i + 1)))
+            # timestamp is auto_now_add, set it afterwards
+            Deposit.objects.filter(pk=deposit.pk).update(timestamp=moment)
+
+    def filtered(self, **params):
+        queryset = Deposit.objects.filter(user=self.user)
+        return list(DepositFilter(params, queryset=queryset).qs.order_by("timestamp").values_list("timestamp", flat=True))
+
+    def test_calendar_parameters_are_local_time_ranges(self):
+        self.assertEqual(self.filtered(year=2025), self.times[:3])
+        self.assertEqual(self.filtered(year=2025, month=2), self.times[1:3])
+        self.assertEqual(self.filtered(year=2025, month=1, day=31), self.times[:1])
+        self.assertEqual(self.filtered(year=2025, month=12), [])
+        self.assertEqual(self.filtered(year=2025, month=2, day=30), [])
+
+    def test_from_to_and_amount_filters(self):
+        self.assertEqual(self.filtered(**{"from": "2025-02-01", "to": "2026-01-01"}), self.times[1:3])
+        self.assertEqual(self.filtered(amount_min=20, amount_max=30), self.times[1:3])
+
+    @skipUnless(connection.vendor == "sqlite", "query plans are checked with sqlite's EXPLAIN QUERY PLAN")
+    def test_calendar_filter_uses_index(self):
+        queryset = DepositFilter({"year": 2025, "month": 2}, queryset=Deposit.objects.filter(user=self.user)).qs
+        self.assertNotIn("extract", str(queryset.query).lower())
+        self.assertIn("deposit_user_ts_idx", queryset.order_by("-timestamp", "-id").explain())
+
+
+class StatementTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(email="trader@example.com", password="password123")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        tz = timezone.get_current_timezone()
+        rows = [
+            (Deposit, "100.00", True, datetime.datetime(2025, 3, 1, 9, 0, tzinfo=tz)),
+            (Deposit, "50.00", False, datetime.datetime(2025, 3, 1, 18, 0, tzinfo=tz)),
+            (Withdrawal, "30.00", True, datetime.datetime(2025, 3, 1, 20, 0, tzinfo=tz)),
+            (Deposit, "20.00", True, datetime.datetime(2025, 3, 9, 9, 0, tzinfo=tz)),
+        ]
+        for model, amount, is_verified, moment in rows:
+            row = model.objects.create(user=self.user, amount=Decimal(amount))
+            model.objects.filter(pk=row.pk).update(is_verified=is_verified, timestamp=moment)
+
+    def test_daily_statement(self):
+        with self.assertNumQueries(2):
+            response = self.client.get("/api/statement/?period=day")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 2)
+        first = response.data[0]
+        self.assertEqual(first["deposits_verified"], "100.00")
+        self.assertEqual(first["deposits_pending"], "50.00")
+        self.assertEqual(first["deposits_pending_count"], 1)
+        self.assertEqual(first["withdrawals_verified"], "30.00")
+        self.assertEqual(first["net_flow"], "70.00")
+
+    def test_monthly_statement_within_range(self):
+        response = self.client.get("/api/statement/", {"period": "month", "to": "2025-03-05T00:00:00"})
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(response.data[0]["deposits_verified_count"], 1)
+        self.assertEqual(response.data[0]["net_flow"], "70.00")
+
+    def test_invalid_period(self):
+        self.assertEqual(self.client.get("/api/statement/?period=year").status_code, 400)
+
+
+@mock.patch("base.db_router.replica_alias", return_value="replica")
+class ReplicaRoutingTests(TestCase):
+    """
+    the routing decisions are recorded but every query still runs on the test database,
+    a sqlite mirror can't read rows the test transaction hasn't committed
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email="trader@example.com", password="password123")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def read_aliases(self, method, url, data=None):
+        """the databases the router picked for reads during the request"""
+        aliases = set()
+        db_for_read = ReplicaRouter.db_for_read
+
+        def record(router, model, **hints):
+            aliases.add(db_for_read(router, model, **hints))
+            return "default"
+
+        with mock.patch.object(ReplicaRouter, "db_for_read", record):
+            response = getattr(self.client, method)(url, data, format="json")
+        return response, aliases
+
+    def test_reads_go_to_replica_only_inside_use_replica(self, replica_alias):
+        router = ReplicaRouter()
+        self.assertEqual(router.db_for_read(Deposit), "default")
+        with use_replica():
+            self.assertEqual(router.db_for_read(Deposit), "replica")
+            self.assertEqual(router.db_for_write(Deposit), "default")
+
+    def test_pinned_user_reads_from_primary(self, replica_alias):
+        pin_to_primary(self.user.pk)
+        with use_replica(self.user.pk):
+            self.assertEqual(ReplicaRouter().db_for_read(Deposit), "default")
+
+    def test_list_reads_from_replica_until_the_user_writes(self, replica_alias):
+        response, aliases = self.read_aliases("get", "/api/deposits/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(aliases, {"replica"})
+
+        response, aliases = self.read_aliases("post", "/api/deposits/", {"amount": "10.00"})
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn("replica", aliases)
+
+        response, aliases = self.read_aliases("get", "/api/deposits/")
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertEqual(aliases, {"default"})
+
+    def test_verify_stays_on_primary(self, replica_alias):
+        staff = User.objects.create_user(email="staff@example.com", password="password123", is_staff=True)
+        deposit = Deposit.objects.create(user=staff, amount=Decimal("10.00"))
+        self.client.force_authenticate(staff)
+
+        response, aliases = self.read_aliases("get", f"/api/deposits/{deposit.pk}/verify/")
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("replica", aliases)
+
+
+class AsyncViewTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email="trader@example.com", password="password123")
+        self.headers = {"Authorization": f"JWT {AccessToken.for_user(self.user)}"}
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    async def test_balance_matches_sync_view(self):
+        await Balance.objects.acreate(user=self.user, amount=Decimal("25.00"))
+
+        response = await self.async_client.get("/api/async/balance/", headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]["amount"], "25.00")
+
+        # both views share the snapshot in the cache
+        await cache.aclear()
+        sync_response = await self.sync_get("/api/balance/")
+        self.assertEqual(response.json(), sync_response.json())
+
+    async def test_account_summary_matches_sync_view(self):
+        await AccountSummary.objects.acreate(user=self.user, margin=Decimal("10.00"))
+
+        response = await self.async_client.get("/api/async/account-summaries/", headers=self.headers)
+        await cache.aclear()
+        self.assertEqual(response.json(), (await self.sync_get("/api/account-summaries/")).json())
+        self.assertEqual(response.json()["count"], 1)
+
+    async def test_token_is_required(self):
+        response = await self.async_client.get("/api/async/balance/")
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response["WWW-Authenticate"], 'JWT realm="api"')
+
+        response = await self.async_client.get("/api/async/balance/", headers={"Authorization": "JWT invalid"})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()["code"], "token_not_valid")
+
+    async def sync_get(self, url):
+        return await sync_to_async(self.client.get)(url)
+
+
+@enforce_query_budgets
+class RequestMetricsTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email="trader@example.com", password="password123", is_staff=True)
+        Balance.objects.create(user=self.user, amount=Decimal("100.00"))
+        self.deposit = Deposit.objects.create(user=self.user, amount=Decimal("10.00"))
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"JWT {AccessToken.for_user(self.user)}")
+
+    def test_endpoints_stay_within_their_query_budgets(self):
+        withdrawal = Withdrawal.objects.create(user=self.user, amount=Decimal("1.00"))
+        with capture_requests() as requests:
+            self.client.get("/api/deposits/")
+            self.client.get(f"/api/deposits/{self.deposit.pk}/")
+            self.client.post("/api/deposits/", {"amount": "5.00"})
+            self.client.patch(f"/api/deposits/{self.deposit.pk}/", {"amount": "7.00"})
+            self.client.get(f"/api/deposits/{self.deposit.pk}/verify/")
+            self.client.delete(f"/api/deposits/{self.deposit.pk}/")
+            self.client.get("/api/withdrawals/")
+            self.client.get(f"/api/withdrawals/{withdrawal.pk}/verify/")
+            self.client.get("/api/balance/")
+            self.client.get("/api/account-summaries/")
+            self.client.get("/api/statement/")
+        self.assertTrue(all(metrics.budget is not None for metrics in requests))
+
+    def test_first_deposit_stays_within_its_query_budgets(self):
+        # no Balance or AccountSummary yet: create makes the Balance in validation, verify makes both when
+        # the deposit didn't come through the api (admin)
+        first, second = [User.objects.create_user(email=f"new{i}@example.com", password="password123", is_staff=True)
+                         for i in range(2)]
+        deposit = Deposit.objects.create(user=second, amount=Decimal("5.00"))
+        with capture_requests() as requests:
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION=f"JWT {AccessToken.for_user(first)}")
+            client.post("/api/deposits/", {"amount": "5.00"})
+            client.credentials(HTTP_AUTHORIZATION=f"JWT {AccessToken.for_user(second)}")
+            client.get(f"/api/deposits/{deposit.pk}/verify/")
+        self.assertEqual([metrics.status for metrics in requests], [201, 200])
+        self.assertEqual(Balance.objects.get(user=second).amount, Decimal("5.00"))
+
+    def test_going_over_budget_fails(self):
+        with mock.patch.object(DepositViewSet, "query_budgets", {"list": 0}):
+            with self.assertRaisesMessage(QueryBudgetExceeded, "DepositViewSet.list ran 2 queries, its budget is 0"):
+                self.client.get("/api/deposits/")
+
+    @override_settings(METRICS_SERVER_TIMING=True)
+    def test_metrics_are_tagged_logged_and_sent(self):
+        with capture_requests() as requests, self.assertLogs("base.metrics", "INFO") as logs:
+            response = self.client.get("/api/deposits/")
+
+        metrics = requests[0]
+        self.assertEqual(metrics.endpoint, "DepositViewSet.list")
+        self.assertEqual(metrics.queries, 2)
+        self.assertGreater(metrics.spans["serializer"], 0)
+        self.assertGreater(metrics.spans["render"], 0)
+        self.assertEqual(logs.records[0].metrics["endpoint"], "DepositViewSet.list")
+        self.assertIn('db;dur=', response["Server-Timing"])
+        self.assertIn('desc="2 queries"', response["Server-Timing"])
@@ -1,13 +1,17 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import DepositViewSet, WithdrawalViewSet, BalanceViewSet, AccountSummaryViewSet
+from .views import (DepositViewSet, WithdrawalViewSet, BalanceViewSet, AccountSummaryViewSet, StatementViewSet,
+                    balance_async, account_summaries_async)
 
 router = DefaultRouter()
 router.register('deposits', DepositViewSet, basename='deposits')
 router.register('withdrawals', WithdrawalViewSet, basename='withdrawals')
 router.register('balance', BalanceViewSet, basename='balance')
 router.register('account-summaries', AccountSummaryViewSet, basename='account-summaries')
+router.register('statement', StatementViewSet, basename='statement')
 
 urlpatterns = [
+    path('async/balance/', balance_async, name='balance_async'),
+    path('async/account-summaries/', account_summaries_async, name='account_summaries_async'),
     path('', include(router.urls)),
 ]
@@ -1,3 +1,4 @@
+import logging
 from django.shortcuts import render
 from rest_framework import viewsets, serializers
 from rest_framework.response import Response
@@ -6,18 +7,35 @@ from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from django_filters.rest_framework import DjangoFilterBackend
 from django.db import transaction
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET
 from transactions.models import Deposit, Withdrawal, Balance, AccountSummary
-from .serializers import DepositSerializer, WithdrawalSerializer, BalanceSerializer, AccountSummarySerializer
+from transactions import ledger
+from transactions.cache import get_snapshot, aget_snapshot, balance_key, account_summary_key
+from transactions.pagination import TimestampCursorPagination
+from transactions.statements import build_statement
+from drf_yasg.utils import swagger_auto_schema
+from base.db_router import ReplicaReadMixin
+from authentication.authentication import jwt_authenticated
+from .serializers import (DepositSerializer, WithdrawalSerializer, BalanceSerializer, AccountSummarySerializer,
+                          StatementQuerySerializer, StatementSerializer)
 from .filters import DepositFilter, WithdrawalFilter
-from decimal import Decimal
 from .permissions import IsOwner, IsAdminOrReadOnly
 
+logger = logging.getLogger(__name__)
 
-class DepositViewSet(viewsets.ModelViewSet):
+
+class DepositViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
+    # queries per action (base.metrics), including the one loading the request's user
+    # (CachedJWTAuthentication saves it on most requests in production). create and verify cover a
+    # user's first deposit, where the Balance and AccountSummary rows get created
+    query_budgets = {'list': 2, 'retrieve': 3, 'create': 9, 'update': 6, 'partial_update': 6, 'destroy': 9,
+                     'verify': 12}
     serializer_class = DepositSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_class = DepositFilter
     permission_classes = [IsOwner]
+    pagination_class = TimestampCursorPagination
 
     def get_queryset(self):
         if getattr(self, 'swagger_fake_view', False) or self.request.user.is_anonymous:
@@ -25,20 +43,18 @@ class DepositViewSet(viewsets.ModelViewSet):
         return Deposit.objects.filter(user=self.request.user)
 
     def perform_create(self, serializer):
-        print("Performing create for deposit")
         try:
             deposit = serializer.save(user=self.request.user)
-            print(f"Deposit created: {deposit}")
+            logger.info("deposit %s created by %s", deposit.pk, self.request.user.pk)
 
         except serializers.ValidationError as e:
-            print(f"Validation errors: {e.detail}")
+            logger.info("deposit validation errors: %s", e.detail)
             return Response(e.detail, status=400)
 
     def update(self, request, *args, **kwargs):
         """overrides defaults update method
         only works when deposit is unverified(is_verified=False)"""
 
-        print("Performing update for deposit")
         try:
             instance = self.get_object()
             old_verified = instance.is_verified
@@ -53,16 +69,15 @@ class DepositViewSet(viewsets.ModelViewSet):
                 instance, data=request.data, partial=partial)
             if serializer.is_valid():
                 serializer.save(user=self.request.user)
-                print(
-                    f"Deposit updated: {serializer.data}, Verified: {serializer.data.get('is_verified')}")
+                logger.info("deposit %s updated", instance.pk)
                 return Response(serializer.data, status=status.HTTP_200_OK)
 
         except serializers.ValidationError as e:
-            print(f"Validation errors: {e.detail}")
+            logger.info("deposit validation errors: %s", e.detail)
             return Response(e.detail, status=status.HTTP_400_BAD_REQUEST)
 
         except Exception as e:
-            print(f"Unexpected error during update: {str(e)}")
+            logger.exception("unexpected error during deposit update")
             return Response(
                 {"detail": "An unexpected error occurred."},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -84,11 +99,9 @@ class DepositViewSet(viewsets.ModelViewSet):
                             {"detail": "You can't delete an already verified deposit."},
                             status=status.HTTP_403_FORBIDDEN,
                         )
-                    balance = Balance.objects.get(user=instance.user)
-                    balance.amount -= Decimal(instance.amount)
-                    balance.save()
-                    print(
-                        f"Balance updated by subtracting {instance.amount}. New balance: {balance.amount}, Deleted by: {request.user.email}")
+                    entry = ledger.reverse_deposit(instance)
+                    logger.info("verified deposit %s of %s deleted by %s, new balance %s",
+                                instance.pk, instance.amount, request.user.pk, entry.balance_after)
 
                 # Delete the deposit
                 instance.delete()
@@ -98,7 +111,7 @@ class DepositViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_204_NO_CONTENT,
                 )
         except Exception as e:
-            print(f"Error during deposit deletion: {e}")
+            logger.exception("error during deposit deletion")
             return Response(e, status=status.HTTP_400_BAD_REQUEST)
 
     @action(detail=True, methods=['GET'], permission_classes=[IsAdminUser])
@@ -107,40 +120,36 @@ class DepositViewSet(viewsets.ModelViewSet):
         try:
             with transaction.atomic():
                 deposit = self.get_object()
-                if deposit.is_verified:
+
+                # make deposit verified, only one of concurrent verifications can win
+                entry = ledger.verify_deposit(deposit)
+                if entry is None:
                     return Response(
                         data={"message": "Deposit is already verified!"},
                         status=status.HTTP_400_BAD_REQUEST
                     )
-
-                # make deposit verified
-                deposit.is_verified = True
-                deposit.save()
-                print(
-                    f"Deposit verified successfully amount: {deposit.amount}")
-
-                balance, created = Balance.objects.get_or_create(
-                    user=deposit.user)
-                balance.amount += Decimal(deposit.amount)
-                balance.save()
-                print(
-                    f"Balance updated successfully new amount {deposit.amount},first time depositing:{created}")
+                logger.info("deposit %s of %s verified", deposit.pk, deposit.amount)
 
                 return Response(
                     data={"message": "Deposit verified successfully",
-                          "new balance": balance.amount},
+                          "new balance": entry.balance_after},
                     status=status.HTTP_200_OK
                 )
         except Exception as e:
-            print(f"Deposit not verified: {e}")
+            logger.exception("deposit not verified")
             return Response(e, status=status.HTTP_400_BAD_REQUEST)
 
 
-class WithdrawalViewSet(viewsets.ModelViewSet):
+class WithdrawalViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
+    # queries per action (base.metrics), including the one loading the request's user
+    # (CachedJWTAuthentication saves it on most requests in production)
+    query_budgets = {'list': 2, 'retrieve': 3, 'create': 3, 'update': 6, 'partial_update': 6, 'destroy': 9,
+                     'verify': 7}
     serializer_class = WithdrawalSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_class = WithdrawalFilter
     permission_classes = [IsOwner]
+    pagination_class = TimestampCursorPagination
 
     def get_queryset(self):
         if getattr(self, 'swagger_fake_view', False) or self.request.user.is_anonymous:
@@ -171,14 +180,14 @@ class WithdrawalViewSet(viewsets.ModelViewSet):
                 instance, data=request.data, partial=partial)
             if serializer.is_valid():
                 serializer.save(user=self.request.user)
-                print(f"Withdrawal updated: {serializer.data}")
+                logger.info("withdrawal %s updated", instance.pk)
                 return Response(serializer.data, status=status.HTTP_200_OK)
 
         except serializers.ValidationError as e:
             return Response(e.detail, status=status.HTTP_400_BAD_REQUEST)
 
         except Exception as e:
-            print(f"Unexpected error during withdrawal update: {str(e)}")
+            logger.exception("unexpected error during withdrawal update")
             return Response(
                 {"detail": "An unexpected error occurred."},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -201,9 +210,7 @@ class WithdrawalViewSet(viewsets.ModelViewSet):
                             {"detail": "You can't delete an already verified withdrawal."},
                             status=status.HTTP_403_FORBIDDEN,
                         )
-                    balance = Balance.objects.get(user=instance.user)
-                    balance.amount += Decimal(instance.amount)
-                    balance.save()
+                    ledger.reverse_withdrawal(instance)
 
                 # Delete the deposit
                 instance.delete()
@@ -213,7 +220,7 @@ class WithdrawalViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_204_NO_CONTENT,
                 )
         except Exception as e:
-            print(f"Error during withdrawal deletion: {e}")
+            logger.exception("error during withdrawal deletion")
             return Response(e, status=status.HTTP_400_BAD_REQUEST)
 
     @action(detail=True, methods=['GET'], permission_classes=[IsAdminUser])
@@ -222,33 +229,29 @@ class WithdrawalViewSet(viewsets.ModelViewSet):
         try:
             with transaction.atomic():
                 withdrawal = self.get_object()
-                if withdrawal.is_verified:
+
+                # make withdrawal verified, only one of concurrent verifications can win
+                entry = ledger.verify_withdrawal(withdrawal)
+                if entry is None:
                     return Response(
                         data={"message": "Deposit is initially verified!"},
                         status=status.HTTP_400_BAD_REQUEST
                     )
 
-                # make deposit verified
-                withdrawal.is_verified = True
-                withdrawal.save()
-
-                balance = Balance.objects.get(user=withdrawal.user)
-                balance.amount -= Decimal(withdrawal.amount)
-                balance.save()
-
                 return Response(
                     data={"message": "Withdrawal verified successfully",
                           "verified amount to be withdraw": withdrawal.amount,
-                          "new balance": balance.amount},
+                          "new balance": entry.balance_after},
 
                     status=status.HTTP_200_OK
                 )
         except Exception as e:
-            print(f"Error during withdrawal verification: {e}")
+            logger.exception("error during withdrawal verification")
             return Response(e, status=status.HTTP_400_BAD_REQUEST)
 
 
 class BalanceViewSet(viewsets.ReadOnlyModelViewSet):
+    query_budgets = {'list': 2}
     serializer_class = BalanceSerializer
     permission_classes = [IsAuthenticated]
 
@@ -258,12 +261,13 @@ class BalanceViewSet(viewsets.ReadOnlyModelViewSet):
         return Balance.objects.filter(user=self.request.user)
 
     def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
-        if queryset.exists():
-            serializer = self.get_serializer(queryset, many=True)
-            return Response(serializer.data)
-        else:
-            return Response({"id": None, "user": request.user.id, "amount": 0})
+        """served from the per-user cache, invalidated whenever the balance changes"""
+
+        def build():
+            data = list(self.get_serializer(self.get_queryset(), many=True).data)
+            return data or {"id": None, "user": request.user.id, "amount": 0}
+
+        return Response(get_snapshot(balance_key(request.user.id), build))
 
 
 class AccountSummaryViewSet(viewsets.ReadOnlyModelViewSet):
@@ -272,6 +276,7 @@ class AccountSummaryViewSet(viewsets.ReadOnlyModelViewSet):
     profit_loss, opened_position 
     """
 
+    query_budgets = {'list': 2}
     serializer_class = AccountSummarySerializer
     # permission_classes = (IsAdminOrReadOnly,)
 
@@ -279,3 +284,69 @@ class AccountSummaryViewSet(viewsets.ReadOnlyModelViewSet):
         if getattr(self, 'swagger_fake_view', False) or self.request.user.is_anonymous:
             return AccountSummary.objects.none()
         return AccountSummary.objects.filter(user=self.request.user)
+
+    def list(self, request, *args, **kwargs):
+        """
+        served from the per-user cache, a user has at most one summary
+        so the whole list fits on the first page
+        """
+        if request.user.is_anonymous:
+            return super().list(request, *args, **kwargs)
+
+        def build():
+            results = list(self.get_serializer(self.get_queryset(), many=True).data)
+            return {"count": len(results), "next": None, "previous": None, "results": results}
+
+        return Response(get_snapshot(account_summary_key(request.user.id), build))
+
+
+class StatementViewSet(ReplicaReadMixin, viewsets.ViewSet):
+    """
+    Account statement of the user: verified and pending deposit/withdrawal totals,
+    counts and net flow per day, week or month, computed by the database in one go
+    """
+    permission_classes = [IsAuthenticated]
+    query_budgets = {'list': 3}
+
+    @swagger_auto_schema(query_serializer=StatementQuerySerializer,
+                         responses={200: StatementSerializer(many=True)})
+    def list(self, request):
+        query = StatementQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+
+        statement = build_statement(
+            request.user,
+            period=query.validated_data['period'],
+            start=query.validated_data.get('from'),
+            end=query.validated_data.get('to'),
+        )
+        return Response(StatementSerializer(statement, many=True).data)
+
+
+# async versions of the most polled endpoints, under ASGI they don't hold a worker thread while waiting
+# on the cache or the database. same responses and cache entries as BalanceViewSet/AccountSummaryViewSet.list
+
+@require_GET
+@jwt_authenticated
+async def balance_async(request):
+    user_id = request.user.id
+
+    async def build():
+        balances = [balance async for balance in Balance.objects.filter(user_id=user_id)]
+        data = list(BalanceSerializer(balances, many=True).data)
+        return data or {"id": None, "user": user_id, "amount": 0}
+
+    return JsonResponse(await aget_snapshot(balance_key(user_id), build), safe=False)
+
+
+@require_GET
+@jwt_authenticated
+async def account_summaries_async(request):
+    user_id = request.user.id
+
+    async def build():
+        summary = await AccountSummary.objects.filter(user_id=user_id).afirst()
+        results = [AccountSummarySerializer(summary).data] if summary else []
+        return {"count": len(results), "next": None, "previous": None, "results": results}
+
+    return JsonResponse(await aget_snapshot(account_summary_key(user_id), build))
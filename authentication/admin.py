@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import NameChangeRequest, EmailChangeRequest, ForgotPasswordRequest, PasswordChangeRequest, User
+from .models import NameChangeRequest, EmailChangeRequest, ForgotPasswordRequest, PasswordChangeRequest, User, OutboundEmail, \
+    OneTimePassword
 from django.contrib.auth.admin import UserAdmin as DefaultUserAdmin
 
 admin.site.register(NameChangeRequest)
@@ -8,6 +9,25 @@ admin.site.register(ForgotPasswordRequest)
 admin.site.register(PasswordChangeRequest)
 
 
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ('id', 'subject', 'recipients', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('status',)
+    list_per_page = 10
+    readonly_fields = ('created_at', 'sent_at')
+    # a pending body may hold a one time password
+    exclude = ('message',)
+
+
+@admin.register(OneTimePassword)
+class OneTimePasswordAdmin(admin.ModelAdmin):
+    list_display = ('user', 'purpose', 'attempts', 'expires_at', 'created_at')
+    list_filter = ('purpose',)
+    list_per_page = 10
+    # only the hash of the code is stored, nothing here is worth editing
+    readonly_fields = ('user', 'purpose', 'code_hash', 'attempts', 'expires_at', 'created_at')
+
+
 # custom user
 
 @admin.register(User)
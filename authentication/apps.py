@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class AuthenticationConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'authentication'
+
+    def ready(self):
+        from django.conf import settings
+
+        # optional in-process reaper, for deployments without a scheduler for reap_expired_requests
+        if settings.REAPER_INTERVAL:
+            from django.core.signals import request_started
+            from .reaper import start_reaper, DISPATCH_UID
+            request_started.connect(start_reaper, dispatch_uid=DISPATCH_UID)
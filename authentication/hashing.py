@@ -0,0 +1,64 @@
+"""
+Password hashing on a bounded pool of worker threads.
+
+hashing is deliberately slow, so at most PASSWORD_HASHING_WORKERS hashes run at once (the hash
+functions release the GIL, so that many cores are used) and at most PASSWORD_HASHING_QUEUE more
+wait for a worker. past that the request is refused with a 503 straight away, a burst of logins
+can't tie up every request thread of the process waiting on hashes.
+views should run their cheap checks (the user exists, is verified, throttles) before calling these.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class HashingBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many sign ins in progress, try again shortly.'
+    default_code = 'hashing_busy'
+
+
+_pool = None
+_slots = None
+_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool, _slots
+    with _lock:
+        if _pool is None:
+            workers = settings.PASSWORD_HASHING_WORKERS
+            _pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hashing")
+            _slots = threading.BoundedSemaphore(workers + settings.PASSWORD_HASHING_QUEUE)
+        return _pool, _slots
+
+
+def run(func, *args):
+    """func(*args) on the hashing pool, raises HashingBusy when the pool and its queue are full"""
+    pool, slots = _get_pool()
+    if not slots.acquire(blocking=False):
+        raise HashingBusy()
+    try:
+        return pool.submit(func, *args).result()
+    finally:
+        slots.release()
+
+
+def make_password(password):
+    return run(hashers.make_password, password)
+
+
+def check_password(user, password):
+    """
+    user.check_password on the pool. when the stored hash was made with another hasher or other
+    parameters than the current profile it is replaced, like Django does on login
+    """
+    is_correct, must_update = run(hashers.verify_password, password, user.password)
+    if is_correct and must_update:
+        user.password = make_password(password)
+        user.save(update_fields=["password"])
+    return is_correct
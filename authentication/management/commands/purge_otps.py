@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from authentication.otp import get_store
+
+
+class Command(BaseCommand):
+    help = "Delete expired one time passwords, run it periodically when OTP_BACKEND is db"
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"purged: {get_store().purge()}")
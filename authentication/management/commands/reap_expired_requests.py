@@ -0,0 +1,26 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from authentication.reaper import reap_expired
+
+
+class Command(BaseCommand):
+    help = ("Delete abandoned change requests, expired one time passwords and expired refresh tokens "
+            "in bounded batches, pass --loop to keep running")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=None,
+                            help="rows deleted per statement (default: REAPER_BATCH_SIZE)")
+        parser.add_argument("--loop", action="store_true", help="keep running")
+        parser.add_argument("--interval", type=float, default=3600, help="seconds between runs (with --loop)")
+
+    def handle(self, *args, **options):
+        while True:
+            for name, count in reap_expired(options["batch_size"]).items():
+                self.stdout.write(f"{name}: {count}")
+
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from authentication.utils import send_queued_mail
+
+
+class Command(BaseCommand):
+    help = "Send queued outbound mail in batches, pass --loop to keep draining the queue"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=None,
+                            help="mails sent per connection (default: MAIL_QUEUE_BATCH_SIZE)")
+        parser.add_argument("--loop", action="store_true", help="keep running and poll the queue")
+        parser.add_argument("--interval", type=float, default=5,
+                            help="seconds to sleep when the queue is empty (with --loop)")
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = send_queued_mail(options["batch_size"])
+            if sent or failed:
+                self.stdout.write(f"sent: {sent}, failed: {failed}")
+
+            if not options["loop"]:
+                break
+            # only wait when nothing was due, otherwise go straight to the next batch
+            if not sent and not failed:
+                time.sleep(options["interval"])
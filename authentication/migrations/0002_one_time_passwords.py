@@ -0,0 +1,55 @@
+# Generated by Django 5.1.6 on 2026-10-18 14:24
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='emailchangerequest',
+            name='otp',
+        ),
+        migrations.RemoveField(
+            model_name='forgotpasswordrequest',
+            name='otp',
+        ),
+        migrations.RemoveField(
+            model_name='namechangerequest',
+            name='otp',
+        ),
+        migrations.RemoveField(
+            model_name='passwordchangerequest',
+            name='otp',
+        ),
+        migrations.RemoveField(
+            model_name='user',
+            name='otp',
+        ),
+        migrations.RemoveField(
+            model_name='user',
+            name='otp_created_at',
+        ),
+        migrations.CreateModel(
+            name='OneTimePassword',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('purpose', models.CharField(choices=[('signup', 'Signup'), ('password_reset', 'Password reset'), ('password_change', 'Password change'), ('email_change', 'Email change')], max_length=20)),
+                ('code_hash', models.CharField(max_length=64)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('expires_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='one_time_passwords', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['expires_at'], name='otp_expires_at_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'purpose'), name='unique_otp_per_user_purpose')],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.6 on 2026-10-18 14:28
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0002_one_time_passwords'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Principal',
+            fields=[
+            ],
+            options={
+                'proxy': True,
+                'indexes': [],
+                'constraints': [],
+            },
+            bases=('authentication.user',),
+        ),
+    ]
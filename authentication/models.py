@@ -2,6 +2,10 @@ from django.db import models
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.conf import settings
+from django.utils import timezone
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from .principals import invalidate_principals, INVALIDATING_FIELDS
 
 
 class NameChangeRequest(models.Model):
@@ -9,7 +13,6 @@ class NameChangeRequest(models.Model):
     new_first_name = models.CharField(max_length=150, null=True, blank=True)
     new_last_name = models.CharField(max_length=150, null=True, blank=True)
     new_phone_number = models.CharField(max_length=150, null=True, blank=True)
-    otp = models.IntegerField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -19,7 +22,6 @@ class NameChangeRequest(models.Model):
 class EmailChangeRequest(models.Model):
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="email_change_request")
     new_email = models.EmailField(unique=True)
-    otp = models.IntegerField()
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -28,7 +30,6 @@ class EmailChangeRequest(models.Model):
 
 class ForgotPasswordRequest(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
-    otp = models.IntegerField(null=True, blank=True)
     new_password = models.CharField(max_length=128, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -38,7 +39,6 @@ class ForgotPasswordRequest(models.Model):
 
 class PasswordChangeRequest(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='password_change_requests')
-    otp = models.CharField(max_length=6)
     new_password = models.CharField(max_length=128)  # To securely store hashed password
     created_at = models.DateTimeField(auto_now_add=True)
     is_verified = models.BooleanField(default=False)
@@ -47,9 +47,83 @@ class PasswordChangeRequest(models.Model):
         return f"Password change request for {self.user.username}"
 
 
+class OneTimePassword(models.Model):
+    """
+    The pending OTP of a user for one purpose, only the HMAC of the code is stored.
+    used by authentication.otp when OTP_BACKEND is "db", expired rows are removed by purge_otps
+    """
+
+    class Purpose(models.TextChoices):
+        SIGNUP = "signup", "Signup"
+        PASSWORD_RESET = "password_reset", "Password reset"
+        PASSWORD_CHANGE = "password_change", "Password change"
+        EMAIL_CHANGE = "email_change", "Email change"
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="one_time_passwords")
+    purpose = models.CharField(max_length=20, choices=Purpose.choices)
+    code_hash = models.CharField(max_length=64)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "purpose"], name="unique_otp_per_user_purpose"),
+        ]
+        indexes = [
+            models.Index(fields=["expires_at"], name="otp_expires_at_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.get_purpose_display()} OTP for user {self.user_id}"
+
+
+class OutboundEmail(models.Model):
+    """
+    Mail waiting to be sent by the send_queued_mail worker,
+    request handlers only insert rows here instead of talking to the mail server
+    """
+
+    class Status(models.TextChoices):
+        PENDING = "pending", "Pending"
+        # claimed by a worker until next_attempt_at
+        SENDING = "sending", "Sending"
+        SENT = "sent", "Sent"
+        FAILED = "failed", "Failed"
+
+    subject = models.CharField(max_length=255)
+    message = models.TextField()
+    from_email = models.CharField(max_length=254, null=True, blank=True)
+    recipients = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ("next_attempt_at", "id")
+
+    def __str__(self):
+        return f"{self.subject} to {', '.join(self.recipients)} ({self.status})"
+
+
 # customuser models
 
-class UserManager(BaseUserManager):
+class UserQuerySet(models.QuerySet):
+
+    def update(self, **kwargs):
+        """like User.save, changing a field the cached principals hold makes them stale"""
+        if not INVALIDATING_FIELDS & kwargs.keys():
+            return super().update(**kwargs)
+        user_ids = list(self.values_list("pk", flat=True))
+        rows = super().update(**kwargs)
+        invalidate_principals(*user_ids)
+        return rows
+
+
+class UserManager(BaseUserManager.from_queryset(UserQuerySet)):
     """
     Custom manager for the User model where email is the unique identifier.
     """
@@ -97,8 +171,6 @@ class User(AbstractUser):
     email = models.EmailField(unique=True)
     is_verified = models.BooleanField(default=False)
     phone_number = models.CharField(max_length=15, blank=True, null=True)
-    otp = models.IntegerField(null=True)
-    otp_created_at = models.DateTimeField(auto_now_add=True)
     USERNAME_FIELD = 'email'  # Use email as the unique identifier
     REQUIRED_FIELDS = []  # No additional required fields
 
@@ -113,3 +185,31 @@ class User(AbstractUser):
 
     def __str__(self):
         return self.email
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # the cached principals hold is_staff, is_active... see CachedJWTAuthentication
+        invalidate_principals(self.pk)
+
+
+class Principal(User):
+    """
+    The user of a request authenticated by CachedJWTAuthentication, only PRINCIPAL_FIELDS are loaded.
+    reading any other field loads the rest of the row in one query
+    """
+
+    class Meta:
+        proxy = True
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        deferred = self.get_deferred_fields()
+        if fields is not None and deferred.issuperset(fields):
+            fields = deferred
+        super().refresh_from_db(using, fields, from_queryset)
+
+
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Principal)
+def forget_deleted_user(sender, instance, **kwargs):
+    # also sent for each row of a queryset delete
+    invalidate_principals(instance.pk)
@@ -0,0 +1,148 @@
+"""
+One time passwords for signup, password reset/change and email change.
+
+a user has at most one pending code per purpose, issuing a new one replaces it.
+only an HMAC of the code is stored and verification consumes it in one atomic step
+(a conditional DELETE, or deleting the code's own cache key), so a code can't be used twice.
+wrong guesses are counted and the code stops working after OTP_MAX_ATTEMPTS of them.
+
+the store is chosen with OTP_BACKEND: "db" (OneTimePassword table) or "cache".
+"""
+import hashlib
+import hmac
+import secrets
+import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction, IntegrityError
+from django.db.models import F
+from django.utils import timezone
+
+from .models import OneTimePassword
+
+Purpose = OneTimePassword.Purpose
+
+# verify_otp results
+VALID = "valid"
+INVALID = "invalid"
+EXPIRED = "expired"  # expired, used up, replaced or never issued
+
+
+def generate_code():
+    return f"{secrets.randbelow(10 ** 6):06d}"
+
+
+def hash_code(user_id, purpose, code):
+    message = f"{purpose}:{user_id}:{str(code).strip()}".encode()
+    return hmac.new(settings.SECRET_KEY.encode(), message, hashlib.sha256).hexdigest()
+
+
+class DatabaseOTPStore:
+
+    def issue(self, user_id, purpose, code_hash):
+        changes = {
+            "code_hash": code_hash,
+            "attempts": 0,
+            "expires_at": timezone.now() + datetime.timedelta(seconds=settings.OTP_TTL),
+        }
+        pending = OneTimePassword.objects.filter(user_id=user_id, purpose=purpose)
+        if not pending.update(**changes):
+            try:
+                with transaction.atomic():
+                    OneTimePassword.objects.create(user_id=user_id, purpose=purpose, **changes)
+            except IntegrityError:
+                # a concurrent request issued one first, replace it
+                pending.update(**changes)
+
+    def verify(self, user_id, purpose, code_hash):
+        usable = OneTimePassword.objects.filter(user_id=user_id, purpose=purpose, expires_at__gt=timezone.now(),
+                                                attempts__lt=settings.OTP_MAX_ATTEMPTS)
+        deleted, _ = usable.filter(code_hash=code_hash).delete()
+        if deleted:
+            return VALID
+        if usable.update(attempts=F("attempts") + 1):
+            return INVALID
+        return EXPIRED
+
+    def discard(self, user_id, purpose):
+        OneTimePassword.objects.filter(user_id=user_id, purpose=purpose).delete()
+
+    def purge(self):
+        deleted, _ = OneTimePassword.objects.filter(expires_at__lte=timezone.now()).delete()
+        return deleted
+
+
+class CacheOTPStore:
+    """
+    the code lives under a key that contains its hash, so verifying is a single cache.delete,
+    a second key points to the current code so issuing a new one can drop the old one
+    """
+
+    def keys(self, user_id, purpose):
+        return f"otp:{purpose}:{user_id}", f"otp-attempts:{purpose}:{user_id}"
+
+    def code_key(self, user_id, purpose, code_hash):
+        return f"otp:{purpose}:{user_id}:{code_hash}"
+
+    def issue(self, user_id, purpose, code_hash):
+        current_key, _ = self.keys(user_id, purpose)
+        self.discard(user_id, purpose)
+        cache.set_many({current_key: code_hash, self.code_key(user_id, purpose, code_hash): True},
+                       settings.OTP_TTL)
+
+    def verify(self, user_id, purpose, code_hash):
+        current_key, attempts_key = self.keys(user_id, purpose)
+        if cache.get(current_key) is None:
+            return EXPIRED
+        # count the attempt before looking at the code, concurrent guesses each get their own number
+        cache.add(attempts_key, 0, settings.OTP_TTL)
+        try:
+            attempts = cache.incr(attempts_key)
+        except ValueError:
+            # the counter expired with the code
+            return EXPIRED
+        if attempts > settings.OTP_MAX_ATTEMPTS:
+            return EXPIRED
+        if cache.delete(self.code_key(user_id, purpose, code_hash)):
+            cache.delete_many([current_key, attempts_key])
+            return VALID
+        return INVALID
+
+    def discard(self, user_id, purpose):
+        current_key, attempts_key = self.keys(user_id, purpose)
+        code_hash = cache.get(current_key)
+        keys = [current_key, attempts_key]
+        if code_hash:
+            keys.append(self.code_key(user_id, purpose, code_hash))
+        cache.delete_many(keys)
+
+    def purge(self):
+        # the cache expires the codes itself
+        return 0
+
+
+STORES = {
+    "db": DatabaseOTPStore,
+    "cache": CacheOTPStore,
+}
+
+
+def get_store():
+    return STORES[settings.OTP_BACKEND]()
+
+
+def issue_otp(user_id, purpose):
+    """create (or replace) the user's code for `purpose` and return it, to be mailed to them"""
+    code = generate_code()
+    get_store().issue(user_id, purpose, hash_code(user_id, purpose, code))
+    return code
+
+
+def verify_otp(user_id, purpose, code):
+    """check and consume the user's code, returns VALID, INVALID or EXPIRED"""
+    return get_store().verify(user_id, purpose, hash_code(user_id, purpose, code))
+
+
+def discard_otp(user_id, purpose):
+    get_store().discard(user_id, purpose)
@@ -0,0 +1,61 @@
+"""
+Cache of the minimal user loaded by CachedJWTAuthentication, one entry per access token (jti)
+kept for PRINCIPAL_CACHE_TTL seconds. every entry carries the user's generation number,
+bumping it with invalidate_principals drops all of the user's entries at once. User.save, deleting
+a user and queryset updates of PRINCIPAL_FIELDS bump it, and the short TTL bounds anything else.
+
+access tokens revoked on logout are kept in a blocklist until they expire.
+all of it needs a cache shared by every worker, so only production sets PRINCIPAL_CACHE_TTL
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from rest_framework_simplejwt.settings import api_settings
+
+# cached for every authenticated request, anything else is loaded on first access
+PRINCIPAL_FIELDS = ("id", "email", "is_staff", "is_active", "is_verified")
+# changing one of these makes the cached principals of the user stale
+INVALIDATING_FIELDS = PRINCIPAL_FIELDS + ("password",)
+
+
+def principal_key(jti):
+    return f"principal:{jti}"
+
+
+def generation_key(user_id):
+    return f"principal-generation:{user_id}"
+
+
+def revoked_key(jti):
+    return f"revoked-token:{jti}"
+
+
+def invalidate_principals(*user_ids):
+    """
+    Make every cached principal of the users stale once the current transaction commits,
+    call it whenever one of INVALIDATING_FIELDS changes
+    """
+    def bump():
+        # outlives every principal cached under the previous generation
+        ttl = 2 * settings.PRINCIPAL_CACHE_TTL
+        for user_id in user_ids:
+            key = generation_key(user_id)
+            cache.add(key, 0, ttl)
+            try:
+                cache.incr(key)
+            except ValueError:
+                # expired in between, which leaves no principal of that generation either
+                cache.add(key, 1, ttl)
+            cache.touch(key, ttl)
+
+    if user_ids:
+        transaction.on_commit(bump)
+
+
+def revoke_token(token):
+    """block a validated access token until it expires, e.g on logout"""
+    ttl = token["exp"] - timezone.now().timestamp()
+    if ttl > 0:
+        cache.set(revoked_key(token[api_settings.JTI_CLAIM]), True, ttl)
+    cache.delete(principal_key(token[api_settings.JTI_CLAIM]))
@@ -0,0 +1,84 @@
+"""
+Deletes rows nothing will use again: abandoned change requests, expired one time passwords,
+refresh tokens past their lifetime (with their blacklist entries) and old sent or failed mails.
+run by `manage.py reap_expired_requests`, or in a background thread of the web process with REAPER_INTERVAL
+"""
+import datetime
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connection
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+
+from .models import (ForgotPasswordRequest, PasswordChangeRequest, EmailChangeRequest, NameChangeRequest,
+                     OneTimePassword, OutboundEmail)
+
+logger = logging.getLogger(__name__)
+
+
+def expired_querysets():
+    """{name: queryset of the expired rows}"""
+    now = timezone.now()
+    abandoned = now - datetime.timedelta(seconds=settings.CHANGE_REQUEST_TTL)
+    return {
+        "forgot password requests": ForgotPasswordRequest.objects.filter(created_at__lt=abandoned),
+        "password change requests": PasswordChangeRequest.objects.filter(created_at__lt=abandoned),
+        "email change requests": EmailChangeRequest.objects.filter(created_at__lt=abandoned),
+        "name change requests": NameChangeRequest.objects.filter(created_at__lt=abandoned),
+        "one time passwords": OneTimePassword.objects.filter(expires_at__lte=now),
+        # expires_at is issued + REFRESH_TOKEN_LIFETIME, deleting cascades to BlacklistedToken
+        "outstanding tokens": OutstandingToken.objects.filter(expires_at__lte=now),
+        "sent and failed mails": OutboundEmail.objects.filter(
+            status__in=[OutboundEmail.Status.SENT, OutboundEmail.Status.FAILED],
+            created_at__lt=now - datetime.timedelta(seconds=settings.MAIL_QUEUE_RETENTION)),
+    }
+
+
+def delete_in_batches(queryset, batch_size):
+    """
+    Delete the rows of the queryset `batch_size` at a time so no statement locks
+    a large part of the table, returns the number of rows deleted
+    """
+    deleted = 0
+    while True:
+        ids = list(queryset.order_by("pk").values_list("pk", flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        queryset.model.objects.filter(pk__in=ids).delete()
+        deleted += len(ids)
+
+
+def reap_expired(batch_size=None):
+    """delete every expired row, returns {name: rows deleted}"""
+    batch_size = batch_size or settings.REAPER_BATCH_SIZE
+    return {name: delete_in_batches(queryset, batch_size) for name, queryset in expired_querysets().items()}
+
+
+def _run_forever(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            counts = reap_expired()
+            logger.info("reaped expired rows: %s", counts)
+        except Exception:
+            logger.exception("reaping expired rows failed")
+        finally:
+            connection.close()
+
+
+DISPATCH_UID = "authentication.reaper"
+_started = threading.Lock()
+
+
+def start_reaper(**kwargs):
+    """
+    request_started receiver, starts the background reaper once per process.
+    only web processes serve requests, so migrations and other commands never start it
+    """
+    if _started.acquire(blocking=False):
+        request_started.disconnect(dispatch_uid=DISPATCH_UID)
+        threading.Thread(target=_run_forever, args=(settings.REAPER_INTERVAL,), name="reaper", daemon=True).start()
@@ -1,26 +1,155 @@
-from cryptography.fernet import Fernet
-import jwt
-import os
-from dotenv import load_dotenv
+"""
+Token codec for small payloads handed to clients.
 
-load_dotenv()
+two modes, chosen with TOKEN_CODEC (or per call):
+  - "encrypted": Fernet (AES-CBC + HMAC-SHA256) over compact JSON, the client can't read the payload.
+    tokens are `<key id>.<fernet token>` so decoding goes straight to the right key.
+  - "signed": base64 JSON with an HMAC-SHA256, readable by the client but tamper proof.
+    shorter and faster, use it when the payload isn't secret.
 
-key = Fernet.generate_key()
-cipher_suite = Fernet(key)
-JWT_SECRET = os.getenv("SECRET_KEY")
+keys come from settings, never from the process, so any worker on any node can decode a token.
+TOKEN_ENCRYPTION_KEYS lists Fernet keys newest first, the first one encrypts and all of them decrypt.
+when it is empty the keys are derived from SECRET_KEY and SECRET_KEY_FALLBACKS, the signed mode
+always derives its keys from those, so rotating SECRET_KEY the Django way rotates both modes.
+an "exp" claim (unix time) is checked on decode in both modes.
+"""
+import base64
+import functools
+import hashlib
+import hmac
+import json
+import time
 
+from cryptography.fernet import Fernet, InvalidToken as InvalidFernetToken
+from django.conf import settings
 
-def create_token(payload):
-    token = jwt.encode(payload, JWT_SECRET, algorithm='HS256')
-    encrypted_token = cipher_suite.encrypt(token.encode()).decode()
-    return encrypted_token
+SALT = "authentication.security"
 
 
-def decrypt_token(enc_token):
-    try:
-        dec_token = cipher_suite.decrypt(enc_token.encode()).decode()
-        payload = jwt.decode(dec_token, JWT_SECRET, algorithms=['HS256'])
-        return {'payload': payload, 'status': True}
+class InvalidToken(Exception):
+    pass
+
+
+def derive_key(secret):
+    """a Fernet key derived from a django secret key"""
+    return base64.urlsafe_b64encode(hashlib.sha256(f"{SALT}:{secret}".encode()).digest()).decode()
+
+
+def key_id(key):
+    return hashlib.sha256(key.encode()).hexdigest()[:8]
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _dumps(payload):
+    return json.dumps(payload, separators=(",", ":")).encode()
+
+
+def _check_expiry(payload):
+    exp = payload.get("exp") if isinstance(payload, dict) else None
+    if exp is not None and exp < time.time():
+        raise InvalidToken("token has expired")
+    return payload
+
+
+class EncryptedTokenCodec:
+
+    def __init__(self, keys):
+        if not keys:
+            raise ValueError("at least one key is required")
+        self.fernets = {key_id(key): Fernet(key) for key in keys}
+        self.current_kid = key_id(keys[0])
+
+    def encode(self, payload):
+        token = self.fernets[self.current_kid].encrypt(_dumps(payload)).decode()
+        return f"{self.current_kid}.{token}"
+
+    def decode(self, token):
+        kid, _, token = token.partition(".")
+        fernet = self.fernets.get(kid)
+        if fernet is None:
+            raise InvalidToken("unknown key")
+        try:
+            return _check_expiry(json.loads(fernet.decrypt(token.encode())))
+        except (InvalidFernetToken, ValueError):
+            raise InvalidToken("token is invalid")
+
 
-    except (jwt.InvalidTokenError, jwt.DecodeError, jwt.InvalidSignatureError, jwt.ExpiredSignatureError):
+class SignedTokenCodec:
+    """`<key id>.<base64 JSON>.<base64 HMAC-SHA256>`, one HMAC with a precomputed key per call"""
+
+    def __init__(self, secrets):
+        if not secrets:
+            raise ValueError("at least one secret is required")
+        self.keys = {}
+        for secret in secrets:
+            key = hashlib.sha256(f"{SALT}:signed:{secret}".encode()).digest()
+            self.keys.setdefault(key_id(key.hex()), key)
+        self.current_kid = next(iter(self.keys))
+
+    def _signature(self, key, signed):
+        return _b64encode(hmac.new(key, signed.encode(), hashlib.sha256).digest())
+
+    def encode(self, payload):
+        signed = f"{self.current_kid}.{_b64encode(_dumps(payload))}"
+        return f"{signed}.{self._signature(self.keys[self.current_kid], signed)}"
+
+    def decode(self, token):
+        signed, _, signature = token.rpartition(".")
+        kid, _, body = signed.partition(".")
+        key = self.keys.get(kid)
+        if key is None:
+            raise InvalidToken("unknown key")
+        try:
+            # compare_digest only takes ASCII str, so compare bytes. encoding a lone surrogate raises a ValueError too
+            if hmac.compare_digest(signature.encode(), self._signature(key, signed).encode()):
+                return _check_expiry(json.loads(_b64decode(body)))
+        except ValueError:
+            pass
+        raise InvalidToken("token is invalid")
+
+
+@functools.lru_cache
+def _encrypted_codec(keys):
+    return EncryptedTokenCodec(list(keys))
+
+
+@functools.lru_cache
+def _signed_codec(secrets):
+    return SignedTokenCodec(list(secrets))
+
+
+def _secrets():
+    return (settings.SECRET_KEY, *settings.SECRET_KEY_FALLBACKS)
+
+
+def encryption_keys():
+    if settings.TOKEN_ENCRYPTION_KEYS:
+        return tuple(settings.TOKEN_ENCRYPTION_KEYS)
+    return tuple(derive_key(secret) for secret in _secrets())
+
+
+def get_codec(mode=None):
+    mode = mode or settings.TOKEN_CODEC
+    if mode == "encrypted":
+        return _encrypted_codec(encryption_keys())
+    if mode == "signed":
+        return _signed_codec(_secrets())
+    raise ValueError(f"unknown token codec {mode!r}")
+
+
+def create_token(payload, mode=None):
+    return get_codec(mode).encode(payload)
+
+
+def decrypt_token(enc_token, mode=None):
+    try:
+        return {'payload': get_codec(mode).decode(enc_token), 'status': True}
+    except InvalidToken:
         return {'status': False}
@@ -1,3 +1,482 @@
-from django.test import TestCase
+import datetime
+import io
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from asgiref.sync import sync_to_async
+from cryptography.fernet import Fernet
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken, BlacklistedToken
+from .models import OutboundEmail, OneTimePassword, ForgotPasswordRequest, NameChangeRequest
+from . import hashing, otp, security
+from .utils import queue_mail, send_queued_mail
+from base.testing import cached_authentication
 
-# Create your tests here.
+
+class MailQueueTests(TestCase):
+
+    def test_queued_mail_is_sent_in_one_connection(self):
+        for i in range(3):
+            queue_mail(subject=f'Mail {i}', message='Hello', recipient_list=[f'user{i}@example.com'])
+        self.assertEqual(len(mail.outbox), 0)
+
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.open') as open_connection:
+            self.assertEqual(send_queued_mail(), (3, 0))
+        open_connection.assert_called_once()
+
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertFalse(OutboundEmail.objects.exclude(status=OutboundEmail.Status.SENT).exists())
+        # the bodies may hold one time passwords, they are not kept once sent
+        self.assertFalse(OutboundEmail.objects.exclude(message='').exists())
+
+    def test_batch_is_claimed_before_sending(self):
+        queue_mail(subject='Mail', message='Hello', recipient_list=['user@example.com'])
+        statuses = []
+
+        def send_messages(messages):
+            statuses.append(OutboundEmail.objects.get().status)
+            # another worker doesn't pick up a claimed mail
+            self.assertEqual(send_queued_mail(), (0, 0))
+            return len(messages)
+
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=send_messages):
+            self.assertEqual(send_queued_mail(), (1, 0))
+        self.assertEqual(statuses, [OutboundEmail.Status.SENDING])
+
+        # a worker that died while sending leaves the mail claimed until the claim expires
+        queued = queue_mail(subject='Mail', message='Hello', recipient_list=['user@example.com'])
+        OutboundEmail.objects.filter(pk=queued.pk).update(status=OutboundEmail.Status.SENDING,
+                                                          next_attempt_at=timezone.now())
+        self.assertEqual(send_queued_mail(), (1, 0))
+
+    def test_failed_mail_is_retried_with_backoff(self):
+        queued = queue_mail(subject='Verify your email', message='Your OTP is: 123456',
+                            recipient_list=['user@example.com'])
+
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('down')):
+            self.assertEqual(send_queued_mail(), (0, 0))
+
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, OutboundEmail.Status.PENDING)
+        self.assertEqual(queued.attempts, 1)
+        self.assertGreater(queued.next_attempt_at, timezone.now())
+
+        # not due yet, so nothing is picked up
+        self.assertEqual(send_queued_mail(), (0, 0))
+
+        OutboundEmail.objects.update(next_attempt_at=timezone.now())
+        call_command('send_queued_mail', stdout=mock.Mock())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].subject, 'Verify your email')
+
+
+class AsyncProfileTests(TestCase):
+
+    async def test_profile(self):
+        user = await get_user_model().objects.acreate(email='trader@example.com', first_name='Ada')
+
+        response = await self.async_client.get('/auth/async/profile/',
+                                               headers={'Authorization': f'JWT {AccessToken.for_user(user)}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['email'], 'trader@example.com')
+        self.assertEqual(response.json()['first_name'], 'Ada')
+
+    async def test_only_get(self):
+        response = await self.async_client.post('/auth/async/profile/')
+        self.assertEqual(response.status_code, 405)
+
+
+class ThrottlingTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        get_user_model().objects.create_user(email='trader@example.com', password='password123')
+
+    def resend(self, email='trader@example.com'):
+        return self.client.post('/auth/signup/resend-otp/', {'email': email}, format='json')
+
+    def test_otp_bucket_per_email(self):
+        for _ in range(5):
+            self.assertEqual(self.resend().status_code, 200)
+
+        # rejected before any query or mail
+        with self.assertNumQueries(0):
+            response = self.resend(email='Trader@Example.com ')
+        self.assertEqual(response.status_code, 429)
+        self.assertLessEqual(int(response['Retry-After']), 12 * 60)
+        self.assertEqual(OutboundEmail.objects.count(), 5)
+
+        # one token is back after 12 minutes
+        later = timezone.now().timestamp() + 12 * 60 + 1
+        with mock.patch('authentication.throttling.time.time', return_value=later):
+            self.assertEqual(self.resend().status_code, 200)
+            self.assertEqual(self.resend().status_code, 429)
+
+    @override_settings(REST_FRAMEWORK={'DEFAULT_THROTTLE_RATES': {'login.ip': '2/min'}, 'NUM_PROXIES': 0})
+    def test_login_bucket_per_ip(self):
+        for i in range(2):
+            response = self.client.post('/auth/login/', {'email': f'user{i}@example.com', 'password': 'x'})
+            self.assertEqual(response.status_code, 400)
+
+        response = self.client.post('/auth/login/', {'email': 'user3@example.com', 'password': 'x'})
+        self.assertEqual(response.status_code, 429)
+        # a different client has its own bucket
+        response = self.client.post('/auth/login/', {'email': 'user3@example.com', 'password': 'x'},
+                                    REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(response.status_code, 400)
+
+        # but not a client making up its own X-Forwarded-For
+        response = self.client.post('/auth/login/', {'email': 'user3@example.com', 'password': 'x'},
+                                    HTTP_X_FORWARDED_FOR='203.0.113.9')
+        self.assertEqual(response.status_code, 429)
+
+    @override_settings(REST_FRAMEWORK={'DEFAULT_THROTTLE_RATES': {'login.ip': '1/min'}, 'NUM_PROXIES': 1})
+    def test_login_bucket_behind_a_proxy(self):
+        def login(forwarded_for):
+            return self.client.post('/auth/login/', {'email': 'user@example.com', 'password': 'x'},
+                                    HTTP_X_FORWARDED_FOR=forwarded_for, REMOTE_ADDR='10.0.0.1')
+
+        self.assertEqual(login('198.51.100.7').status_code, 400)
+        # the proxy appends the address it saw, what the client put in front doesn't matter
+        self.assertEqual(login('203.0.113.9, 198.51.100.7').status_code, 429)
+        self.assertEqual(login('198.51.100.8').status_code, 400)
+
+
+class OTPTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(email='trader@example.com', password='password123')
+
+    def test_code_is_consumed_in_one_query(self):
+        code = otp.issue_otp(self.user.pk, otp.Purpose.SIGNUP)
+        self.assertNotIn(code, OneTimePassword.objects.get().code_hash)
+
+        # codes are scoped to their purpose
+        self.assertEqual(otp.verify_otp(self.user.pk, otp.Purpose.EMAIL_CHANGE, code), otp.EXPIRED)
+        with self.assertNumQueries(1):
+            self.assertEqual(otp.verify_otp(self.user.pk, otp.Purpose.SIGNUP, code), otp.VALID)
+        self.assertEqual(otp.verify_otp(self.user.pk, otp.Purpose.SIGNUP, code), otp.EXPIRED)
+
+    def test_wrong_guesses_use_up_the_code(self):
+        code = otp.issue_otp(self.user.pk, otp.Purpose.PASSWORD_CHANGE)
+        wrong = f'{(int(code) + 1) % 10 ** 6:06d}'
+        for _ in range(5):
+            self.assertEqual(otp.verify_otp(self.user.pk, otp.Purpose.PASSWORD_CHANGE, wrong), otp.INVALID)
+        self.assertEqual(otp.verify_otp(self.user.pk, otp.Purpose.PASSWORD_CHANGE, code), otp.EXPIRED)
+
+    def test_new_code_replaces_the_old_one(self):
+        with mock.patch('authentication.otp.generate_code', side_effect=['111111', '222222']):
+            first = otp.issue_otp(self.user.pk, otp.Purpose.SIGNUP)
+            second = otp.issue_otp(self.user.pk, otp.Purpose.SIGNUP)
+        self.assertEqual(otp.verify_otp(self.user.pk, otp.Purpose.SIGNUP, first), otp.INVALID)
+        self.assertEqual(otp.verify_otp(self.user.pk, otp.Purpose.SIGNUP, second), otp.VALID)
+        self.assertEqual(OneTimePassword.objects.count(), 0)
+
+    def test_expired_codes_are_purged(self):
+        code = otp.issue_otp(self.user.pk, otp.Purpose.SIGNUP)
+        OneTimePassword.objects.update(expires_at=timezone.now())
+        self.assertEqual(otp.verify_otp(self.user.pk, otp.Purpose.SIGNUP, code), otp.EXPIRED)
+
+        call_command('purge_otps', stdout=mock.Mock())
+        self.assertFalse(OneTimePassword.objects.exists())
+
+    @override_settings(OTP_BACKEND='cache')
+    def test_cache_backend(self):
+        code = otp.issue_otp(self.user.pk, otp.Purpose.SIGNUP)
+        wrong = f'{(int(code) + 1) % 10 ** 6:06d}'
+        self.assertEqual(otp.verify_otp(self.user.pk, otp.Purpose.SIGNUP, wrong), otp.INVALID)
+        with self.assertNumQueries(0):
+            self.assertEqual(otp.verify_otp(self.user.pk, otp.Purpose.SIGNUP, code), otp.VALID)
+        self.assertEqual(otp.verify_otp(self.user.pk, otp.Purpose.SIGNUP, code), otp.EXPIRED)
+        self.assertFalse(OneTimePassword.objects.exists())
+
+    @override_settings(OTP_BACKEND='cache')
+    def test_cache_backend_counts_concurrent_guesses(self):
+        code = otp.issue_otp(self.user.pk, otp.Purpose.SIGNUP)
+        wrong = f'{(int(code) + 1) % 10 ** 6:06d}'
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(lambda _: otp.verify_otp(self.user.pk, otp.Purpose.SIGNUP, wrong), range(20)))
+        self.assertEqual(results.count(otp.INVALID), 5)
+        self.assertEqual(otp.verify_otp(self.user.pk, otp.Purpose.SIGNUP, code), otp.EXPIRED)
+
+    def test_signup_flow(self):
+        client = APIClient()
+        response = client.post('/auth/signup/', {
+            'first_name': 'Ada', 'last_name': 'Lovelace', 'phone_number': '08000000000',
+            'email': 'ada@example.com', 'password': 'password123', 'verify_password': 'password123',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+
+        code = OutboundEmail.objects.get(recipients=['ada@example.com']).message.rsplit(' ', 1)[-1]
+        response = client.post('/auth/signup/verify-otp/', {'email': 'ada@example.com', 'otp': code}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(get_user_model().objects.get(email='ada@example.com').is_verified)
+
+
+class ForgotPasswordTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(email='trader@example.com', password='password123')
+        self.client = APIClient()
+
+    def post(self, action, **data):
+        return self.client.post(f'/auth/forgot-password/{action}/', {'email': 'trader@example.com', **data})
+
+    def test_repeated_request_keeps_the_new_password(self):
+        self.assertEqual(self.post('request-forgot-password').status_code, 200)
+        response = self.post('set-new-password', new_password='new-password', confirm_password='new-password')
+        self.assertEqual(response.status_code, 200)
+        code = re.search(r'\d{6}', OutboundEmail.objects.latest('pk').message).group()
+        self.assertEqual(self.post('request-forgot-password').status_code, 200)
+
+        self.assertEqual(self.post('verify-otp', otp=code).status_code, 201)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('new-password'))
+
+    def test_otp_without_a_new_password_is_rejected(self):
+        self.post('request-forgot-password')
+        code = otp.issue_otp(self.user.pk, otp.Purpose.PASSWORD_RESET)
+        self.assertEqual(self.post('verify-otp', otp=code).status_code, 400)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('password123'))
+
+
+class ReaperTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.users = [User.objects.create_user(email=f'user{i}@example.com', password='password123')
+                      for i in range(3)]
+
+    def test_deletes_only_expired_rows(self):
+        long_ago = timezone.now() - datetime.timedelta(days=2)
+        for user in self.users:
+            ForgotPasswordRequest.objects.create(user=user)
+            NameChangeRequest.objects.create(user=user, new_first_name='Ada')
+            RefreshToken.for_user(user).blacklist()
+        ForgotPasswordRequest.objects.exclude(user=self.users[0]).update(created_at=long_ago)
+        NameChangeRequest.objects.filter(user=self.users[0]).update(created_at=long_ago)
+        OutstandingToken.objects.exclude(user=self.users[2]).update(expires_at=long_ago)
+        otp.issue_otp(self.users[0].pk, otp.Purpose.SIGNUP)
+
+        out = io.StringIO()
+        call_command('reap_expired_requests', batch_size=1, stdout=out)
+
+        self.assertIn('forgot password requests: 2', out.getvalue())
+        self.assertIn('outstanding tokens: 2', out.getvalue())
+        self.assertEqual(list(ForgotPasswordRequest.objects.values_list('user', flat=True)), [self.users[0].pk])
+        self.assertEqual(NameChangeRequest.objects.count(), 2)
+        self.assertEqual(list(OutstandingToken.objects.values_list('user', flat=True)), [self.users[2].pk])
+        self.assertEqual(BlacklistedToken.objects.count(), 1)
+        self.assertEqual(OneTimePassword.objects.count(), 1)
+
+    def test_deletes_old_sent_and_failed_mail(self):
+        for status in OutboundEmail.Status:
+            OutboundEmail.objects.create(subject='Mail', recipients=['user@example.com'], status=status)
+        OutboundEmail.objects.update(created_at=timezone.now() - datetime.timedelta(days=30))
+        OutboundEmail.objects.create(subject='Mail', recipients=['user@example.com'], status=OutboundEmail.Status.SENT)
+
+        out = io.StringIO()
+        call_command('reap_expired_requests', stdout=out)
+        self.assertIn('sent and failed mails: 2', out.getvalue())
+        self.assertEqual(sorted(OutboundEmail.objects.values_list('status', flat=True)), ['pending', 'sending', 'sent'])
+
+    def test_forgot_password_request_reuses_the_pending_row(self):
+        client = APIClient()
+        for _ in range(2):
+            response = client.post('/auth/forgot-password/request-forgot-password/', {'email': 'user0@example.com'})
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(ForgotPasswordRequest.objects.count(), 1)
+
+
+@cached_authentication
+class CachedJWTAuthenticationTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(email='trader@example.com', password='password123',
+                                                         first_name='Ada')
+        self.refresh = RefreshToken.for_user(self.user)
+        self.access = self.refresh.access_token
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'JWT {self.access}')
+
+    def test_user_is_cached_per_token(self):
+        self.client.get('/api/balance/')
+        # the balance itself is cached too, so nothing reaches the database
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/balance/')
+        self.assertEqual(response.data['user'], self.user.pk)
+
+        # other fields are loaded together on first use
+        with self.assertNumQueries(1):
+            response = self.client.get('/auth/profile/')
+        self.assertEqual(response.data['first_name'], 'Ada')
+
+    @override_settings(PRINCIPAL_CACHE_TTL=0)
+    def test_cache_ttl(self):
+        self.client.get('/api/balance/')
+        with self.assertNumQueries(1):
+            self.client.get('/api/balance/')
+
+    def test_saving_the_user_drops_the_cached_principal(self):
+        self.assertEqual(self.client.get('/api/manage/balances/').status_code, 403)
+
+        self.user.is_staff = True
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertEqual(self.client.get('/api/manage/balances/').status_code, 200)
+
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertEqual(self.client.get('/api/balance/').status_code, 401)
+
+    def test_queryset_updates_drop_the_cached_principal(self):
+        get_user_model().objects.filter(pk=self.user.pk).update(is_staff=True)
+        self.assertEqual(self.client.get('/api/manage/deposits/').status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            get_user_model().objects.filter(pk=self.user.pk).update(is_active=False, is_staff=False)
+        self.assertEqual(self.client.get('/api/manage/deposits/').status_code, 401)
+
+        # fields the principal doesn't hold leave it cached
+        with self.captureOnCommitCallbacks() as callbacks:
+            get_user_model().objects.filter(pk=self.user.pk).update(first_name='Grace')
+        self.assertEqual(callbacks, [])
+
+    def test_deleting_the_user_drops_the_cached_principal(self):
+        self.assertEqual(self.client.get('/api/balance/').status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            get_user_model().objects.filter(pk=self.user.pk).delete()
+        self.assertEqual(self.client.get('/api/balance/').status_code, 401)
+
+    def test_logout_revokes_the_access_token(self):
+        self.client.get('/api/balance/')
+        response = self.client.post('/auth/logout/', {'refresh_token': str(self.refresh)})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get('/api/balance/')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data['detail'], 'Token has been revoked')
+
+    async def test_logout_revokes_the_access_token_on_async_views(self):
+        headers = {'Authorization': f'JWT {self.access}'}
+        self.assertEqual((await self.async_client.get('/api/async/balance/', headers=headers)).status_code, 200)
+        response = await sync_to_async(self.client.post)('/auth/logout/', {'refresh_token': str(self.refresh)})
+        self.assertEqual(response.status_code, 200)
+        for url in ('/api/async/balance/', '/auth/async/profile/'):
+            response = await self.async_client.get(url, headers=headers)
+            self.assertEqual(response.status_code, 401)
+            self.assertEqual(response.json()['detail'], 'Token has been revoked')
+
+
+class TokenCodecTests(TestCase):
+
+    def setUp(self):
+        security._encrypted_codec.cache_clear()
+        security._signed_codec.cache_clear()
+
+    def test_round_trip_in_both_modes(self):
+        payload = {"user_id": 1, "purpose": "reset"}
+        for mode in ("encrypted", "signed"):
+            token = security.create_token(payload, mode=mode)
+            self.assertEqual(security.decrypt_token(token, mode=mode), {"payload": payload, "status": True})
+
+    def test_decodes_in_another_process(self):
+        token = security.create_token({"user_id": 1})
+        # a new worker builds its codec from the same settings
+        security._encrypted_codec.cache_clear()
+        security._signed_codec.cache_clear()
+        self.assertTrue(security.decrypt_token(token)["status"])
+
+    def test_rotated_keys_still_decode(self):
+        old_key, new_key = Fernet.generate_key().decode(), Fernet.generate_key().decode()
+        with override_settings(TOKEN_ENCRYPTION_KEYS=[old_key]):
+            token = security.create_token({"user_id": 1})
+        with override_settings(TOKEN_ENCRYPTION_KEYS=[new_key, old_key]):
+            self.assertTrue(security.decrypt_token(token)["status"])
+            self.assertTrue(security.create_token({"user_id": 1}).startswith(security.key_id(new_key)))
+        with override_settings(TOKEN_ENCRYPTION_KEYS=[new_key]):
+            self.assertFalse(security.decrypt_token(token)["status"])
+
+    def test_secret_key_fallbacks_rotate_both_modes(self):
+        with override_settings(SECRET_KEY="old-secret"):
+            tokens = {mode: security.create_token({"user_id": 1}, mode=mode) for mode in ("encrypted", "signed")}
+        with override_settings(SECRET_KEY="new-secret", SECRET_KEY_FALLBACKS=["old-secret"]):
+            for mode, token in tokens.items():
+                self.assertTrue(security.decrypt_token(token, mode=mode)["status"])
+
+    def test_tampered_and_expired_tokens_are_rejected(self):
+        for mode in ("encrypted", "signed"):
+            token = security.create_token({"user_id": 1}, mode=mode)
+            tampered = token[:-3] + ("AAA" if token[-3:] != "AAA" else "BBB")
+            self.assertFalse(security.decrypt_token(tampered, mode=mode)["status"])
+            self.assertFalse(security.decrypt_token("garbage", mode=mode)["status"])
+            expired = security.create_token({"user_id": 1, "exp": 1}, mode=mode)
+            self.assertFalse(security.decrypt_token(expired, mode=mode)["status"])
+            # non-ASCII signatures
+            for bad in (token[:-3] + "é€!", token[:-3] + "\ud800"):
+                self.assertFalse(security.decrypt_token(bad, mode=mode)["status"])
+
+
+@override_settings(PASSWORD_PBKDF2_ITERATIONS=1000)
+class PasswordHashingTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(email='trader@example.com', password='password123',
+                                                         is_verified=True)
+
+    def login(self, password='password123'):
+        return self.client.post('/auth/login/', {'email': 'trader@example.com', 'password': password}, format='json')
+
+    def test_profile_parameters(self):
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$1000$'))
+
+    def test_rehashed_on_login_when_the_profile_changes(self):
+        with override_settings(PASSWORD_PBKDF2_ITERATIONS=2000):
+            self.assertEqual(self.login().status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$2000$'))
+
+        self.user.password = make_password('password123', hasher='scrypt')
+        self.user.save()
+        self.assertEqual(self.login().status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$1000$'))
+
+    def test_wrong_password_is_not_rehashed(self):
+        with override_settings(PASSWORD_PBKDF2_ITERATIONS=2000):
+            self.assertEqual(self.login(password='wrong').status_code, 400)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$1000$'))
+
+    def test_cheap_checks_run_before_hashing(self):
+        self.user.is_verified = False
+        self.user.save()
+        with mock.patch('authentication.hashing.run') as run:
+            self.assertEqual(self.login().status_code, 400)
+            self.client.post('/auth/login/', {'email': 'nobody@example.com', 'password': 'x'}, format='json')
+        run.assert_not_called()
+
+    def test_busy_pool_refuses_with_503(self):
+        full = threading.BoundedSemaphore(1)
+        full.acquire()
+        with mock.patch('authentication.hashing._get_pool', return_value=(None, full)):
+            response = self.login()
+        self.assertEqual(response.status_code, 503)
@@ -0,0 +1,141 @@
+"""
+Token bucket throttles for the OTP/mail sending and login endpoints.
+
+a rate of '5/hour' is a bucket of 5 requests refilled at 5 per hour (one every 12 minutes).
+the bucket is kept in the cache as the time it will be full again, in milliseconds (GCRA),
+every request reserves its token with an atomic cache.incr so concurrent workers can't overspend it.
+
+rates are configured per scope and dimension in REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']
+e.g 'otp.email', 'otp.ip', 'otp.user', a missing rate leaves that dimension unthrottled.
+"""
+import math
+import time
+
+from django.core.cache import cache as default_cache
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """'5/hour' -> (5, 3600), same format as DRF's rates"""
+    num, period = rate.split('/')
+    return int(num), PERIODS[period[0]]
+
+
+def _timeout(milliseconds):
+    # cache timeouts are whole seconds on some backends, round up so a bucket never expires early
+    return max(1, math.ceil(milliseconds / 1000))
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Base class, subclasses set `kind` and return the identity of the bucket from get_ident_key.
+    the scope comes from the view's `throttle_scope`, see ThrottledActionsMixin
+    """
+    cache = default_cache
+    kind = None
+
+    def __init__(self):
+        self.retry_after = None
+
+    def get_ident_key(self, request, view):
+        """what the bucket is keyed on, None to skip throttling the request"""
+        raise NotImplementedError('.get_ident_key() must be overridden')
+
+    def get_rate(self, scope):
+        return api_settings.DEFAULT_THROTTLE_RATES.get(f'{scope}.{self.kind}')
+
+    def allow_request(self, request, view):
+        scope = getattr(view, 'throttle_scope', None)
+        rate = self.get_rate(scope) if scope else None
+        if rate is None:
+            return True
+        ident = self.get_ident_key(request, view)
+        if ident is None:
+            return True
+
+        requests, period = parse_rate(rate)
+        interval = period * 1000 // requests
+        return self.consume(f'throttle:{scope}.{self.kind}:{ident}', interval, interval * requests)
+
+    def consume(self, key, interval, capacity):
+        """
+        Take one token out of the bucket stored under `key`, `interval` is the time one token
+        takes to refill and `capacity` the time the whole bucket takes, both in milliseconds
+        """
+        now = int(time.time() * 1000)
+        # a missing bucket is a full one, and it expires as soon as it is full again
+        self.cache.add(key, now, timeout=_timeout(capacity))
+        try:
+            full_at = self.cache.incr(key, interval)
+        except ValueError:
+            # expired between add and incr
+            self.cache.add(key, now + interval, timeout=_timeout(interval))
+            return True
+
+        if full_at <= now + interval:
+            # the bucket was full, start it again from now rather than from when it filled up.
+            # a request racing this set may get its token for free, at worst one per concurrent request
+            self.cache.set(key, now + interval, timeout=_timeout(interval))
+            return True
+
+        if full_at - now > capacity:
+            # no token left, give the reservation back
+            try:
+                self.cache.decr(key, interval)
+            except ValueError:
+                pass
+            self.retry_after = (full_at - now - capacity) / 1000
+            return False
+
+        self.cache.touch(key, _timeout(full_at - now))
+        return True
+
+    def wait(self):
+        return self.retry_after
+
+
+class IPTokenBucketThrottle(TokenBucketThrottle):
+    """keyed on the client address, X-Forwarded-For is only read for the NUM_PROXIES trusted proxies"""
+    kind = 'ip'
+
+    def get_ident_key(self, request, view):
+        return self.get_ident(request)
+
+
+class EmailTokenBucketThrottle(TokenBucketThrottle):
+    """keyed on the email in the request body, so one address can't be flooded from many IPs"""
+    kind = 'email'
+
+    def get_ident_key(self, request, view):
+        email = request.data.get('email')
+        if not email or not isinstance(email, str):
+            return None
+        return email.strip().lower()
+
+
+class UserTokenBucketThrottle(TokenBucketThrottle):
+    kind = 'user'
+
+    def get_ident_key(self, request, view):
+        if not request.user or not request.user.is_authenticated:
+            return None
+        return request.user.pk
+
+
+class ThrottledActionsMixin:
+    """
+    Throttle the viewset actions listed in `throttle_scopes` {action: scope} with token buckets
+    per IP, email and user. DRF checks throttles before calling the action, so a rejected request
+    never reaches the database or the mail queue
+    """
+    throttle_scopes = {}
+    token_bucket_throttles = [IPTokenBucketThrottle, EmailTokenBucketThrottle, UserTokenBucketThrottle]
+
+    def get_throttles(self):
+        self.throttle_scope = self.throttle_scopes.get(self.action)
+        if self.throttle_scope is None:
+            return super().get_throttles()
+        return [throttle() for throttle in self.token_bucket_throttles] + super().get_throttles()
@@ -1,5 +1,6 @@
 from django.urls import path
-from .views import (UserSignupViewSet, UserLoginViewSet, LogoutViewSet, UserProfileViewSet, PasswordChangeRequestViewSet, ForgotPasswordViewSet)
+from .views import (UserSignupViewSet, UserLoginViewSet, LogoutViewSet, UserProfileViewSet, PasswordChangeRequestViewSet, ForgotPasswordViewSet,
+                    profile_async)
 from rest_framework_simplejwt.views import TokenRefreshView
 
 
@@ -27,6 +28,7 @@ urlpatterns = [
          PasswordChangeRequestViewSet.as_view({'post': 'verify_password_change'}), name='verify_password_change'),
     # profile
     path('profile/', UserProfileViewSet.as_view({'get': 'retrieve'}), name='user_profile'),
+    path('async/profile/', profile_async, name='user_profile_async'),
     path('profile/request-email-change/', UserProfileViewSet.as_view({'post': 'request_email_change'}),
          name='request_email_change'),
     path('profile/resend-email-change-otp/', UserProfileViewSet.as_view({'post': 'resend_email_change_otp'}),
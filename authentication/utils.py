@@ -1,21 +1,102 @@
-import threading
-import time
+import datetime
 
-from django.core.mail import send_mail
+from django.core.mail import EmailMessage, get_connection
 from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
 
+from .models import OutboundEmail
 
-class EmailThread(threading.Thread):
-    def __init__(self, subject, message, recipient_list):
-        self.subject = subject
-        self.message = message
-        self.recipient_list = recipient_list
-        super().__init__()
-
-    def run(self):
-        send_mail(
-            self.subject,
-            self.message,
-            settings.EMAIL_HOST_USER,
-            self.recipient_list,
-        )
\ No newline at end of file
+
+def queue_mail(subject, message, recipient_list, from_email=None):
+    """
+    Store a mail in the outbound queue, it is delivered by `manage.py send_queued_mail`.
+    this replaces calling send_mail from request handlers
+    """
+    return OutboundEmail.objects.create(
+        subject=subject,
+        message=message,
+        recipients=list(recipient_list),
+        from_email=from_email or settings.EMAIL_HOST_USER,
+    )
+
+
+def retry_delay(attempts):
+    """exponential backoff: MAIL_QUEUE_RETRY_DELAY seconds doubled for every failed attempt"""
+    return datetime.timedelta(seconds=settings.MAIL_QUEUE_RETRY_DELAY * 2 ** (attempts - 1))
+
+
+def _record_failure(mail, error):
+    """schedule a retry for the mail, returns 1 once it has run out of attempts"""
+    mail.attempts += 1
+    mail.last_error = str(error)
+    if mail.attempts >= settings.MAIL_QUEUE_MAX_ATTEMPTS:
+        mail.status = OutboundEmail.Status.FAILED
+        mail.message = ""
+        return 1
+    mail.status = OutboundEmail.Status.PENDING
+    mail.next_attempt_at = timezone.now() + retry_delay(mail.attempts)
+    return 0
+
+
+def claim_batch(batch_size):
+    """
+    Mark up to `batch_size` due mails as sending and return them. the rows are only locked while they
+    are claimed, the claim lasts MAIL_QUEUE_CLAIM_TIMEOUT seconds, after that a mail still sending
+    (its worker died) is due again
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        # skip rows another worker is claiming
+        batch = list(
+            OutboundEmail.objects.select_for_update(skip_locked=True)
+            .filter(status__in=[OutboundEmail.Status.PENDING, OutboundEmail.Status.SENDING], next_attempt_at__lte=now)
+            [:batch_size]
+        )
+        claimed_until = now + datetime.timedelta(seconds=settings.MAIL_QUEUE_CLAIM_TIMEOUT)
+        OutboundEmail.objects.filter(pk__in=[mail.pk for mail in batch]).update(
+            status=OutboundEmail.Status.SENDING, next_attempt_at=claimed_until)
+    return batch
+
+
+def send_queued_mail(batch_size=None):
+    """
+    Send one batch of due mails over a single mail server connection, outside of any transaction.
+    the body of a sent or failed mail is blanked, it may hold a one time password.
+    returns a (sent, failed) tuple of counts
+    """
+    batch = claim_batch(batch_size or settings.MAIL_QUEUE_BATCH_SIZE)
+    sent = failed = 0
+    if not batch:
+        return sent, failed
+
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception as e:
+        # mail server unreachable, push the whole batch back
+        for mail in batch:
+            failed += _record_failure(mail, e)
+    else:
+        try:
+            for mail in batch:
+                try:
+                    connection.send_messages([
+                        EmailMessage(mail.subject, mail.message, mail.from_email, mail.recipients,
+                                     connection=connection)
+                    ])
+                except Exception as e:
+                    failed += _record_failure(mail, e)
+                else:
+                    mail.attempts += 1
+                    mail.status = OutboundEmail.Status.SENT
+                    mail.sent_at = timezone.now()
+                    mail.last_error = ""
+                    mail.message = ""
+                    sent += 1
+        finally:
+            connection.close()
+
+    OutboundEmail.objects.bulk_update(
+        batch, ["status", "attempts", "next_attempt_at", "last_error", "sent_at", "message"])
+    return sent, failed
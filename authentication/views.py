@@ -1,29 +1,41 @@
 from django.contrib.auth import get_user_model
 from django.conf import settings
 from django.core.mail import send_mail
-import random
 import datetime
 from django.utils import timezone
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
-from django.contrib.auth.hashers import make_password
+from .hashing import make_password, check_password
 from rest_framework.exceptions import AuthenticationFailed
 from .serializers import (UserSignupSerializer, LoginSerializer, PasswordChangeRequestSerializer, \
                           UserProfileSerializer, ForgotPasswordRequestSerializer, UserSignupSerializerResendOTP,
                           UserSignupSerializerOTP, ViewUserProfileSerializer)
 from rest_framework_simplejwt.tokens import RefreshToken, AccessToken
-from .utils import EmailThread
+from .utils import queue_mail
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from .models import EmailChangeRequest, PasswordChangeRequest, ForgotPasswordRequest, NameChangeRequest
-from django.utils.timezone import now
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET
+from .authentication import jwt_authenticated
+from .throttling import ThrottledActionsMixin
+from .otp import issue_otp, verify_otp, Purpose, VALID, INVALID
+from .principals import revoke_token
 
 User = get_user_model()
 
 
-class ForgotPasswordViewSet(viewsets.ModelViewSet):
+def otp_error(result):
+    """the 400 response for a failed verify_otp"""
+    if result == INVALID:
+        return Response({"error": "Incorrect OTP."}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({"error": "OTP has expired. Please request a new one."}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class ForgotPasswordViewSet(ThrottledActionsMixin, viewsets.ModelViewSet):
     queryset = ForgotPasswordRequest.objects.all()
     serializer_class = ForgotPasswordRequestSerializer
+    throttle_scopes = {'request_forgot_password': 'otp', 'set_new_password': 'otp', 'resend_otp': 'otp'}
 
     @action(detail=False, methods=['post'], url_path='request-forgot-password')
     def request_forgot_password(self, request):
@@ -36,12 +48,14 @@ class ForgotPasswordViewSet(viewsets.ModelViewSet):
             return Response({"error": "No user found with this email."}, status=status.HTTP_400_BAD_REQUEST)
 
         reset_url = f"https://asluxeryoriginals.pythonanywhere.com/auth/forgot-password/set-new-password/?email={email}"
-        ForgotPasswordRequest.objects.create(user=user)
-        send_mail(
+        # restart the user's pending request instead of adding a row on every call,
+        # keeping a new password already set with its OTP
+        if not ForgotPasswordRequest.objects.filter(user=user).update(created_at=timezone.now()):
+            ForgotPasswordRequest.objects.create(user=user)
+        queue_mail(
             subject='Password Reset Request',
             message=f"Click the following link to reset your password: {reset_url}. This link will expire in 10 minutes.",
             recipient_list=[email],
-            from_email=settings.EMAIL_HOST_USER,
         )
 
         return Response({"message": "A password reset link has been sent to your email."}, status=status.HTTP_200_OK)
@@ -67,21 +81,22 @@ class ForgotPasswordViewSet(viewsets.ModelViewSet):
         if not user:
             return Response({"error": "No user found with this email."}, status=status.HTTP_400_BAD_REQUEST)
         forgot_password_request = ForgotPasswordRequest.objects.filter(user=user).first()
+        if not forgot_password_request:
+            return Response({"error": "No pending forgot password request found."}, status=status.HTTP_400_BAD_REQUEST)
         expiration_time = forgot_password_request.created_at + datetime.timedelta(minutes=10)
         if timezone.now() > expiration_time:
             return Response({"error": "The reset link has expired. Please request a new one."}, status=status.HTTP_400_BAD_REQUEST)
 
         ForgotPasswordRequest.objects.filter(user=user).delete()
-        otp = random.randint(100000, 999999)
+        otp = issue_otp(user.pk, Purpose.PASSWORD_RESET)
 
-        send_mail(
+        queue_mail(
             subject='Forgot Password OTP',
             message=f"Your OTP for password reset is: {otp}. It will expire in 5 minutes.",
             recipient_list=[email],
-            from_email=settings.EMAIL_HOST_USER,
         )
 
-        ForgotPasswordRequest.objects.create(user=user, otp=otp, new_password=new_password)
+        ForgotPasswordRequest.objects.create(user=user, new_password=new_password)
 
         return Response({"message": "An OTP has been sent to your email."}, status=status.HTTP_200_OK)
 
@@ -100,13 +115,13 @@ class ForgotPasswordViewSet(viewsets.ModelViewSet):
         forgot_password_request = ForgotPasswordRequest.objects.filter(user=user).first()
         if not forgot_password_request:
             return Response({"error": "No pending forgot password request found."}, status=status.HTTP_400_BAD_REQUEST)
+        if forgot_password_request.new_password is None:
+            return Response({"error": "Set a new password before verifying the OTP."},
+                            status=status.HTTP_400_BAD_REQUEST)
 
-        if str(forgot_password_request.otp) != str(otp):
-            return Response({"error": "Incorrect OTP."}, status=status.HTTP_400_BAD_REQUEST)
-
-        otp_age = (timezone.now() - forgot_password_request.created_at).total_seconds()
-        if otp_age > 300:
-            return Response({"error": "OTP has expired. Please request a new one."}, status=status.HTTP_400_BAD_REQUEST)
+        result = verify_otp(user.pk, Purpose.PASSWORD_RESET, otp)
+        if result != VALID:
+            return otp_error(result)
 
         user.password = make_password(forgot_password_request.new_password)
         if not user.is_verified:
@@ -139,33 +154,26 @@ class ForgotPasswordViewSet(viewsets.ModelViewSet):
         if not forgot_password_request:
             return Response({"error": "No pending forgot password request found."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Generate a new OTP
-        otp = random.randint(100000, 999999)
-        forgot_password_request.otp = otp
-
-        # Extend the expiration time by 5 minutes from now
-        forgot_password_request.created_at = timezone.now()  # Reset the creation time to current time
-
-        # Save the updated OTP and expiration time
-        forgot_password_request.save()
+        # Generate a new OTP, it replaces the previous one and expires 5 minutes from now
+        otp = issue_otp(user.pk, Purpose.PASSWORD_RESET)
 
         # Send the new OTP to the user
-        send_mail(
+        queue_mail(
             subject='Forgot Password OTP - Resent',
             message=f"Your new OTP for password reset is: {otp}. It will expire in 5 minutes.",
             recipient_list=[email],
-            from_email=settings.EMAIL_HOST_USER,
         )
 
         return Response({"message": "A new OTP has been sent to your email and the expiration time has been extended."}, status=status.HTTP_200_OK)
 
 
-class UserProfileViewSet(viewsets.ModelViewSet):
+class UserProfileViewSet(ThrottledActionsMixin, viewsets.ModelViewSet):
     """
     ViewSet for retrieving and updating the user's profile.
     """
     serializer_class = UserProfileSerializer
     permission_classes = [IsAuthenticated]
+    throttle_scopes = {'request_email_change': 'otp', 'resend_email_change_otp': 'otp'}
 
     def retrieve(self, request, *args, **kwargs):
         """
@@ -187,7 +195,7 @@ class UserProfileViewSet(viewsets.ModelViewSet):
         new_email = serializer.validated_data.get('new_email')
         password = serializer.validated_data.get('password')
 
-        if not user.check_password(password):
+        if not check_password(user, password):
             return Response({"error": "Incorrect password."}, status=status.HTTP_400_BAD_REQUEST)
 
         if User.objects.filter(email=new_email).exists():
@@ -196,20 +204,17 @@ class UserProfileViewSet(viewsets.ModelViewSet):
         # Optional: Check if there is an existing pending request and reuse it
         existing_request = EmailChangeRequest.objects.filter(user=user).first()
         if existing_request:
-            otp = random.randint(100000, 999999)
             existing_request.new_email = new_email
-            existing_request.otp = otp
             existing_request.created_at = timezone.now()
             existing_request.save()
         else:
-            otp = random.randint(100000, 999999)
-            EmailChangeRequest.objects.create(user=user, new_email=new_email, otp=otp)
+            EmailChangeRequest.objects.create(user=user, new_email=new_email)
+        otp = issue_otp(user.pk, Purpose.EMAIL_CHANGE)
 
-        send_mail(
+        queue_mail(
             subject='Email Change OTP',
             message=f"Your OTP is: {otp}",
             recipient_list=[new_email],
-            from_email=settings.EMAIL_HOST_USER,
         )
 
         return Response({"message": "OTP sent to the new email address."}, status=status.HTTP_200_OK)
@@ -230,16 +235,14 @@ class UserProfileViewSet(viewsets.ModelViewSet):
         if time_since_last_otp < 60:
             return Response({"error": "Please wait before requesting a new OTP."}, status=status.HTTP_400_BAD_REQUEST)
 
-        otp = random.randint(100000, 999999)
-        email_change_request.otp = otp
+        otp = issue_otp(user.pk, Purpose.EMAIL_CHANGE)
         email_change_request.created_at = timezone.now()
-        email_change_request.save()
+        email_change_request.save(update_fields=['created_at'])
 
-        send_mail(
+        queue_mail(
             subject='Resend Email Change OTP',
             message=f"Your new OTP is: {otp}",
             recipient_list=[email_change_request.new_email],
-            from_email=settings.EMAIL_HOST_USER,
         )
 
         return Response({"message": "New OTP sent to the new email address."}, status=status.HTTP_200_OK)
@@ -259,25 +262,20 @@ class UserProfileViewSet(viewsets.ModelViewSet):
         if not email_change_request:
             return Response({"error": "No pending email change request found."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Check if OTP matches
-        if str(email_change_request.otp) != str(otp):
-            return Response({"error": "Invalid OTP."}, status=status.HTTP_400_BAD_REQUEST)
-
-        # Check if OTP has expired (5 minutes validity)
-        otp_age = (timezone.now() - email_change_request.created_at).total_seconds()
-        if otp_age > 300:
-            return Response({"error": "OTP has expired. Please request a new one."}, status=status.HTTP_400_BAD_REQUEST)
+        # Check and use up the OTP (5 minutes validity)
+        result = verify_otp(user.pk, Purpose.EMAIL_CHANGE, otp)
+        if result != VALID:
+            return otp_error(result)
 
         user.email = email_change_request.new_email
         user.save()
         email_change_request.delete()
 
         # Send confirmation email
-        send_mail(
+        queue_mail(
             subject='Email Change Confirmation',
             message="Your email address has been successfully changed.",
             recipient_list=[user.email],
-            from_email=settings.EMAIL_HOST_USER,
         )
 
         return Response({"message": "Email updated successfully."}, status=status.HTTP_200_OK)
@@ -324,7 +322,7 @@ class UserProfileViewSet(viewsets.ModelViewSet):
         password = serializer.validated_data.get('password')
 
         # Verify the password provided by the user
-        if not user.check_password(password):
+        if not check_password(user, password):
             return Response({"error": "Incorrect password."}, status=status.HTTP_400_BAD_REQUEST)
 
         # Fetch the latest name change request
@@ -343,23 +341,23 @@ class UserProfileViewSet(viewsets.ModelViewSet):
         user.save()
         name_change_request.delete()
 
-        send_mail(
+        queue_mail(
             subject='Profile Change Confirmation',
             message="Your profile has been successfully updated.",
             recipient_list=[user.email],
-            from_email=settings.EMAIL_HOST_USER,
         )
 
         return Response({"message": "Name updated successfully."}, status=status.HTTP_200_OK)
 
 
-class PasswordChangeRequestViewSet(viewsets.ModelViewSet):
+class PasswordChangeRequestViewSet(ThrottledActionsMixin, viewsets.ModelViewSet):
     """
     Handles password change requests with OTP verification.
     """
     permission_classes = [IsAuthenticated]
     queryset = PasswordChangeRequest.objects.all()
     serializer_class = PasswordChangeRequestSerializer
+    throttle_scopes = {'request_password_change': 'otp', 'resend_otp': 'otp'}
 
     @action(detail=False, methods=['post'], url_path='request-password-change')
     def request_password_change(self, request):
@@ -375,7 +373,7 @@ class PasswordChangeRequestViewSet(viewsets.ModelViewSet):
         if not old_password:
             return Response({"error": "Old password is required."}, status=status.HTTP_400_BAD_REQUEST)
 
-        if not user.check_password(old_password):
+        if not check_password(user, old_password):
             return Response({"error": "Old password is incorrect."}, status=status.HTTP_400_BAD_REQUEST)
 
         # Ensure old and new passwords are not the same
@@ -397,15 +395,14 @@ class PasswordChangeRequestViewSet(viewsets.ModelViewSet):
 
         # Clear previous requests and create a new one
         PasswordChangeRequest.objects.filter(user=user).delete()
-        otp = random.randint(100000, 999999)
+        otp = issue_otp(user.pk, Purpose.PASSWORD_CHANGE)
 
-        send_mail(
+        queue_mail(
             subject='Password Change OTP',
             message=f"Your OTP for password change is: {otp}",
             recipient_list=[user.email],
-            from_email=settings.EMAIL_HOST_USER,
         )
-        PasswordChangeRequest.objects.create(user=user, otp=otp, new_password=new_password)
+        PasswordChangeRequest.objects.create(user=user, new_password=new_password)
 
         return Response({"message": "An OTP has been sent to your email."}, status=status.HTTP_200_OK)
 
@@ -416,21 +413,15 @@ class PasswordChangeRequestViewSet(viewsets.ModelViewSet):
         """
         user = request.user
 
-        password_change_request = PasswordChangeRequest.objects.filter(user=user).first()
-
-        if not password_change_request:
+        if not PasswordChangeRequest.objects.filter(user=user).exists():
             return Response({"error": "No pending password change request found."}, status=status.HTTP_400_BAD_REQUEST)
 
-        otp = random.randint(100000, 999999)
-        password_change_request.otp = otp
-        password_change_request.created_at = timezone.now()
-        password_change_request.save()
+        otp = issue_otp(user.pk, Purpose.PASSWORD_CHANGE)
 
-        send_mail(
+        queue_mail(
             subject='Password Change OTP - Resent',
             message=f"Your new OTP for password change is: {otp}",
             recipient_list=[user.email],
-            from_email=settings.EMAIL_HOST_USER,
         )
         return Response({"message": "A new OTP has been sent to your email."}, status=status.HTTP_200_OK)
 
@@ -450,12 +441,9 @@ class PasswordChangeRequestViewSet(viewsets.ModelViewSet):
         if not password_change_request:
             return Response({"error": "No pending password change request found."}, status=status.HTTP_400_BAD_REQUEST)
 
-        if str(password_change_request.otp) != str(otp):
-            return Response({"error": "Incorrect OTP."}, status=status.HTTP_400_BAD_REQUEST)
-
-        otp_age = (timezone.now() - password_change_request.created_at).total_seconds()
-        if otp_age > 300:
-            return Response({"error": "OTP has expired. Please request a new one."}, status=status.HTTP_400_BAD_REQUEST)
+        result = verify_otp(user.pk, Purpose.PASSWORD_CHANGE, otp)
+        if result != VALID:
+            return otp_error(result)
 
         # Change the user's password
         user.password = make_password(password_change_request.new_password)
@@ -471,20 +459,20 @@ class PasswordChangeRequestViewSet(viewsets.ModelViewSet):
                 token.blacklist()
             except Exception as e:
                 raise AuthenticationFailed('Refresh token is invalid or expired.')
-        send_mail(
+        queue_mail(
             subject='Password changed successfully',
             message=f'Password changed successfully and  you have been logged out. \n Login with your new password',
             recipient_list=[request.user.email],
-            from_email=settings.EMAIL_HOST_USER,
         )
         return Response({"message": "Password changed successfully. You have been logged out."},
                         status=status.HTTP_200_OK)
 
 
-class UserSignupViewSet(viewsets.ViewSet):
+class UserSignupViewSet(ThrottledActionsMixin, viewsets.ViewSet):
     """
     Viewset for handling user signup and OTP verification.
     """
+    throttle_scopes = {'create': 'otp', 'resend_otp': 'otp'}
 
     def create(self, request, *args, **kwargs):
         """
@@ -502,16 +490,12 @@ class UserSignupViewSet(viewsets.ViewSet):
 
         if user:
             if not user.is_verified:
-                otp = random.randint(100000, 999999)
-                user.otp = otp
-                user.otp_created_at = now()
-                user.save()
+                otp = issue_otp(user.pk, Purpose.SIGNUP)
 
-                send_mail(
+                queue_mail(
                     subject='Verify your email',
                     message=f'Your OTP is: {otp}',
                     recipient_list=[email],
-                    from_email=settings.EMAIL_HOST_USER,
                 )
 
                 return Response({"message": f"User already exists but is not verified. OTP resent."},
@@ -520,22 +504,19 @@ class UserSignupViewSet(viewsets.ViewSet):
                 return Response({"error": "User already exists and is verified."}, status=status.HTTP_400_BAD_REQUEST)
 
         # Create new user
-        otp = random.randint(100000, 999999)
-        User.objects.create(
+        user = User.objects.create(
             first_name=serializer.validated_data['first_name'],
             last_name=serializer.validated_data['last_name'],
             email=email,
             password=make_password(password),
             phone_number=phone_number,
-            otp=otp,
-            otp_created_at=now()
         )
+        otp = issue_otp(user.pk, Purpose.SIGNUP)
 
-        send_mail(
+        queue_mail(
             subject='Verify your email',
             message=f'Your OTP is: {otp}',
             recipient_list=[email],
-            from_email=settings.EMAIL_HOST_USER,
         )
 
         return Response({"message": f"Signup successful. OTP sent to your email "}, status=status.HTTP_201_CREATED)
@@ -557,21 +538,17 @@ class UserSignupViewSet(viewsets.ViewSet):
         if user.is_verified:
             return Response({"error": "User is already verified."}, status=status.HTTP_400_BAD_REQUEST)
 
-        if str(user.otp) != otp:
-            return Response({"error": "Invalid OTP."}, status=status.HTTP_400_BAD_REQUEST)
-
-        if now() - user.otp_created_at > datetime.timedelta(minutes=5):
-            return Response({"error": "OTP has expired."}, status=status.HTTP_400_BAD_REQUEST)
+        result = verify_otp(user.pk, Purpose.SIGNUP, otp)
+        if result != VALID:
+            return otp_error(result)
 
         user.is_verified = True
-        user.otp = None
-        user.save()
+        user.save(update_fields=['is_verified'])
 
-        send_mail(
+        queue_mail(
             subject='Signup successful',
             message=f'You have finished the signup verification for Xexplatform. Welcome!',
             recipient_list=[email],
-            from_email=settings.EMAIL_HOST_USER,
         )
 
         refresh = RefreshToken.for_user(user)
@@ -599,27 +576,24 @@ class UserSignupViewSet(viewsets.ViewSet):
         if user.is_verified:
             return Response({"error": "User is already verified."}, status=status.HTTP_400_BAD_REQUEST)
 
-        otp = random.randint(100000, 999999)
-        user.otp = otp
-        user.otp_created_at = now()
-        user.save()
+        otp = issue_otp(user.pk, Purpose.SIGNUP)
 
-        send_mail(
+        queue_mail(
             subject='Resend OTP',
             message=f'Your OTP is: {otp}',
             recipient_list=[email],
-            from_email=settings.EMAIL_HOST_USER,
         )
 
         return Response({"message": f"OTP resent to your email."}, status=status.HTTP_200_OK)
 
 
-class UserLoginViewSet(viewsets.ViewSet):
+class UserLoginViewSet(ThrottledActionsMixin, viewsets.ViewSet):
     """
     Handles user login and token generation.
     """
 
     serializer_class = LoginSerializer
+    throttle_scopes = {'create': 'login'}
 
     def create(self, request, *args, **kwargs):
         if request.method != 'POST':
@@ -637,7 +611,8 @@ class UserLoginViewSet(viewsets.ViewSet):
         if not user.is_verified:
             return Response({'message': 'Please verify your email first'}, status=status.HTTP_400_BAD_REQUEST)
 
-        if not user.check_password(password):
+        # only hash once the cheap checks passed, on the bounded hashing pool
+        if not check_password(user, password):
             return Response({'message': 'Invalid password'}, status=status.HTTP_400_BAD_REQUEST)
 
         # Generate tokens
@@ -645,12 +620,10 @@ class UserLoginViewSet(viewsets.ViewSet):
         access_token = str(refresh.access_token)
 
         # Send login success email
-        send_mail(
+        queue_mail(
             subject='Login Successful',
             message=f'Welcome to XEX Trading! Your account is now active, and you’re ready to start trading.',
             recipient_list=[email],
-            from_email=settings.EMAIL_HOST_USER,
-            fail_silently=True
         )
 
         return Response({
@@ -677,8 +650,18 @@ class LogoutViewSet(viewsets.ViewSet):
             # Invalidate the refresh token
             token = RefreshToken(refresh_token)
             token.blacklist()  # This will invalidate the refresh token
+            if request.auth is not None:
+                # the access token stays valid until it expires otherwise
+                revoke_token(request.auth)
 
             return Response({"detail": "Logout successful."}, status=status.HTTP_200_OK)
         except Exception as e:
             # Handle specific exceptions if necessary
             return Response({"detail": "Error during logout.", "error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+@require_GET
+@jwt_authenticated
+async def profile_async(request):
+    """async version of UserProfileViewSet.retrieve, the user was already loaded by the authentication"""
+    return JsonResponse(ViewUserProfileSerializer(request.user, context={'request': request}).data)
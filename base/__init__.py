@@ -1,2 +0,0 @@
-import pymysql
-pymysql.install_as_MySQLdb()
\ No newline at end of file
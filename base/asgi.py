@@ -8,9 +8,15 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 """
 
 import os
-
+from dotenv import load_dotenv
 from django.core.asgi import get_asgi_application
+load_dotenv()
+
+# Get DJANGO_ENV from .env file (defaults to 'development' if not set)
+django_env = os.getenv("DJANGO_ENV", "development").lower()
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", f"base.settings.{django_env}")
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'base.settings')
+# lets the settings switch to the pooled database backend (see DB_POOL_SIZE)
+os.environ.setdefault("DJANGO_SERVER", "asgi")
 
 application = get_asgi_application()
@@ -0,0 +1,29 @@
+from django.core.exceptions import ImproperlyConfigured
+
+MYSQL_DRIVERS = ("auto", "mysqlclient", "pymysql")
+
+
+def select_mysql_driver(driver="auto"):
+    """
+    Make sure a MySQL driver can be imported before Django loads its mysql backend.
+    mysqlclient is used when it is installed (or required with driver="mysqlclient"),
+    otherwise PyMySQL is installed as MySQLdb.
+    returns the name of the driver in use, raises ImproperlyConfigured when it is missing
+    """
+    if driver not in MYSQL_DRIVERS:
+        raise ImproperlyConfigured(f"DB_DRIVER must be one of {', '.join(MYSQL_DRIVERS)}, got {driver!r}")
+
+    if driver in ("auto", "mysqlclient"):
+        try:
+            import MySQLdb  # noqa: F401
+            return "mysqlclient"
+        except ImportError:
+            if driver == "mysqlclient":
+                raise ImproperlyConfigured("DB_DRIVER is mysqlclient but mysqlclient is not installed")
+
+    try:
+        import pymysql
+    except ImportError:
+        raise ImproperlyConfigured("No MySQL driver found, install mysqlclient or PyMySQL")
+    pymysql.install_as_MySQLdb()
+    return "pymysql"
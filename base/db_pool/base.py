@@ -0,0 +1,49 @@
+"""
+MySQL backend with an in-process connection pool, meant for the ASGI server where
+Django's persistent connections (CONN_MAX_AGE) can't be reused across requests.
+use ENGINE "base.db_pool" with CONN_MAX_AGE 0 and POOL_SIZE in the database settings,
+closing a connection at the end of a request hands it back to the pool
+"""
+import queue
+import threading
+
+from django.db.backends.mysql import base as mysql
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class DatabaseWrapper(mysql.DatabaseWrapper):
+
+    def _get_pool(self):
+        with _pools_lock:
+            if self.alias not in _pools:
+                _pools[self.alias] = queue.LifoQueue(maxsize=self.settings_dict.get("POOL_SIZE", 10))
+            return _pools[self.alias]
+
+    def get_new_connection(self, conn_params):
+        pool = self._get_pool()
+        while True:
+            try:
+                connection = pool.get_nowait()
+            except queue.Empty:
+                return super().get_new_connection(conn_params)
+            # drop connections the server has closed while they were idle
+            try:
+                connection.ping()
+                return connection
+            except Exception:
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+
+    def _close(self):
+        if self.connection is None:
+            return
+        try:
+            # never hand out a connection with an open transaction
+            self.connection.rollback()
+            self._get_pool().put_nowait(self.connection)
+        except Exception:
+            super()._close()
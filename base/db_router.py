@@ -0,0 +1,90 @@
+"""
+Read replica routing.
+reads go to the primary unless a view opted in (ReplicaReadMixin) or code runs inside use_replica(),
+writes always go to the primary, and a user who just wrote keeps reading from the primary
+for REPLICA_STICKY_SECONDS so they never see their own change missing because of replication lag
+"""
+import contextlib
+import contextvars
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.permissions import SAFE_METHODS
+
+PRIMARY = "default"
+
+_read_alias = contextvars.ContextVar("read_alias", default=None)
+
+
+def replica_alias():
+    """the configured replica alias, or None when there is no replica"""
+    alias = settings.DATABASE_REPLICA_ALIAS
+    return alias if alias in settings.DATABASES else None
+
+
+def _sticky_key(user_id):
+    return f"db:primary-pin:{user_id}"
+
+
+def pin_to_primary(user_id):
+    """send the user's reads to the primary for a while, call it when their data changes"""
+    if user_id and replica_alias():
+        cache.set(_sticky_key(user_id), True, settings.REPLICA_STICKY_SECONDS)
+
+
+def is_pinned_to_primary(user_id):
+    return bool(user_id) and cache.get(_sticky_key(user_id), False)
+
+
+@contextlib.contextmanager
+def use_replica(user_id=None):
+    """reads made inside the block go to the replica, unless the user was pinned to the primary"""
+    alias = replica_alias()
+    token = _read_alias.set(None if is_pinned_to_primary(user_id) else alias)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get() or PRIMARY
+
+    def db_for_write(self, model, **hints):
+        # explicit, otherwise django would save an instance back to the database it was read from
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replica holds the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # the replica gets its schema through replication
+        return db != settings.DATABASE_REPLICA_ALIAS
+
+
+class ReplicaReadMixin:
+    """
+    Opt a viewset into replica reads for the actions in `replica_actions`,
+    any other action (and every unsafe method) stays on the primary.
+    unsafe requests pin the user to the primary, see pin_to_primary
+    """
+    replica_actions = ('list', 'retrieve')
+
+    def dispatch(self, request, *args, **kwargs):
+        token = _read_alias.set(None)
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            _read_alias.reset(token)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        user_id = request.user.pk
+        if request.method not in SAFE_METHODS:
+            pin_to_primary(user_id)
+        elif self.action in self.replica_actions and not is_pinned_to_primary(user_id):
+            # reset by dispatch once the response is built
+            _read_alias.set(replica_alias())
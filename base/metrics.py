@@ -0,0 +1,209 @@
+"""
+Per request metrics: SQL queries and their time, serializer, render and total time,
+tagged with the DRF view and action (`DepositViewSet.list`).
+
+RequestMetricsMiddleware logs one record per request on the `base.metrics` logger, the numbers are
+in the record's `metrics` attribute for structured (json) logging, and with METRICS_SERVER_TIMING
+they are sent in a Server-Timing header as well, browsers show it in the network tab.
+
+views declare query budgets per action, `query_budgets = {"list": 4}`. going over one is logged
+as a warning, or raises QueryBudgetExceeded with QUERY_BUDGET_STRICT (see base.testing)
+"""
+import contextlib
+import contextvars
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar("request_metrics", default=None)
+# called with the RequestMetrics of every finished request, see base.testing.capture_requests
+listeners = []
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class RequestMetrics:
+
+    def __init__(self, method, path):
+        self.method = method
+        self.path = path
+        self.view = None
+        self.action = None
+        self.budget = None
+        self.status = None
+        self.queries = 0
+        # seconds
+        self.spans = {"db": 0.0, "serializer": 0.0, "render": 0.0}
+        self.total = None
+        self._open = set()
+        self._start = time.perf_counter()
+
+    @property
+    def endpoint(self):
+        if self.view and self.action:
+            return f"{self.view}.{self.action}"
+        return self.view
+
+    @property
+    def over_budget(self):
+        return self.budget is not None and self.queries > self.budget
+
+    def as_dict(self):
+        return {
+            "method": self.method,
+            "path": self.path,
+            "endpoint": self.endpoint,
+            "status": self.status,
+            "queries": self.queries,
+            "query_budget": self.budget,
+            **{f"{name}_ms": round(seconds * 1000, 2) for name, seconds in self.spans.items()},
+            "total_ms": round(self.total * 1000, 2),
+        }
+
+    def server_timing(self):
+        timings = [f'db;dur={self.spans["db"] * 1000:.1f};desc="{self.queries} queries"']
+        timings += [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.spans.items() if name != "db"]
+        timings.append(f"total;dur={self.total * 1000:.1f}")
+        return ", ".join(timings)
+
+
+@contextlib.contextmanager
+def span(name):
+    """add the time spent in the block to the current request's `name` span, nested blocks count once"""
+    metrics = _current.get()
+    if metrics is None or name in metrics._open:
+        yield
+        return
+    metrics._open.add(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.spans[name] = metrics.spans.get(name, 0.0) + time.perf_counter() - start
+        metrics._open.discard(name)
+
+
+# savepoints are only statements when nested in another transaction, like the one of every TestCase.
+# they aren't counted so a view has the same count in tests and in production
+SAVEPOINT_STATEMENTS = ("SAVEPOINT", "RELEASE SAVEPOINT", "ROLLBACK TO SAVEPOINT")
+
+
+def record_query(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    if not sql.startswith(SAVEPOINT_STATEMENTS):
+        metrics.queries += 1
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.spans["db"] += time.perf_counter() - start
+
+
+def install_query_recorder(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+connection_created.connect(install_query_recorder, dispatch_uid="base.metrics")
+
+
+class TimedSerializerMixin:
+    """counts the serializer's validation and representation in the request's serializer span"""
+
+    def run_validation(self, *args, **kwargs):
+        with span("serializer"):
+            return super().run_validation(*args, **kwargs)
+
+    def to_representation(self, *args, **kwargs):
+        with span("serializer"):
+            return super().to_representation(*args, **kwargs)
+
+
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        # connections opened before this module was loaded missed connection_created
+        for connection in connections.all(initialized_only=True):
+            install_query_recorder(connection)
+        metrics = RequestMetrics(request.method, request.path)
+        token = _current.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(metrics, response)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics(request.method, request.path)
+        token = _current.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(metrics, response)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = _current.get()
+        if metrics is None:
+            return None
+        view_class = getattr(view_func, "cls", None)
+        if view_class is None:
+            metrics.view = view_func.__name__
+            return None
+        metrics.view = view_class.__name__
+        # viewsets map the method to an action, plain APIViews are tagged with the method
+        actions = getattr(view_func, "actions", None) or {}
+        metrics.action = actions.get(request.method.lower(), request.method.lower())
+        metrics.budget = getattr(view_class, "query_budgets", {}).get(metrics.action)
+        return None
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after the view returns, time the rendering too
+        metrics = _current.get()
+        if metrics is not None:
+            start = time.perf_counter()
+
+            def rendered(response):
+                metrics.spans["render"] += time.perf_counter() - start
+
+            response.add_post_render_callback(rendered)
+        return response
+
+    def finish(self, metrics, response):
+        metrics.total = time.perf_counter() - metrics._start
+        metrics.status = response.status_code
+        if settings.METRICS_SERVER_TIMING:
+            response["Server-Timing"] = metrics.server_timing()
+
+        logger.info("%s %s %s %s queries=%d db=%.1fms total=%.1fms", metrics.method, metrics.path, metrics.status,
+                    metrics.endpoint, metrics.queries, metrics.spans["db"] * 1000, metrics.total * 1000,
+                    extra={"metrics": metrics.as_dict()})
+        for listener in listeners:
+            listener(metrics)
+
+        if metrics.over_budget:
+            message = f"{metrics.endpoint} ran {metrics.queries} queries, its budget is {metrics.budget}"
+            if settings.QUERY_BUDGET_STRICT:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message, extra={"metrics": metrics.as_dict()})
+        return response
@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 from pathlib import Path
 import os
 from datetime import timedelta
+from decimal import Decimal
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -53,6 +54,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first, so its total time covers the other middleware
+    'base.metrics.RequestMetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -108,6 +111,30 @@ WSGI_APPLICATION = 'base.wsgi.application'
 # }
 
 
+# Cache
+# locmem is per process, fine for development and tests. production requires REDIS_URL (see production.py)
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv("CACHE_BACKEND", 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv("CACHE_LOCATION", 'brokerapp'),
+        'KEY_PREFIX': 'brokerapp',
+    }
+}
+
+# seconds a cached balance / account summary snapshot is served before it is rebuilt
+BALANCE_CACHE_TTL = int(os.getenv("BALANCE_CACHE_TTL", 300))
+
+
+# Read replica
+# views using base.db_router.ReplicaReadMixin read from this alias when it is in DATABASES,
+# a user who just wrote reads from the primary for REPLICA_STICKY_SECONDS
+
+DATABASE_ROUTERS = ['base.db_router.ReplicaRouter']
+DATABASE_REPLICA_ALIAS = 'replica'
+REPLICA_STICKY_SECONDS = int(os.getenv("REPLICA_STICKY_SECONDS", 10))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -126,6 +153,52 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# request metrics of base.metrics, logged on the base.metrics logger.
+# METRICS_SERVER_TIMING adds the Server-Timing header, QUERY_BUDGET_STRICT raises when a view goes over its query budget
+METRICS_SERVER_TIMING = os.getenv("METRICS_SERVER_TIMING", "false").lower() == "true"
+QUERY_BUDGET_STRICT = os.getenv("QUERY_BUDGET_STRICT", "false").lower() == "true"
+
+# LOG_FORMAT=json writes one json object per record, request metrics included
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'text': {'format': '%(asctime)s %(levelname)s %(name)s %(message)s'},
+        'json': {'()': 'base.log.JSONFormatter'},
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': os.getenv("LOG_FORMAT", "text"),
+            'level': os.getenv("LOG_LEVEL", "INFO"),
+        },
+    },
+    'loggers': {
+        name: {'handlers': ['console'], 'level': 'DEBUG', 'propagate': False}
+        for name in ('base', 'api', 'authentication', 'transactions')
+    },
+}
+
+# password hashing, PASSWORD_HASHER_PROFILE picks the hasher of new hashes: pbkdf2, scrypt or argon2 (needs argon2-cffi).
+# the others stay listed so existing hashes still verify, they are rehashed with the profile on the next login.
+# work factors default to Django's, benchmarks/hashing.py reports logins/sec per core for tuning them
+PASSWORD_HASHER_PROFILE = os.getenv("PASSWORD_HASHER_PROFILE", "pbkdf2")
+PASSWORD_PBKDF2_ITERATIONS = int(os.getenv("PASSWORD_PBKDF2_ITERATIONS", 870000))
+PASSWORD_SCRYPT_WORK_FACTOR = int(os.getenv("PASSWORD_SCRYPT_WORK_FACTOR", 2 ** 14))
+PASSWORD_ARGON2_TIME_COST = int(os.getenv("PASSWORD_ARGON2_TIME_COST", 2))
+PASSWORD_ARGON2_MEMORY_COST = int(os.getenv("PASSWORD_ARGON2_MEMORY_COST", 102400))
+PROFILE_HASHERS = {
+    "pbkdf2": "authentication.hashers.PBKDF2PasswordHasher",
+    "scrypt": "authentication.hashers.ScryptPasswordHasher",
+    "argon2": "authentication.hashers.Argon2PasswordHasher",
+}
+PASSWORD_HASHERS = [PROFILE_HASHERS[PASSWORD_HASHER_PROFILE]] + [
+    hasher for profile, hasher in PROFILE_HASHERS.items() if profile != PASSWORD_HASHER_PROFILE
+]
+
+# authentication.hashing pool: hashes running at once, and how many more may wait before a 503
+PASSWORD_HASHING_WORKERS = int(os.getenv("PASSWORD_HASHING_WORKERS") or os.cpu_count() or 1)
+PASSWORD_HASHING_QUEUE = int(os.getenv("PASSWORD_HASHING_QUEUE", 32))
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
@@ -160,11 +233,37 @@ FLW_SEC_KEY = os.getenv("FLW_SEC_KEY")
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
+    # simplejwt's JWTAuthentication, with the user cached per token when PRINCIPAL_CACHE_TTL is set
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'authentication.authentication.CachedJWTAuthentication',
     ),
+    # token buckets of authentication.throttling, '<scope>.<ip|email|user>': '<burst>/<refill period>'
+    # otp covers every endpoint that sends an OTP or reset mail, login the password check
+    'DEFAULT_THROTTLE_RATES': {
+        'otp.email': os.getenv("THROTTLE_OTP_EMAIL", '5/hour'),
+        'otp.user': os.getenv("THROTTLE_OTP_USER", '5/hour'),
+        'otp.ip': os.getenv("THROTTLE_OTP_IP", '30/hour'),
+        'login.email': os.getenv("THROTTLE_LOGIN_EMAIL", '10/min'),
+        'login.ip': os.getenv("THROTTLE_LOGIN_IP", '60/min'),
+    },
+    # reverse proxies in front of the app, the per-IP buckets key on the address the last of them saw.
+    # 0 uses REMOTE_ADDR and ignores X-Forwarded-For, which any client can set to get a fresh bucket.
+    # behind one load balancer set it to 1, X-Forwarded-For is then only trusted for that hop
+    'NUM_PROXIES': int(os.getenv("NUM_PROXIES", 0)),
 }
 
+# seconds CachedJWTAuthentication keeps a user cached per access token, see authentication/principals.py.
+# 0 loads the user on every request, the default here since locmem isn't shared by the workers
+PRINCIPAL_CACHE_TTL = int(os.getenv("PRINCIPAL_CACHE_TTL", 0))
+
+# upper bound for the ?page_size= a client can ask for on cursor paginated history lists
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", 100))
+
+# authentication.security token codec, "encrypted" (Fernet) or "signed" (readable, tamper proof)
+# TOKEN_ENCRYPTION_KEYS: comma separated Fernet keys, newest first. derived from SECRET_KEY when empty
+TOKEN_CODEC = os.getenv("TOKEN_CODEC", "encrypted")
+TOKEN_ENCRYPTION_KEYS = [key.strip() for key in os.getenv("TOKEN_ENCRYPTION_KEYS", "").split(",") if key.strip()]
+
 SIMPLE_JWT = {
     'AUTH_HEADER_TYPES': ('JWT',),
     'ACCESS_TOKEN_LIFETIME': timedelta(days=1),
@@ -201,3 +300,38 @@ EMAIL_PORT = 465
 EMAIL_HOST_USER = os.getenv("EMAIL")
 EMAIL_HOST_PASSWORD = os.getenv("PASSWORD")
 DEFAULT_FROM_EMAIL = os.getenv("EMAIL")
+
+# outbound mail queue, drained by `python manage.py send_queued_mail --loop`
+MAIL_QUEUE_BATCH_SIZE = int(os.getenv("MAIL_QUEUE_BATCH_SIZE", 50))
+MAIL_QUEUE_MAX_ATTEMPTS = int(os.getenv("MAIL_QUEUE_MAX_ATTEMPTS", 5))
+MAIL_QUEUE_RETRY_DELAY = int(os.getenv("MAIL_QUEUE_RETRY_DELAY", 30))  # seconds, doubled on every retry
+# seconds a worker has to send the batch it claimed before another one may pick it up
+MAIL_QUEUE_CLAIM_TIMEOUT = int(os.getenv("MAIL_QUEUE_CLAIM_TIMEOUT", 300))
+# sent and failed mails are deleted by reap_expired_requests after this many seconds
+MAIL_QUEUE_RETENTION = int(os.getenv("MAIL_QUEUE_RETENTION", 7 * 24 * 3600))
+
+# one time passwords, see authentication/otp.py
+# "db" keeps them in the OneTimePassword table (run purge_otps periodically),
+# "cache" in the default cache, only with a cache shared by every worker e.g redis
+OTP_BACKEND = os.getenv("OTP_BACKEND", "db")
+OTP_TTL = int(os.getenv("OTP_TTL", 300))  # seconds
+OTP_MAX_ATTEMPTS = int(os.getenv("OTP_MAX_ATTEMPTS", 5))
+
+# `python manage.py reap_expired_requests` deletes change requests older than CHANGE_REQUEST_TTL seconds,
+# expired OTPs and refresh tokens, REAPER_BATCH_SIZE rows per statement.
+# REAPER_INTERVAL > 0 also runs it every that many seconds in a thread of each web process
+CHANGE_REQUEST_TTL = int(os.getenv("CHANGE_REQUEST_TTL", 24 * 3600))
+REAPER_BATCH_SIZE = int(os.getenv("REAPER_BATCH_SIZE", 1000))
+REAPER_INTERVAL = int(os.getenv("REAPER_INTERVAL", 0))
+
+# margin levels (percent) announced by `python manage.py run_margin_scanner`, see transactions/scanner.py.
+# it polls the changed account summaries every MARGIN_SCANNER_INTERVAL seconds,
+# re-reading the last MARGIN_SCANNER_OVERLAP seconds of changes to catch rows committed late
+MARGIN_CALL_LEVEL = Decimal(os.getenv("MARGIN_CALL_LEVEL", "100"))
+STOP_OUT_LEVEL = Decimal(os.getenv("STOP_OUT_LEVEL", "50"))
+MARGIN_SCANNER_INTERVAL = float(os.getenv("MARGIN_SCANNER_INTERVAL", 1))
+MARGIN_SCANNER_OVERLAP = float(os.getenv("MARGIN_SCANNER_OVERLAP", 2))
+
+# admin changelists of large tables (transactions.pagination.EstimatedCountPaginator) show the table statistics'
+# row count instead of running COUNT(*), unless it is under this many rows
+ADMIN_EXACT_COUNT_LIMIT = int(os.getenv("ADMIN_EXACT_COUNT_LIMIT", 10000))
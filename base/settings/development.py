@@ -14,8 +14,23 @@ DATABASES = {
     }
 }
 
+# point REPLICA_DB_NAME at a copy of the database to try replica routing locally
+if os.getenv("REPLICA_DB_NAME"):
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.getenv("REPLICA_DB_NAME"),
+        'TEST': {'MIRROR': 'default'},
+    }
+
+# request timings in the browser's network tab, and only warnings on the console (tests included)
+METRICS_SERVER_TIMING = os.getenv("METRICS_SERVER_TIMING", "true").lower() == "true"
+LOGGING['handlers']['console']['level'] = os.getenv("LOG_LEVEL", "WARNING")
+
 # email
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+# mails are written to files by default while developing,
+# set EMAIL_BACKEND=django.core.mail.backends.smtp.EmailBackend to really send them
+EMAIL_BACKEND = os.getenv("EMAIL_BACKEND", 'django.core.mail.backends.filebased.EmailBackend')
+EMAIL_FILE_PATH = BASE_DIR / 'sent_emails'
 EMAIL_USE_SSL = True
 EMAIL_USE_TSL = False
 EMAIL_HOST = 'smtp.gmail.com'
@@ -1,4 +1,6 @@
 from .base import *
+from django.core.exceptions import ImproperlyConfigured
+from base.db import select_mysql_driver
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -7,6 +9,9 @@ DEBUG = os.getenv('DEBUG')
 ALLOWED_HOSTS = ["*"]
 
 
+# fails at startup when the chosen driver (auto, mysqlclient or pymysql) isn't installed
+DB_DRIVER = select_mysql_driver(os.getenv("DB_DRIVER", "auto"))
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.mysql',
@@ -18,10 +23,45 @@ DATABASES = {
         'OPTIONS': {
             'init_command': "SET sql_mode='STRICT_TRANS_TABLES,ERROR_FOR_DIVISION_BY_ZERO,NO_ENGINE_SUBSTITUTION'"
         },
+        # keep connections open between requests, and check them before reuse
+        'CONN_MAX_AGE': int(os.getenv("DB_CONN_MAX_AGE", 60)),
+        'CONN_HEALTH_CHECKS': True,
+    }
+}
 
-        
+# read replica, used by the list/report endpoints when REPLICA_HOST is set
+if os.getenv("REPLICA_HOST"):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': os.getenv("REPLICA_HOST"),
+        'PORT': os.getenv("REPLICA_PORT", DATABASES['default']['PORT']),
+        'USER': os.getenv("REPLICA_USER", DATABASES['default']['USER']),
+        'PASSWORD': os.getenv("REPLICA_PASSWORD", DATABASES['default']['PASSWORD']),
+    }
+
+# under ASGI persistent connections aren't reused across requests, an in-process pool is used instead
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 0))
+if os.getenv("DJANGO_SERVER") == "asgi" and DB_POOL_SIZE > 0:
+    for database in DATABASES.values():
+        database.update({
+            'ENGINE': 'base.db_pool',
+            'CONN_MAX_AGE': 0,
+            'POOL_SIZE': DB_POOL_SIZE,
+        })
+
+# the cache has to be shared by every worker: balance snapshot invalidations, read replica pinning,
+# throttle buckets and cached principals all assume it, a per-process cache would silently break them
+if not os.getenv("REDIS_URL"):
+    raise ImproperlyConfigured("REDIS_URL must be set in production, e.g redis://localhost:6379/0")
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv("REDIS_URL"),
+        'KEY_PREFIX': 'brokerapp',
     }
 }
+# with the cache shared, the user of a request can be cached per access token (no query on most requests)
+PRINCIPAL_CACHE_TTL = int(os.getenv("PRINCIPAL_CACHE_TTL", 60))
 
 # email
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
@@ -0,0 +1,33 @@
+"""
+Test helpers for the request metrics of base.metrics
+"""
+import contextlib
+
+from django.test import override_settings
+
+from . import metrics
+
+
+def enforce_query_budgets(test):
+    """
+    class or method decorator, a request going over its view's query budget raises
+    QueryBudgetExceeded, which the test client re-raises and fails the test with
+    """
+    return override_settings(QUERY_BUDGET_STRICT=True)(test)
+
+
+@contextlib.contextmanager
+def capture_requests():
+    """yields a list that gets the RequestMetrics of every request finished in the block"""
+    captured = []
+    metrics.listeners.append(captured.append)
+    try:
+        yield captured
+    finally:
+        metrics.listeners.remove(captured.append)
+
+
+
+def cached_authentication(test):
+    """class or method decorator, cache the user of a request per token like production does"""
+    return override_settings(PRINCIPAL_CACHE_TTL=60)(test)
@@ -0,0 +1,40 @@
+"""
+Offline benchmarks, run from the project root e.g `python -m benchmarks.serializers`.
+they run against a throwaway test database (in-memory sqlite with the development settings)
+"""
+import contextlib
+import os
+import time
+
+
+def setup_django():
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "base.settings.development")
+    os.environ.setdefault("SECRET_KEY", "benchmark-secret-key")
+    import django
+    django.setup()
+
+
+@contextlib.contextmanager
+def benchmark_database():
+    """create the test database for the duration of the block"""
+    setup_django()
+    from django.test.utils import setup_test_environment, teardown_test_environment, setup_databases, \
+        teardown_databases
+
+    setup_test_environment()
+    old_config = setup_databases(verbosity=0, interactive=False)
+    try:
+        yield
+    finally:
+        teardown_databases(old_config, verbosity=0)
+        teardown_test_environment()
+
+
+def timed(func, repeat=5):
+    """best wall time in seconds of `repeat` calls to func"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
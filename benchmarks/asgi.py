@@ -0,0 +1,147 @@
+"""
+Requests per second of the balance endpoint through the WSGI and ASGI entry points,
+driven in-process with `--concurrency` requests in flight: `--threads` worker threads for WSGI
+(like gunicorn's gthread workers) and concurrent tasks on one event loop for ASGI (like uvicorn).
+
+    python -m benchmarks.asgi [--requests 2000] [--concurrency 64] [--threads 4] [--cold] [--db-latency 2]
+
+--cold disables the balance cache so every request reaches the database,
+--db-latency adds a sleep of that many milliseconds to every query to stand in for a network round trip
+"""
+import argparse
+import asyncio
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from benchmarks import benchmark_database
+
+SCENARIOS = [
+    ("wsgi", "/api/balance/"),
+    ("asgi", "/api/balance/"),
+    ("asgi", "/api/async/balance/"),
+]
+
+
+def add_query_latency(milliseconds):
+    from django.db.backends.signals import connection_created
+
+    def delay(execute, sql, params, many, context):
+        time.sleep(milliseconds / 1000)
+        return execute(sql, params, many, context)
+
+    def install(sender, connection, **kwargs):
+        connection.execute_wrappers.append(delay)
+
+    connection_created.connect(install, weak=False)
+
+
+def wsgi_requests(path, tokens, requests, concurrency, threads):
+    from django.core.handlers.wsgi import WSGIHandler
+    handler = WSGIHandler()
+
+    def call(i):
+        environ = {
+            "REQUEST_METHOD": "GET",
+            "PATH_INFO": path,
+            "QUERY_STRING": "",
+            "SERVER_NAME": "testserver",
+            "SERVER_PORT": "80",
+            "HTTP_AUTHORIZATION": f"JWT {tokens[i % len(tokens)]}",
+            "wsgi.input": io.BytesIO(),
+            "wsgi.url_scheme": "http",
+        }
+        statuses = []
+        response = handler(environ, lambda status, headers: statuses.append(status))
+        b"".join(response)
+        response.close()
+        return statuses[0]
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        return list(pool.map(call, range(requests)))
+
+
+def asgi_requests(path, tokens, requests, concurrency, threads):
+    from django.core.handlers.asgi import ASGIHandler
+    handler = ASGIHandler()
+
+    async def call(i, semaphore):
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "path": path,
+            "query_string": b"",
+            "headers": [(b"host", b"testserver"), (b"authorization", f"JWT {tokens[i % len(tokens)]}".encode())],
+            "server": ("testserver", 80),
+        }
+        body_sent = False
+        statuses = []
+
+        async def receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            # the client never disconnects
+            await asyncio.Future()
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                statuses.append(message["status"])
+
+        async with semaphore:
+            await handler(scope, receive, send)
+        return statuses[0]
+
+    async def run():
+        semaphore = asyncio.Semaphore(concurrency)
+        return await asyncio.gather(*(call(i, semaphore) for i in range(requests)))
+
+    return asyncio.run(run())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--cold", action="store_true")
+    parser.add_argument("--db-latency", type=float, default=0)
+    args = parser.parse_args()
+
+    with benchmark_database():
+        from django.conf import settings
+        from django.contrib.auth import get_user_model
+        from django.core.cache import cache
+        from rest_framework_simplejwt.tokens import AccessToken
+        from transactions.models import Balance
+
+        if args.cold:
+            settings.BALANCE_CACHE_TTL = 0
+        if args.db_latency:
+            add_query_latency(args.db_latency)
+
+        User = get_user_model()
+        users = User.objects.bulk_create(
+            User(email=f"bench{i}@example.com", password="!") for i in range(args.users))
+        Balance.objects.bulk_create(Balance(user=user, amount=Decimal("100.00")) for user in users)
+        tokens = [str(AccessToken.for_user(user)) for user in users]
+
+        runners = {"wsgi": wsgi_requests, "asgi": asgi_requests}
+        for server, path in SCENARIOS:
+            cache.clear()
+            start = time.perf_counter()
+            statuses = runners[server](path, tokens, args.requests, args.concurrency, args.threads)
+            seconds = time.perf_counter() - start
+            failed = sum(status not in (200, "200 OK") for status in statuses)
+            print(f"{server:<5} {path:<22} {args.requests / seconds:8.0f} req/s"
+                  + (f"  ({failed} failed)" if failed else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Per-request database connection overhead with and without persistent connections.
+every simulated request goes through Django's request_started/request_finished
+connection handling and runs one query.
+
+    python -m benchmarks.connections [--requests 2000]
+
+runs against a sqlite file, and against MySQL as well when BENCH_MYSQL_NAME
+(plus BENCH_MYSQL_USER, BENCH_MYSQL_PASSWORD, BENCH_MYSQL_HOST, BENCH_MYSQL_PORT) is set,
+e.g a local `docker run -e MYSQL_ALLOW_EMPTY_PASSWORD=1 -p 3306:3306 mysql:8` stand-in
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks import setup_django
+
+
+def databases(tmp_dir):
+    yield "sqlite", {"ENGINE": "django.db.backends.sqlite3", "NAME": os.path.join(tmp_dir, "bench.sqlite3")}
+
+    if os.getenv("BENCH_MYSQL_NAME"):
+        from base.db import select_mysql_driver
+        select_mysql_driver(os.getenv("DB_DRIVER", "auto"))
+        mysql = {
+            "NAME": os.getenv("BENCH_MYSQL_NAME"),
+            "USER": os.getenv("BENCH_MYSQL_USER", "root"),
+            "PASSWORD": os.getenv("BENCH_MYSQL_PASSWORD", ""),
+            "HOST": os.getenv("BENCH_MYSQL_HOST", "127.0.0.1"),
+            "PORT": os.getenv("BENCH_MYSQL_PORT", "3306"),
+        }
+        yield "mysql", {"ENGINE": "django.db.backends.mysql", **mysql}
+        yield "mysql pool", {"ENGINE": "base.db_pool", "POOL_SIZE": 4, **mysql}
+
+
+def per_request(settings_dict, requests):
+    """mean seconds per simulated request"""
+    from django.db import connections
+    from django.db.utils import load_backend
+
+    # fills in the defaults Django adds to every DATABASES entry
+    settings_dict = connections.configure_settings({"default": settings_dict})["default"]
+    wrapper = load_backend(settings_dict["ENGINE"]).DatabaseWrapper(settings_dict, "bench")
+    try:
+        start = time.perf_counter()
+        for _ in range(requests):
+            # what django.db.close_old_connections does on request_started/request_finished
+            wrapper.close_if_unusable_or_obsolete()
+            with wrapper.cursor() as cursor:
+                cursor.execute("SELECT 1")
+                cursor.fetchone()
+            wrapper.close_if_unusable_or_obsolete()
+        return (time.perf_counter() - start) / requests
+    finally:
+        wrapper.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+    setup_django()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, settings_dict in databases(tmp_dir):
+            modes = [("CONN_MAX_AGE=0", {"CONN_MAX_AGE": 0})]
+            if settings_dict["ENGINE"] != "base.db_pool":
+                modes.append(("persistent + health checks", {"CONN_MAX_AGE": 60, "CONN_HEALTH_CHECKS": True}))
+            for mode, options in modes:
+                seconds = per_request({**settings_dict, **options}, args.requests)
+                print(f"{name:<12} {mode:<28} {seconds * 1e6:8.1f} us/request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Synthetic data for the benchmarks: users with deposits, withdrawals and the balances they add up to.
+rows are bulk created (no ledger entries), the same seed always gives the same data
+"""
+import random
+from decimal import Decimal
+
+PASSWORD = "benchmark-password"
+
+
+def create_users(count, staff=0, prefix="bench"):
+    """`count` verified users, the first `staff` of them staff, all with PASSWORD"""
+    from django.contrib.auth import get_user_model
+    from django.contrib.auth.hashers import make_password
+
+    User = get_user_model()
+    # hashing is deliberately slow, every user shares one hash
+    password = make_password(PASSWORD)
+    return User.objects.bulk_create(
+        User(email=f"{prefix}{i}@example.com", password=password, first_name="Bench", last_name=str(i),
+             is_verified=True, is_staff=i < staff)
+        for i in range(count))
+
+
+def create_transactions(users, per_user, verified=0.8, seed=0, batch_size=2000):
+    """
+    `per_user` deposits and as many withdrawals for each user, a `verified` share of them verified,
+    and a Balance per user holding verified deposits minus verified withdrawals
+    """
+    from transactions.models import Deposit, Withdrawal, Balance
+
+    rng = random.Random(seed)
+    deposits, withdrawals, balances = [], [], []
+    for user in users:
+        total = Decimal("0.00")
+        for _ in range(per_user):
+            amount = Decimal(rng.randrange(1000, 100000)) / 100
+            is_verified = rng.random() < verified
+            deposits.append(Deposit(user=user, amount=amount, is_verified=is_verified))
+            total += amount if is_verified else 0
+        for _ in range(per_user):
+            amount = Decimal(rng.randrange(100, 10000)) / 100
+            is_verified = rng.random() < verified
+            withdrawals.append(Withdrawal(user=user, amount=amount, is_verified=is_verified))
+            total -= amount if is_verified else 0
+        balances.append(Balance(user=user, amount=total))
+
+    Deposit.objects.bulk_create(deposits, batch_size=batch_size)
+    Withdrawal.objects.bulk_create(withdrawals, batch_size=batch_size)
+    Balance.objects.bulk_create(balances, batch_size=batch_size)
+    return len(deposits), len(withdrawals)
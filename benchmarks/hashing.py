@@ -0,0 +1,49 @@
+"""
+Password checks per second per core for each hasher profile, and through the hashing pool
+with all of its workers busy, to tune the PASSWORD_* work factors against login traffic.
+
+    python -m benchmarks.hashing [--checks 20] [--workers 4]
+"""
+import argparse
+import importlib.util
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks import setup_django
+
+
+def checks_per_second(check, checks, workers):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        assert all(pool.map(lambda _: check(), range(checks)))
+    return checks / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--checks", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    from django.contrib.auth.hashers import make_password, verify_password
+    from django.utils.module_loading import import_string
+
+    for profile, hasher in settings.PROFILE_HASHERS.items():
+        if profile == "argon2" and not importlib.util.find_spec("argon2"):
+            continue
+        encoded = make_password("correct horse battery staple", hasher=import_string(hasher)())
+
+        def check():
+            return verify_password("correct horse battery staple", encoded)[0]
+
+        single = checks_per_second(check, args.checks, 1)
+        pooled = checks_per_second(check, args.checks * args.workers, args.workers)
+        print(f"{profile:<7} {1000 / single:7.1f} ms/check  {single:6.1f} logins/s per core"
+              f"  {pooled:7.1f} logins/s on {args.workers} workers")
+
+
+if __name__ == "__main__":
+    main()
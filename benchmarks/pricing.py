@@ -0,0 +1,89 @@
+"""
+Compute time of marking open positions to market with transactions.pricing: repricing every position,
+the per-user profit/loss and margin sums and each user's Decimal figures, on a synthetic in-memory book.
+--db also runs the whole reprice() (load, compute, bulk writes) against the throwaway sqlite database.
+
+    python -m benchmarks.pricing [--positions 100000] [--users 10000] [--symbols 50] [--db 20000]
+"""
+import argparse
+import time
+from decimal import Decimal
+
+from benchmarks import benchmark_database, setup_django, timed
+
+
+def synthetic_book(positions, users, symbols, seed=0):
+    import numpy as np
+    from transactions.pricing import PositionBook
+
+    rng = np.random.default_rng(seed)
+    prices = rng.uniform(1, 2000, symbols)
+    symbol_index = rng.integers(0, symbols, positions)
+    open_prices = prices[symbol_index] * rng.uniform(0.95, 1.05, positions)
+    volumes = rng.uniform(0.01, 10, positions).round(2)
+    book = PositionBook(
+        ids=np.arange(positions),
+        user_ids=rng.integers(0, users, positions),
+        symbols=[f"SYM{i}" for i in symbol_index],
+        sides=rng.choice(["buy", "sell"], positions),
+        volumes=volumes,
+        open_prices=open_prices,
+        current_prices=open_prices,
+        margins=(volumes * open_prices / 100).round(2),
+    )
+    tick = {f"SYM{i}": price * 1.001 for i, price in enumerate(prices)}
+    return book, tick
+
+
+def run_db(positions, users):
+    from benchmarks.data import create_users
+    from transactions.margin import recompute_summaries
+    from transactions.models import Balance, Position
+    from transactions.pricing import reprice
+
+    users = create_users(users)
+    Balance.objects.bulk_create(Balance(user=user, amount=Decimal("10000.00")) for user in users)
+    Position.objects.bulk_create(
+        (Position(user=users[i % len(users)], symbol=f"SYM{i % 50}", side="buy" if i % 3 else "sell",
+                  volume=Decimal("1.5"), leverage=100, open_price=Decimal("100"), current_price=Decimal("100"),
+                  margin=Decimal("1.50"))
+         for i in range(positions)), batch_size=2000)
+    recompute_summaries()
+
+    start = time.perf_counter()
+    count = reprice({f"SYM{i}": Decimal("101.25") for i in range(50)})
+    seconds = time.perf_counter() - start
+    print(f"reprice() with the database: {count} positions in {seconds * 1000:.0f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--positions", type=int, default=100000)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--symbols", type=int, default=50)
+    parser.add_argument("--db", type=int, default=0, metavar="POSITIONS")
+    args = parser.parse_args()
+
+    setup_django()
+    from transactions.margin import derived_figures
+    from transactions.pricing import AMOUNT_PLACES, mark_to_market, to_decimal
+
+    book, tick = synthetic_book(args.positions, args.users, args.symbols)
+    balance = Decimal("10000.00")
+
+    def compute():
+        _, _, profit_loss, margin = mark_to_market(book, tick)
+        for pl, used in zip(profit_loss.tolist(), margin.tolist()):
+            derived_figures(balance, to_decimal(pl, AMOUNT_PLACES), to_decimal(used, AMOUNT_PLACES))
+
+    seconds = timed(compute)
+    print(f"{args.positions} positions, {len(book.users)} users: {seconds * 1000:.1f} ms compute "
+          f"({seconds / args.positions * 1e9:.0f} ns/position)")
+
+    if args.db:
+        with benchmark_database():
+            run_db(args.db, max(1, args.db // 10))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Per-row cost of serializing manage list rows: model instances through the
+SerializerMethodField vs the flat .values() path of UserdataListSerializer.
+
+    python -m benchmarks.serializers [--rows 10000]
+"""
+import argparse
+from decimal import Decimal
+
+from benchmarks import benchmark_database, timed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=100)
+    args = parser.parse_args()
+
+    with benchmark_database():
+        from django.contrib.auth import get_user_model
+        from django.db.models import F
+        from rest_framework import serializers
+        from transactions.models import Deposit
+        from transactions.serializers import ManagerDepositSerializer
+
+        User = get_user_model()
+        users = User.objects.bulk_create(
+            User(email=f"bench{i}@example.com", password="!") for i in range(args.users))
+        Deposit.objects.bulk_create(
+            Deposit(user=users[i % len(users)], amount=Decimal(i % 1000) + Decimal("0.25"))
+            for i in range(args.rows))
+
+        def instances():
+            queryset = Deposit.objects.select_related("user")
+            return serializers.ListSerializer(child=ManagerDepositSerializer(), instance=queryset).data
+
+        def flat():
+            queryset = Deposit.objects.values("user_id", "id", "amount", "is_verified", "timestamp",
+                                              user_email=F("user__email"))
+            return ManagerDepositSerializer(queryset, many=True).data
+
+        assert instances() == flat()
+        for name, func in (("instances + SerializerMethodField", instances), ("flat .values() rows", flat)):
+            seconds = timed(func)
+            print(f"{name:<36} {seconds * 1000:8.1f} ms total  {seconds / args.rows * 1e6:6.2f} us/row")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""
+Latency, throughput and queries per request of the main API flows, run in-process against
+a throwaway sqlite database filled by benchmarks.data.
+
+    python -m benchmarks.suite [--users 200] [--per-user 50] [--requests 300] [--only login,balance]
+                               [--save baseline.json] [--compare baseline.json] [--threshold 10]
+
+--save writes the results as json (not when a request failed), --compare diffs them against a saved run and exits with 1
+when a scenario's p95 grew by more than --threshold percent or it runs more queries per request.
+throttles are disabled and sent mail is only queued, so the numbers are the views' own
+"""
+import argparse
+import datetime
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks import benchmark_database
+
+
+class Context:
+    """clients and data shared by the scenarios"""
+
+    def __init__(self, users, staff):
+        from rest_framework.test import APIClient
+        from rest_framework_simplejwt.tokens import AccessToken
+
+        self.users = users
+        self.staff = staff
+        self.anonymous = APIClient()
+        self.clients = []
+        for user in users[:50]:
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION=f"JWT {AccessToken.for_user(user)}")
+            self.clients.append(client)
+        self.staff_client = APIClient()
+        self.staff_client.credentials(HTTP_AUTHORIZATION=f"JWT {AccessToken.for_user(staff)}")
+
+    def client(self, i):
+        return self.clients[i % len(self.clients)]
+
+
+def login(context, i):
+    from benchmarks.data import PASSWORD
+    user = context.users[i % len(context.users)]
+    return context.anonymous.post("/auth/login/", {"email": user.email, "password": PASSWORD}, format="json")
+
+
+def balance(context, i):
+    return context.client(i).get("/api/balance/")
+
+
+def deposit_create(context, i):
+    return context.client(i).post("/api/deposits/", {"amount": "25.00"}, format="json")
+
+
+def deposit_verify(context, i):
+    # verifies the deposits deposit_create left pending, one per request
+    from transactions.models import Deposit
+    pending = Deposit.objects.filter(is_verified=False).values_list("id", flat=True).first()
+    return context.staff_client.post("/api/manage/deposits/bulk-verify/", {"ids": [pending]}, format="json")
+
+
+def manage_list(context, i):
+    return context.staff_client.get("/api/manage/deposits/")
+
+
+def manage_search(context, i):
+    user = context.users[i % len(context.users)]
+    return context.staff_client.get("/api/manage/deposits/", {"search": user.email})
+
+
+def history_paging(context, i):
+    """one page of deposit history, every 5th request starts over from the first page"""
+    client = context.client(i)
+    cursor = getattr(client, "next_page", None)
+    response = client.get(cursor if cursor and i % 5 else "/api/deposits/")
+    client.next_page = response.data.get("next")
+    return response
+
+
+SCENARIOS = {
+    "login": login,
+    "balance": balance,
+    "deposit_create": deposit_create,
+    "deposit_verify": deposit_verify,
+    "manage_list": manage_list,
+    "manage_search": manage_search,
+    "history_paging": history_paging,
+}
+
+
+def percentile(sorted_values, percent):
+    """nearest rank percentile"""
+    index = max(0, min(len(sorted_values) - 1, round(percent / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def run_scenario(scenario, context, requests):
+    from base.testing import capture_requests
+
+    latencies = []
+    errors = 0
+    with capture_requests() as captured:
+        start = time.perf_counter()
+        for i in range(requests):
+            request_start = time.perf_counter()
+            response = scenario(context, i)
+            latencies.append(time.perf_counter() - request_start)
+            errors += response.status_code >= 400
+        seconds = time.perf_counter() - start
+
+    latencies.sort()
+    queries = [metrics.queries for metrics in captured]
+    return {
+        "requests": requests,
+        "errors": errors,
+        "req_per_s": round(requests / seconds, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "queries_per_request": round(statistics.mean(queries), 2) if queries else 0,
+        "max_queries": max(queries, default=0),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results):
+    print(f"{'scenario':<15} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8} {'errors':>7}")
+    for name, result in results.items():
+        print(f"{name:<15} {result['req_per_s']:>8} {result['p50_ms']:>8} {result['p95_ms']:>8} "
+              f"{result['p99_ms']:>8} {result['queries_per_request']:>8} {result['errors']:>7}")
+
+
+def compare(results, baseline, threshold):
+    """prints the change of every scenario against the baseline, returns the names of the regressed ones"""
+    regressions = []
+    print(f"\nagainst {baseline.get('commit') or 'baseline'} ({baseline.get('created')})")
+    for name, result in results.items():
+        before = baseline["scenarios"].get(name)
+        if before is None:
+            print(f"{name:<15} new")
+            continue
+        p95_change = (result["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100 if before["p95_ms"] else 0
+        rate_change = (result["req_per_s"] - before["req_per_s"]) / before["req_per_s"] * 100 \
+            if before["req_per_s"] else 0
+        query_change = result["queries_per_request"] - before["queries_per_request"]
+        regressed = p95_change > threshold or query_change > 0
+        if regressed:
+            regressions.append(name)
+        print(f"{name:<15} p95 {p95_change:+7.1f}%  req/s {rate_change:+7.1f}%  queries {query_change:+6.2f}"
+              + ("  REGRESSION" if regressed else ""))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--per-user", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--only", help="comma separated scenarios, all by default")
+    parser.add_argument("--save", metavar="FILE")
+    parser.add_argument("--compare", metavar="FILE")
+    parser.add_argument("--threshold", type=float, default=10, help="p95 growth in percent counted as a regression")
+    args = parser.parse_args()
+
+    names = args.only.split(",") if args.only else list(SCENARIOS)
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    with benchmark_database():
+        from django.conf import settings
+        from django.test import override_settings
+        from benchmarks.data import create_users, create_transactions
+
+        users = create_users(args.users + 1, staff=1)
+        create_transactions(users, args.per_user)
+        context = Context(users[1:], staff=users[0])
+
+        results = {}
+        # override_settings makes DRF reload its api_settings, assigning the setting doesn't
+        with override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, "DEFAULT_THROTTLE_RATES": {}}):
+            for name in names:
+                results[name] = run_scenario(SCENARIOS[name], context, args.requests)
+        print_results(results)
+
+    run = {
+        "commit": git_commit(),
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "config": {"users": args.users, "per_user": args.per_user, "requests": args.requests},
+        "scenarios": results,
+    }
+    failed = [name for name, result in results.items() if result["errors"]]
+    if args.save and failed:
+        sys.exit(f"\nnot saved to {args.save}, requests failed in: {', '.join(failed)}")
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(run, file, indent=2)
+        print(f"\nsaved to {args.save}")
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if baseline.get("config") != run["config"]:
+            print(f"\nwarning: baseline was run with {baseline.get('config')}")
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
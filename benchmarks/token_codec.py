@@ -0,0 +1,58 @@
+"""
+Encode/decode throughput of the token codec modes, against the JWT inside Fernet scheme
+authentication.security used before (two HMACs and an AES pass per token).
+
+    python -m benchmarks.token_codec [--iterations 20000]
+"""
+import argparse
+import time
+
+from benchmarks import setup_django
+
+PAYLOAD = {"user_id": 1234, "email": "bench@example.com", "purpose": "password_reset", "exp": 4102444800}
+
+
+def jwt_fernet_codec(secret):
+    import jwt
+    from cryptography.fernet import Fernet
+    fernet = Fernet(Fernet.generate_key())
+
+    def encode(payload):
+        return fernet.encrypt(jwt.encode(payload, secret, algorithm="HS256").encode()).decode()
+
+    def decode(token):
+        return jwt.decode(fernet.decrypt(token.encode()).decode(), secret, algorithms=["HS256"])
+
+    return encode, decode
+
+
+def ops_per_second(func, arg, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func(arg)
+    return iterations / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    from authentication import security
+
+    codecs = {"jwt+fernet (old)": jwt_fernet_codec(settings.SECRET_KEY)}
+    for mode in ("encrypted", "signed"):
+        codec = security.get_codec(mode)
+        codecs[mode] = codec.encode, codec.decode
+
+    for name, (encode, decode) in codecs.items():
+        token = encode(PAYLOAD)
+        assert decode(token) == PAYLOAD
+        print(f"{name:<17} encode {ops_per_second(encode, PAYLOAD, args.iterations):9.0f}/s"
+              f"  decode {ops_per_second(decode, token, args.iterations):9.0f}/s  {len(token):4d} bytes")
+
+
+if __name__ == "__main__":
+    main()
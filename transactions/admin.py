@@ -1,46 +1,124 @@
+from django.conf import settings
 from django.contrib import admin
-from .models import Deposit, Withdrawal, Balance, AccountSummary
+from django.db import transaction
+from .cache import invalidate_users
+from .margin import recompute_summaries
+from .models import Deposit, Withdrawal, Balance, AccountSummary, LedgerEntry, Position
+from .pagination import EstimatedCountPaginator
 
-admin.site.register(Balance)
 
-# Register your models here.
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Changelist settings for the tables that grow with every user: the user of each row is joined in
+    rather than fetched per row, searching matches the start of the user's email so the unique index
+    on it can be used, and there is no COUNT(*) over the whole table (see EstimatedCountPaginator)
+    """
+    list_select_related = ("user",)
+    search_fields = ("^user__email",)
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+    list_per_page = 10
+
+
+class SummarySourceAdmin(LargeTableAdmin):
+    """
+    Balances and positions feed the account summaries. their model delete() keeps the summary up
+    to date, the "delete selected" action deletes in bulk without it, so the users it touched are
+    recomputed afterwards
+    """
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            user_ids = set(queryset.values_list("user_id", flat=True))
+            super().delete_queryset(request, queryset)
+            recompute_summaries(user_ids)
+        invalidate_users(user_ids)
+
+
+@admin.register(Balance)
+class BalanceAdmin(SummarySourceAdmin):
+    list_display = ("id", "user", "amount")
 
 
 @admin.register(Deposit)
-class DepositAdmin(admin.ModelAdmin):
-    list_display = ("id", "user", "amount", "is_verified")
+class DepositAdmin(LargeTableAdmin):
+    list_display = ("id", "user", "amount", "is_verified", "timestamp")
     list_editable = ("is_verified",)
-    list_per_page = 10
     list_filter = ("is_verified",)
-    search_fields = ("user__username",)
-    ordering = ('timestamp', 'is_verified')
+    date_hierarchy = "timestamp"
+    # newest first, along deposit_ts_idx
+    ordering = ("-timestamp",)
 
     class Meta:
         model = Deposit
 
 
 @admin.register(Withdrawal)
-class WithdrawalAdmin(admin.ModelAdmin):
-    list_display = ("id", "user", "amount", "is_verified")
+class WithdrawalAdmin(LargeTableAdmin):
+    list_display = ("id", "user", "amount", "is_verified", "timestamp")
     list_editable = ("is_verified",)
-    list_per_page = 10
     list_filter = ("is_verified",)
-    search_fields = ("user__username",)
-    ordering = ('timestamp', 'is_verified')
+    date_hierarchy = "timestamp"
+    # newest first, along withdrawal_ts_idx
+    ordering = ("-timestamp",)
 
     class Meta:
         model = Withdrawal
 
 
+class MarginStatusFilter(admin.SimpleListFilter):
+    """the accounts below MARGIN_CALL_LEVEL / STOP_OUT_LEVEL, read through summary_margin_level_idx"""
+    title = "margin status"
+    parameter_name = "margin_status"
+
+    def lookups(self, request, model_admin):
+        return (("margin_call", "Margin call"), ("stop_out", "Stop out"))
+
+    def queryset(self, request, queryset):
+        if self.value() == "margin_call":
+            return queryset.filter(margin__gt=0, margin_level__lt=settings.MARGIN_CALL_LEVEL)
+        if self.value() == "stop_out":
+            return queryset.filter(margin__gt=0, margin_level__lt=settings.STOP_OUT_LEVEL)
+        return queryset
+
+
 @admin.register(AccountSummary)
-class AccountSummaryAdmin(admin.ModelAdmin):
-    list_display = ("id", "user", "profit_loss", "margin",
-                    "free_margin", "margin_level", "opened_position")
-    list_editable = ("profit_loss", "margin", "free_margin",
-                     "margin_level", "opened_position")
-    list_per_page = 10
-    search_fields = ("user__username",)
-    ordering = ("opened_position", "-free_margin")
+class AccountSummaryAdmin(LargeTableAdmin):
+    """the figures are derived from the balance and positions (transactions.margin), they can't be edited"""
+    list_display = ("id", "user", "balance", "profit_loss", "equity", "margin",
+                    "free_margin", "margin_level", "opened_position", "updated_at")
+    readonly_fields = ("balance", "profit_loss", "equity", "margin", "free_margin", "margin_level", "opened_position")
+    list_filter = (MarginStatusFilter,)
+    # the latest changes first, along the updated_at index. the margin status filter lists the accounts at risk
+    ordering = ("-updated_at",)
 
     class Meta:
         model = AccountSummary
+
+
+@admin.register(Position)
+class PositionAdmin(SummarySourceAdmin):
+    list_display = ("id", "user", "symbol", "side", "volume", "open_price", "current_price", "margin",
+                    "profit_loss", "opened_at", "closed_at")
+    readonly_fields = ("margin", "profit_loss")
+    # filtering on symbol would list every distinct symbol of the table on each page, search it instead
+    list_filter = ("side",)
+    search_fields = ("^user__email", "=symbol")
+    raw_id_fields = ("user",)
+
+
+@admin.register(LedgerEntry)
+class LedgerEntryAdmin(LargeTableAdmin):
+    """ledger entries are append-only, they can be looked at but never changed"""
+    list_display = ("id", "user", "sequence", "kind", "amount", "balance_after", "timestamp")
+    list_filter = ("kind",)
+    date_hierarchy = "timestamp"
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
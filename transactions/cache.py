@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+
+def balance_key(user_id):
+    return f"balance:{user_id}"
+
+
+def account_summary_key(user_id):
+    return f"account-summary:{user_id}"
+
+
+def get_snapshot(key, build):
+    """
+    Return the cached snapshot stored under `key`, calling `build()` to
+    create (and cache) it when it is missing or has expired.
+    """
+    snapshot = cache.get(key)
+    if snapshot is None:
+        snapshot = build()
+        cache.set(key, snapshot, settings.BALANCE_CACHE_TTL)
+    return snapshot
+
+
+def invalidate_user(user_id):
+    """
+    Drop the user's cached balance and account summary once the current transaction commits,
+    so a concurrent read can't put the old values back before the change is visible
+    """
+    transaction.on_commit(lambda: cache.delete_many([balance_key(user_id), account_summary_key(user_id)]))
+
+
+def invalidate_users(user_ids):
+    """invalidate_user for many users at once"""
+    keys = [key for user_id in user_ids for key in (balance_key(user_id), account_summary_key(user_id))]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+async def aget_snapshot(key, build):
+    """async get_snapshot, `build` is a coroutine function"""
+    snapshot = await cache.aget(key)
+    if snapshot is None:
+        snapshot = await build()
+        await cache.aset(key, snapshot, settings.BALANCE_CACHE_TTL)
+    return snapshot
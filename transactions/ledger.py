@@ -0,0 +1,138 @@
+from collections import defaultdict
+from decimal import Decimal
+from django.db import transaction, IntegrityError
+from django.db.models import F, Sum, Count
+from .models import Balance, Deposit, Withdrawal, LedgerEntry
+from .cache import invalidate_user
+from .margin import apply_changes
+from base.db_router import pin_to_primary
+
+BULK_BATCH_SIZE = 1000
+
+
+def _apply_to_balance(user_id, amount, entries=1):
+    """
+    Add `amount` to the user's balance and reserve `entries` ledger sequence numbers
+    in a single UPDATE, creating the balance row on first use.
+    Returns the new (amount, sequence) of the balance.
+    """
+    invalidate_user(user_id)
+    pin_to_primary(user_id)
+    changes = {"amount": F("amount") + amount, "sequence": F("sequence") + entries}
+    if Balance.objects.filter(user_id=user_id).update(**changes):
+        apply_changes(user_id, balance=amount)
+    else:
+        try:
+            with transaction.atomic():
+                # saving the new row computes the account summary as well
+                Balance.objects.create(user_id=user_id, amount=amount, sequence=entries)
+        except IntegrityError:
+            # another worker created the row first, apply on top of it
+            Balance.objects.filter(user_id=user_id).update(**changes)
+            apply_changes(user_id, balance=amount)
+
+    # the row is locked by the update until the surrounding transaction ends
+    return Balance.objects.filter(user_id=user_id).values_list("amount", "sequence").get()
+
+
+def post_entry(user_id, amount, kind, deposit=None, withdrawal=None):
+    """Apply a signed amount to the user's balance and append the matching ledger entry."""
+    amount = Decimal(amount)
+    with transaction.atomic():
+        balance_after, sequence = _apply_to_balance(user_id, amount)
+        return LedgerEntry.objects.create(
+            user_id=user_id,
+            sequence=sequence,
+            kind=kind,
+            amount=amount,
+            balance_after=balance_after,
+            deposit=deposit,
+            withdrawal=withdrawal,
+        )
+
+
+def verify_deposit(deposit):
+    """
+    Mark an unverified deposit as verified and credit the balance.
+    returns the ledger entry, or None when the deposit was already verified
+    """
+    with transaction.atomic():
+        if not Deposit.objects.filter(pk=deposit.pk, is_verified=False).update(is_verified=True):
+            return None
+        deposit.is_verified = True
+        return post_entry(deposit.user_id, deposit.amount, LedgerEntry.Kind.DEPOSIT, deposit=deposit)
+
+
+def verify_withdrawal(withdrawal):
+    """
+    Mark an unverified withdrawal as verified and debit the balance.
+    returns the ledger entry, or None when the withdrawal was already verified
+    """
+    with transaction.atomic():
+        if not Withdrawal.objects.filter(pk=withdrawal.pk, is_verified=False).update(is_verified=True):
+            return None
+        withdrawal.is_verified = True
+        return post_entry(withdrawal.user_id, -Decimal(withdrawal.amount),
+                          LedgerEntry.Kind.WITHDRAWAL, withdrawal=withdrawal)
+
+
+def reverse_deposit(deposit):
+    """Take a verified deposit back out of the balance e.g before deleting it"""
+    return post_entry(deposit.user_id, -Decimal(deposit.amount), LedgerEntry.Kind.REVERSAL, deposit=deposit)
+
+
+def reverse_withdrawal(withdrawal):
+    """Put a verified withdrawal back into the balance e.g before deleting it"""
+    return post_entry(withdrawal.user_id, withdrawal.amount, LedgerEntry.Kind.REVERSAL, withdrawal=withdrawal)
+
+
+def _bulk_verify(model, queryset, sign, kind, reference):
+    """
+    Verify every unverified row of `queryset` set-wise: one UPDATE on is_verified,
+    one grouped Sum per user for the balances and batched ledger inserts.
+    returns the ids that were verified by this call
+    """
+    with transaction.atomic():
+        rows = list(queryset.filter(is_verified=False).select_for_update()
+                    .order_by("id").values_list("id", "user_id", "amount"))
+        if not rows:
+            return []
+        ids = [pk for pk, user_id, amount in rows]
+        model.objects.filter(pk__in=ids).update(is_verified=True)
+
+        rows_by_user = defaultdict(list)
+        for pk, user_id, amount in rows:
+            rows_by_user[user_id].append((pk, amount))
+
+        totals = (model.objects.filter(pk__in=ids).order_by()
+                  .values("user_id").annotate(total=Sum("amount"), count=Count("id")))
+        entries = []
+        for row in totals:
+            total = sign * row["total"]
+            balance_after, sequence = _apply_to_balance(row["user_id"], total, row["count"])
+
+            # number the user's entries from the start of the reserved sequence range
+            running = balance_after - total
+            first_sequence = sequence - row["count"] + 1
+            for offset, (pk, amount) in enumerate(rows_by_user[row["user_id"]]):
+                running += sign * amount
+                entries.append(LedgerEntry(
+                    user_id=row["user_id"],
+                    sequence=first_sequence + offset,
+                    kind=kind,
+                    amount=sign * amount,
+                    balance_after=running,
+                    **{f"{reference}_id": pk},
+                ))
+        LedgerEntry.objects.bulk_create(entries, batch_size=BULK_BATCH_SIZE)
+        return ids
+
+
+def bulk_verify_deposits(queryset):
+    """verify all pending deposits in the queryset, see _bulk_verify"""
+    return _bulk_verify(Deposit, queryset, 1, LedgerEntry.Kind.DEPOSIT, "deposit")
+
+
+def bulk_verify_withdrawals(queryset):
+    """verify all pending withdrawals in the queryset, see _bulk_verify"""
+    return _bulk_verify(Withdrawal, queryset, -1, LedgerEntry.Kind.WITHDRAWAL, "withdrawal")
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from transactions.margin import recompute_summaries, BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = ("Rebuild every account summary from the balances and open positions, in batches of users. "
+            "summaries are kept up to date incrementally, this repairs them e.g after a bulk import")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="users per batch")
+        parser.add_argument("--user", type=int, action="append", dest="users", help="only this user id, repeatable")
+
+    def handle(self, *args, **options):
+        count = recompute_summaries(options["users"], batch_size=options["batch_size"])
+        self.stdout.write(f"account summaries updated: {count}")
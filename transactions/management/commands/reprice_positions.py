@@ -0,0 +1,24 @@
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand, CommandError
+
+from transactions.pricing import reprice, CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = "Mark every open position of the given symbols to market and refresh the account summaries"
+
+    def add_arguments(self, parser):
+        parser.add_argument("prices", nargs="+", metavar="SYMBOL=PRICE")
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="users per transaction")
+
+    def handle(self, *args, **options):
+        prices = {}
+        for tick in options["prices"]:
+            symbol, _, price = tick.partition("=")
+            try:
+                prices[symbol] = Decimal(price)
+            except InvalidOperation:
+                raise CommandError(f"expected SYMBOL=PRICE, got {tick!r}")
+        count = reprice(prices, chunk_size=options["chunk_size"])
+        self.stdout.write(f"positions repriced: {count}")
@@ -0,0 +1,42 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from transactions.scanner import MarginScanner
+
+logger = logging.getLogger("transactions.scanner")
+
+
+class Command(BaseCommand):
+    help = ("Watch the account summaries and announce the accounts falling below MARGIN_CALL_LEVEL "
+            "or STOP_OUT_LEVEL, runs until interrupted")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, default=None,
+                            help="seconds between passes (default: MARGIN_SCANNER_INTERVAL)")
+        parser.add_argument("--once", action="store_true", help="announce the accounts below a level and exit")
+
+    def handle(self, *args, **options):
+        interval = options["interval"] if options["interval"] is not None else settings.MARGIN_SCANNER_INTERVAL
+        scanner = MarginScanner()
+        events = scanner.start()
+        self.stdout.write(f"accounts below the margin call level: {len(scanner.watchlist)}, "
+                          f"stopped out: {sum(event.kind == 'stop_out' for event in events)}")
+        if options["once"]:
+            return
+
+        try:
+            while True:
+                started = time.monotonic()
+                try:
+                    scanner.scan()
+                except Exception:
+                    logger.exception("margin scan failed")
+                    # start the next pass on a fresh connection
+                    connection.close()
+                time.sleep(max(0.0, interval - (time.monotonic() - started)))
+        except KeyboardInterrupt:
+            pass
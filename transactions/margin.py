@@ -0,0 +1,146 @@
+"""
+Account summary figures, derived from the user's balance and open positions:
+
+    profit_loss   sum of the open positions' profit/loss
+    margin        sum of the open positions' margin, volume * open price / leverage
+    equity        balance + profit_loss
+    free_margin   equity - margin
+    margin_level  equity / margin in percent, 0 without open positions
+
+every balance or position change is applied incrementally by apply_changes: a single UPDATE adds
+the difference to the stored sums and computes the derived fields from the old values plus that
+difference, so nothing is re-read or summed again and concurrent changes can't overwrite each other.
+recompute_summaries rebuilds them from scratch, set-wise for batches of users
+(manage.py recompute_account_summaries)
+"""
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import transaction, IntegrityError
+from django.db.models import F, Sum, Count, Case, When, Value, DecimalField, ExpressionWrapper
+from django.db.models.functions import Coalesce, Now
+from django.db.models.lookups import GreaterThan
+
+from .cache import invalidate_user, invalidate_users
+from .models import AccountSummary, Balance, Position
+
+CENT = Decimal("0.01")
+SUMMARY_FIELDS = ("balance", "profit_loss", "equity", "margin", "free_margin", "margin_level", "opened_position")
+BATCH_SIZE = 1000
+
+
+def position_figures(side, volume, leverage, open_price, current_price):
+    """(margin, profit_loss) of a position"""
+    volume, open_price, current_price = Decimal(volume), Decimal(open_price), Decimal(current_price)
+    margin = volume * open_price / leverage
+    profit_loss = (current_price - open_price) * volume
+    if side == Position.Side.SELL:
+        profit_loss = -profit_loss
+    return margin.quantize(CENT), profit_loss.quantize(CENT)
+
+
+def derived_figures(balance, profit_loss, margin):
+    """{equity, free_margin, margin_level} of an account"""
+    equity = balance + profit_loss
+    return {
+        "equity": equity,
+        "free_margin": equity - margin,
+        "margin_level": (equity * 100 / margin).quantize(CENT) if margin > 0 else Decimal(0),
+    }
+
+
+def apply_changes(user_id, balance=0, profit_loss=0, margin=0, positions=0):
+    """add the differences to the user's summary, creating it from the current figures if it doesn't exist"""
+    if not (balance or profit_loss or margin or positions):
+        return
+    invalidate_user(user_id)
+
+    new_balance = F("balance") + Value(Decimal(balance))
+    new_profit_loss = F("profit_loss") + Value(Decimal(profit_loss))
+    new_margin = F("margin") + Value(Decimal(margin))
+    equity = new_balance + new_profit_loss
+    changes = {
+        "balance": new_balance,
+        "profit_loss": new_profit_loss,
+        "margin": new_margin,
+        "opened_position": Coalesce(F("opened_position"), 0) + positions,
+        "equity": equity,
+        "free_margin": equity - new_margin,
+        # a float factor so sqlite doesn't do integer division on whole amounts
+        "margin_level": Case(
+            When(GreaterThan(new_margin, 0),
+                 then=ExpressionWrapper(equity * Value(100.0) / new_margin, output_field=DecimalField())),
+            default=Value(Decimal(0)),
+        ),
+        # update() skips auto_now
+        "updated_at": Now(),
+    }
+    summaries = AccountSummary.objects.filter(user_id=user_id)
+    if not summaries.update(**changes):
+        try:
+            with transaction.atomic():
+                # the balance and positions already include the change
+                recompute_summaries([user_id])
+        except IntegrityError:
+            # another worker created the row first, apply on top of it
+            summaries.update(**changes)
+
+
+def _recompute_batch(user_ids):
+    balances = dict(Balance.objects.filter(user_id__in=user_ids).values_list("user_id", "amount"))
+    positions = {
+        row["user_id"]: row
+        for row in Position.objects.filter(user_id__in=user_ids, closed_at__isnull=True).order_by()
+        .values("user_id").annotate(profit_loss=Sum("profit_loss"), margin=Sum("margin"), count=Count("id"))
+    }
+    summaries = {summary.user_id: summary for summary in AccountSummary.objects.filter(user_id__in=user_ids)}
+
+    changed, created = [], []
+    for user_id in user_ids:
+        summary = summaries.get(user_id)
+        if summary is None and user_id not in balances and user_id not in positions:
+            continue
+        open_positions = positions.get(user_id, {})
+        figures = {
+            "balance": balances.get(user_id, Decimal(0)),
+            "profit_loss": open_positions.get("profit_loss") or Decimal(0),
+            "margin": open_positions.get("margin") or Decimal(0),
+            "opened_position": open_positions.get("count", 0),
+        }
+        figures.update(derived_figures(figures["balance"], figures["profit_loss"], figures["margin"]))
+        if summary is None:
+            created.append(AccountSummary(user_id=user_id, **figures))
+        elif any(getattr(summary, field) != value for field, value in figures.items()):
+            for field, value in figures.items():
+                setattr(summary, field, value)
+            summary.updated_at = Now()
+            changed.append(summary)
+
+    AccountSummary.objects.bulk_update(changed, SUMMARY_FIELDS + ("updated_at",), batch_size=BATCH_SIZE)
+    AccountSummary.objects.bulk_create(created, batch_size=BATCH_SIZE)
+    if created:
+        # auto_now stamps the new rows with the app's clock, the scanner compares updated_at with the database's
+        AccountSummary.objects.filter(user_id__in=[summary.user_id for summary in created]).update(updated_at=Now())
+    invalidate_users([summary.user_id for summary in changed + created])
+    return len(changed) + len(created)
+
+
+def recompute_summaries(user_ids=None, batch_size=BATCH_SIZE):
+    """
+    rebuild the summaries of `user_ids`, or of every user, from their balance and open positions,
+    `batch_size` users at a time with three reads and a bulk write per batch.
+    users with neither get no summary. returns the number of summaries created or changed
+    """
+    if user_ids is not None:
+        user_ids = list(user_ids)
+        return sum(_recompute_batch(user_ids[i:i + batch_size]) for i in range(0, len(user_ids), batch_size))
+
+    users = get_user_model().objects.order_by("pk").values_list("pk", flat=True)
+    count, last = 0, None
+    while True:
+        batch = list((users.filter(pk__gt=last) if last is not None else users)[:batch_size])
+        if not batch:
+            return count
+        with transaction.atomic():
+            count += _recompute_batch(batch)
+        last = batch[-1]
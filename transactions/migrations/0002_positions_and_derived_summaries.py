@@ -0,0 +1,72 @@
+# Generated by Django 5.1.6 on 2026-10-18 14:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='accountsummary',
+            name='balance',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=20),
+        ),
+        migrations.AddField(
+            model_name='accountsummary',
+            name='equity',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=20),
+        ),
+        migrations.AlterField(
+            model_name='accountsummary',
+            name='free_margin',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=20),
+        ),
+        migrations.AlterField(
+            model_name='accountsummary',
+            name='margin',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=20),
+        ),
+        migrations.AlterField(
+            model_name='accountsummary',
+            name='margin_level',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=20),
+        ),
+        migrations.AlterField(
+            model_name='accountsummary',
+            name='opened_position',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='accountsummary',
+            name='profit_loss',
+            field=models.DecimalField(decimal_places=2, default=0.0, editable=False, max_digits=10),
+        ),
+        migrations.CreateModel(
+            name='Position',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('symbol', models.CharField(max_length=20)),
+                ('side', models.CharField(choices=[('buy', 'Buy'), ('sell', 'Sell')], max_length=4)),
+                ('volume', models.DecimalField(decimal_places=4, max_digits=20)),
+                ('leverage', models.PositiveIntegerField(default=100)),
+                ('open_price', models.DecimalField(decimal_places=6, max_digits=20)),
+                ('current_price', models.DecimalField(decimal_places=6, max_digits=20)),
+                ('margin', models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=20)),
+                ('profit_loss', models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=20)),
+                ('opened_at', models.DateTimeField(auto_now_add=True)),
+                ('closed_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='positions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ('-opened_at',),
+                'indexes': [models.Index(fields=['user', 'closed_at'], name='position_user_open_idx'), models.Index(condition=models.Q(('closed_at__isnull', True)), fields=['symbol'], name='position_open_symbol_idx')],
+            },
+        ),
+    ]
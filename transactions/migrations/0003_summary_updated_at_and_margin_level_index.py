@@ -0,0 +1,24 @@
+# Generated by Django 5.1.6 on 2026-10-18 16:05
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0002_positions_and_derived_summaries'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='accountsummary',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='accountsummary',
+            index=models.Index(condition=models.Q(('margin__gt', 0)), fields=['margin_level'], name='summary_margin_level_idx'),
+        ),
+    ]
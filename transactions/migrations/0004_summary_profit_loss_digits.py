@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-18 15:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0003_summary_updated_at_and_margin_level_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='accountsummary',
+            name='profit_loss',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=20),
+        ),
+    ]
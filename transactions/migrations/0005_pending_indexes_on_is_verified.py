@@ -0,0 +1,31 @@
+# Generated by Django 5.1.6 on 2026-10-18 15:31
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0004_summary_profit_loss_digits'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='deposit',
+            name='deposit_pending_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='withdrawal',
+            name='withdrawal_pending_idx',
+        ),
+        migrations.AddIndex(
+            model_name='deposit',
+            index=models.Index(fields=['is_verified', 'timestamp'], name='deposit_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='withdrawal',
+            index=models.Index(fields=['is_verified', 'timestamp'], name='withdrawal_pending_idx'),
+        ),
+    ]
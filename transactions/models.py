@@ -1,84 +1,154 @@
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.db.models import Sum
 from decimal import Decimal
+from .cache import invalidate_user
 
 
 class Balance(models.Model):
     user = models.OneToOneField(
         settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     amount = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
+    # sequence number of the latest LedgerEntry applied to this balance
+    sequence = models.PositiveBigIntegerField(default=0, editable=False)
 
     def __str__(self):
-        return f"{self.user.username} - {self.amount}"
+        return f"{self.user.email} - {self.amount}"
+
+    def save(self, *args, **kwargs):
+        from .margin import recompute_summaries
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            # balances changed through the ledger update the summary incrementally,
+            # a saved row can have any amount so the user's summary is recomputed
+            recompute_summaries([self.user_id])
+        invalidate_user(self.user_id)
+
+    def delete(self, *args, **kwargs):
+        from .margin import recompute_summaries
+
+        invalidate_user(self.user_id)
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            recompute_summaries([self.user_id])
+            return result
+
+
+class LedgerEntry(models.Model):
+    """
+    Append-only record of every change applied to a user's balance.
+    entries are numbered per user, so `sequence` of the latest entry
+    always matches Balance.sequence
+    """
+
+    class Kind(models.TextChoices):
+        DEPOSIT = "deposit", "Deposit"
+        WITHDRAWAL = "withdrawal", "Withdrawal"
+        REVERSAL = "reversal", "Reversal"
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL,
+                             on_delete=models.CASCADE, related_name="ledger_entries")
+    sequence = models.PositiveBigIntegerField()
+    kind = models.CharField(max_length=20, choices=Kind.choices)
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    balance_after = models.DecimalField(max_digits=12, decimal_places=2)
+    deposit = models.ForeignKey("Deposit", on_delete=models.SET_NULL,
+                                null=True, blank=True, related_name="ledger_entries")
+    withdrawal = models.ForeignKey("Withdrawal", on_delete=models.SET_NULL,
+                                   null=True, blank=True, related_name="ledger_entries")
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ("user", "sequence")
+        verbose_name_plural = "Ledger Entries"
+        constraints = [
+            models.UniqueConstraint(fields=["user", "sequence"], name="unique_ledger_sequence_per_user"),
+        ]
+
+    def __str__(self):
+        return f"{self.user.email} - #{self.sequence} {self.kind} {self.amount}"
 
 
 class Deposit(models.Model):
+    # user lookups are covered by the (user, -timestamp) index below
     user = models.ForeignKey(settings.AUTH_USER_MODEL,
-                             on_delete=models.CASCADE)
+                             on_delete=models.CASCADE, db_index=False)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     is_verified = models.BooleanField(default=False)
     timestamp = models.DateTimeField(auto_now_add=True)
 
     class Meta:
-        ordering = ("-timestamp","is_verified")
+        ordering = ("-timestamp", "is_verified")
+        indexes = [
+            # a user's own history, newest first
+            models.Index(fields=["user", "-timestamp"], name="deposit_user_ts_idx"),
+            # staff lists ordered by timestamp across all users
+            models.Index(fields=["timestamp"], name="deposit_ts_idx"),
+            # staff queue of rows waiting for verification, oldest first. not a partial index:
+            # MySQL would drop the condition and duplicate deposit_ts_idx
+            models.Index(fields=["is_verified", "timestamp"], name="deposit_pending_idx"),
+        ]
 
     def __str__(self):
-        return f"{self.user.username} - Deposit - {self.amount}"
+        return f"{self.user.email} - Deposit - {self.amount}"
 
     def save(self, *args, **kwargs):
         """increase the balance if deposit is just verified and vice versa"""
-        print("calling the save method of Deposit")
+        from .ledger import post_entry
+
         try:
-            # forcing to make sure the status is false when a deposit is just created
-            if not self.pk:
-                self.is_verified = False
-            else:
-                old_deposit = Deposit.objects.get(pk=self.pk)
-                old_verified = old_deposit.is_verified
-                old_amount = Decimal(old_deposit.amount)
-
-                instance_verified = self.is_verified
-                instance_amount = Decimal(self.amount)
-
-                value = Decimal(0)
-
-                if old_verified and not instance_verified:
-                    # we want to subtract from balance because we have added it when it was first verified
-                    value -= old_amount
-                    print(f'subtract amount:{value} from balance')
-                elif instance_verified and not old_verified:
-                    value += instance_amount
-                    print(f'add verified amount :{value} to balance')
-                elif instance_verified and old_verified:
-                    value += instance_amount - old_amount
-                    print(f'adjust the amount to be added to balance, amount:{value}')
-
-                if value != 0:
-                    balance, created = Balance.objects.get_or_create(
-                        user=old_deposit.user)
-                    balance.amount += value
-                    balance.save()
-                    print(f'updating balance with {value},new Balance: {balance.amount} ')
+            with transaction.atomic():
+                # forcing to make sure the status is false when a deposit is just created
+                if not self.pk:
+                    self.is_verified = False
+                else:
+                    # lock the row so two concurrent saves can't both apply the same change
+                    old_verified, old_amount = Deposit.objects.select_for_update().filter(
+                        pk=self.pk).values_list("is_verified", "amount").get()
 
-            super().save(*args, **kwargs)
+                    value = Decimal(0)
+                    kind = LedgerEntry.Kind.DEPOSIT
+                    if old_verified and not self.is_verified:
+                        # we want to subtract from balance because we have added it when it was first verified
+                        value -= Decimal(old_amount)
+                        kind = LedgerEntry.Kind.REVERSAL
+                    elif self.is_verified and not old_verified:
+                        value += Decimal(self.amount)
+                    elif self.is_verified and old_verified:
+                        value += Decimal(self.amount) - Decimal(old_amount)
+
+                    if value != 0:
+                        post_entry(self.user_id, value, kind, deposit=self)
+
+                super().save(*args, **kwargs)
         except Exception as e:
             raise ValidationError(f"An error occurred while saving the deposit:{str(e)}")
 
 
 class Withdrawal(models.Model):
+    # user lookups are covered by the (user, -timestamp) index below
     user = models.ForeignKey(settings.AUTH_USER_MODEL,
-                             on_delete=models.CASCADE)
+                             on_delete=models.CASCADE, db_index=False)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     is_verified = models.BooleanField(default=False)
     timestamp = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ("-timestamp", "is_verified")
+        indexes = [
+            # a user's own history, newest first
+            models.Index(fields=["user", "-timestamp"], name="withdrawal_user_ts_idx"),
+            # staff lists ordered by timestamp across all users
+            models.Index(fields=["timestamp"], name="withdrawal_ts_idx"),
+            # staff queue of rows waiting for verification, oldest first. not a partial index:
+            # MySQL would drop the condition and duplicate withdrawal_ts_idx
+            models.Index(fields=["is_verified", "timestamp"], name="withdrawal_pending_idx"),
+        ]
 
     def __str__(self):
-        return f"{self.user.username} - Withdrawal - {self.amount}"
+        return f"{self.user.email} - Withdrawal - {self.amount}"
 
     def clean(self):
         balance = Balance.objects.get(user=self.user)
@@ -87,51 +157,138 @@ class Withdrawal(models.Model):
 
     def save(self, *args, **kwargs):
         """Adjust the balance when a withdrawal is verified or unverified."""
-        print("Calling the save method of Withdrawal")
+        from .ledger import post_entry
+
         try:
-            # Ensure that a newly created withdrawal is not marked as verified
-            if not self.pk:
-                self.is_verified = False
-            else:
-                old_withdrawal = Withdrawal.objects.get(pk=self.pk)
-                old_verified = old_withdrawal.is_verified
-                old_amount = Decimal(old_withdrawal.amount)
-
-                instance_verified = self.is_verified
-                instance_amount = Decimal(self.amount)
-
-                value = Decimal(0)
-                if old_verified and not instance_verified:
-                    value += old_amount
-                    print(f'add amount :{value} back to balance')
-                elif not old_verified and instance_verified:
-                    value -= instance_amount 
-                    print(f'subtract amount:{value}  from balance')
-                elif old_verified and instance_verified:
-                    value -= instance_amount - old_amount
-                    print(f'adjust the amount to be added to balance, amount:{value}')
-
-                if value != 0:
-                    balance, created = Balance.objects.get_or_create(user=self.user)
-                    balance.amount += value
-                    balance.save()
-                    print(f"Balance updated by {value}. New balance: {balance.amount}")
+            with transaction.atomic():
+                # Ensure that a newly created withdrawal is not marked as verified
+                if not self.pk:
+                    self.is_verified = False
+                else:
+                    old_verified, old_amount = Withdrawal.objects.select_for_update().filter(
+                        pk=self.pk).values_list("is_verified", "amount").get()
 
-            super().save(*args, **kwargs)
+                    value = Decimal(0)
+                    kind = LedgerEntry.Kind.WITHDRAWAL
+                    if old_verified and not self.is_verified:
+                        value += Decimal(old_amount)
+                        kind = LedgerEntry.Kind.REVERSAL
+                    elif not old_verified and self.is_verified:
+                        value -= Decimal(self.amount)
+                    elif old_verified and self.is_verified:
+                        value -= Decimal(self.amount) - Decimal(old_amount)
+
+                    if value != 0:
+                        post_entry(self.user_id, value, kind, withdrawal=self)
+
+                super().save(*args, **kwargs)
         except Exception as e:
             raise ValidationError(f"An error occurred while saving the withdrawal: {str(e)}")
 
 
 class AccountSummary(models.Model):
+    """
+    Figures of the user's account, all derived from their Balance and open Positions
+    and kept up to date by transactions.margin, never edited by hand
+    """
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
-    profit_loss = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
-    margin = models.DecimalField(max_digits=20, decimal_places=2, default=0)
-    free_margin = models.DecimalField(max_digits=20, decimal_places=2, default=0)
-    margin_level = models.DecimalField(max_digits=20, decimal_places=2, default=0)
-    opened_position = models.IntegerField(null=True, blank=True)
+    balance = models.DecimalField(max_digits=20, decimal_places=2, default=0, editable=False)
+    profit_loss = models.DecimalField(max_digits=20, decimal_places=2, default=0, editable=False)
+    equity = models.DecimalField(max_digits=20, decimal_places=2, default=0, editable=False)
+    margin = models.DecimalField(max_digits=20, decimal_places=2, default=0, editable=False)
+    free_margin = models.DecimalField(max_digits=20, decimal_places=2, default=0, editable=False)
+    margin_level = models.DecimalField(max_digits=20, decimal_places=2, default=0, editable=False)
+    opened_position = models.IntegerField(null=True, blank=True, editable=False)
+    # set on every change, transactions.scanner reads the summaries changed since its last pass
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
-        return f"Margin used by {self.user.username}: Margin level:{self.margin_level}"
+        return f"Margin used by {self.user.email}: Margin level:{self.margin_level}"
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        invalidate_user(self.user_id)
+
+    def delete(self, *args, **kwargs):
+        invalidate_user(self.user_id)
+        return super().delete(*args, **kwargs)
 
     class Meta:
         verbose_name_plural = "Account Summaries"
+        indexes = [
+            # accounts with open positions by margin level, the ones close to a margin call first
+            models.Index(fields=["margin_level"], condition=models.Q(margin__gt=0), name="summary_margin_level_idx"),
+        ]
+
+
+class Position(models.Model):
+    """
+    A trade of the user. while it is open (closed_at is null) its margin and profit/loss
+    count in the user's AccountSummary
+    """
+
+    class Side(models.TextChoices):
+        BUY = "buy", "Buy"
+        SELL = "sell", "Sell"
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="positions",
+                             db_index=False)
+    symbol = models.CharField(max_length=20)
+    side = models.CharField(max_length=4, choices=Side.choices)
+    volume = models.DecimalField(max_digits=20, decimal_places=4)
+    leverage = models.PositiveIntegerField(default=100)
+    open_price = models.DecimalField(max_digits=20, decimal_places=6)
+    current_price = models.DecimalField(max_digits=20, decimal_places=6)
+    # derived from the fields above on save
+    margin = models.DecimalField(max_digits=20, decimal_places=2, default=0, editable=False)
+    profit_loss = models.DecimalField(max_digits=20, decimal_places=2, default=0, editable=False)
+    opened_at = models.DateTimeField(auto_now_add=True)
+    closed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ("-opened_at",)
+        indexes = [
+            # the open positions of a user, what the account summary is made of
+            models.Index(fields=["user", "closed_at"], name="position_user_open_idx"),
+            # repricing every open position of a symbol
+            models.Index(fields=["symbol"], condition=models.Q(closed_at__isnull=True), name="position_open_symbol_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.user.email} - {self.side} {self.volume} {self.symbol}"
+
+    @property
+    def is_open(self):
+        return self.closed_at is None
+
+    def save(self, *args, **kwargs):
+        """derive margin and profit/loss, and apply the difference it makes to the account summary"""
+        from .margin import position_figures, apply_changes
+
+        self.margin, self.profit_loss = position_figures(self.side, self.volume, self.leverage, self.open_price,
+                                                         self.current_price)
+        with transaction.atomic():
+            old = None
+            if self.pk:
+                # lock the row so two concurrent saves can't both apply the same change
+                old = Position.objects.select_for_update().filter(pk=self.pk).values(
+                    "profit_loss", "margin", "closed_at").first()
+            super().save(*args, **kwargs)
+
+            profit_loss, margin, positions = Decimal(0), Decimal(0), 0
+            if old and old["closed_at"] is None:
+                profit_loss, margin, positions = -old["profit_loss"], -old["margin"], -1
+            if self.is_open:
+                profit_loss, margin, positions = profit_loss + self.profit_loss, margin + self.margin, positions + 1
+            apply_changes(self.user_id, profit_loss=profit_loss, margin=margin, positions=positions)
+
+    def delete(self, *args, **kwargs):
+        from .margin import apply_changes
+
+        with transaction.atomic():
+            old = Position.objects.select_for_update().filter(pk=self.pk).values(
+                "profit_loss", "margin", "closed_at").first()
+            result = super().delete(*args, **kwargs)
+            if old and old["closed_at"] is None:
+                apply_changes(self.user_id, profit_loss=-old["profit_loss"], margin=-old["margin"], positions=-1)
+            return result
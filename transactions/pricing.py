@@ -0,0 +1,145 @@
+"""
+Mark to market of open positions with NumPy.
+
+a tick is a {symbol: price} dict. the open positions are loaded as arrays (symbol index, direction,
+volume, open price, margin, user index) so repricing them all is one vectorized expression, and the
+per-user profit/loss and margin are grouped sums instead of a loop over positions. the arrays hold
+fixed point integers (prices in millionths, volumes in ten thousandths, amounts in cents, the decimal
+places of the model fields), so the profit/loss is exact and rounded half to even like
+transactions.margin.position_figures, and the per-user sums are added to the Decimal balance with
+transactions.margin.derived_figures: the figures are exactly the margin engine's.
+positions and account summaries are written back with bulk_update.
+
+reprice() works through the users holding the ticked symbols `chunk_size` at a time, each chunk in
+its own transaction. it locks the positions (by pk) before the summaries, the order Position.save
+takes them in, and a ledger change racing it is applied on top of the repriced figures rather
+than overwritten
+"""
+from decimal import Decimal
+
+import numpy as np
+from django.db import transaction
+from django.db.models.functions import Now
+
+from .cache import invalidate_users
+from .margin import derived_figures
+from .models import AccountSummary, Position
+
+CHUNK_SIZE = 5000
+
+# decimal places of the fixed point arrays
+PRICE_PLACES, VOLUME_PLACES, AMOUNT_PLACES = 6, 4, 2
+
+
+def fixed_point(values, places):
+    """
+    numbers (Decimals, or floats in the benchmarks) as integers in units of 10**-places, rounded half
+    to even. int64 unless a value doesn't fit, then Python ints in an object array
+    """
+    scaled = [int(Decimal(value).scaleb(places).to_integral_value()) for value in values]
+    if all(-2 ** 63 < value < 2 ** 63 for value in scaled):
+        return np.array(scaled, dtype=np.int64)
+    return np.array(scaled, dtype=object)
+
+
+def to_decimal(value, places):
+    """a fixed point integer back to a Decimal with `places` decimal places"""
+    return Decimal(int(value)).scaleb(-places)
+
+
+def round_half_even(values, divisor):
+    """integer division of fixed point values rounding half to even, the Decimal default"""
+    quotient, remainder = values // divisor, values % divisor
+    return quotient + ((2 * remainder > divisor) | ((2 * remainder == divisor) & (quotient % 2 == 1)))
+
+
+class PositionBook:
+    """open positions as parallel fixed point arrays, users[user_index[i]] holds position i"""
+
+    def __init__(self, ids, user_ids, symbols, sides, volumes, open_prices, current_prices, margins):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.users, self.user_index = np.unique(np.asarray(user_ids, dtype=np.int64), return_inverse=True)
+        self.symbols, self.symbol_index = np.unique(np.asarray(symbols, dtype=object), return_inverse=True)
+        self.direction = np.where(np.asarray(sides) == Position.Side.SELL, -1, 1)
+        self.volume = fixed_point(volumes, VOLUME_PLACES)
+        self.open_price = fixed_point(open_prices, PRICE_PLACES)
+        self.current_price = fixed_point(current_prices, PRICE_PLACES)
+        self.margin = fixed_point(margins, AMOUNT_PLACES)
+
+    @classmethod
+    def load(cls, queryset):
+        rows = list(queryset.order_by("pk").values_list("id", "user_id", "symbol", "side", "volume",
+                                                        "open_price", "current_price", "margin"))
+        return cls(*zip(*rows)) if rows else cls(*([()] * 8))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def price_vector(self, prices):
+        """(the tick's price of every symbol of the book, whether the tick has one)"""
+        ticked = np.array([symbol in prices for symbol in self.symbols], dtype=bool)
+        vector = fixed_point([prices[symbol] if symbol in prices else 0 for symbol in self.symbols], PRICE_PLACES)
+        return vector, ticked
+
+
+def mark_to_market(book, prices):
+    """
+    reprice the book, returns (current price and profit/loss of every position,
+    profit/loss and margin summed per user in the order of book.users), fixed point
+    """
+    vector, ticked = book.price_vector(prices)
+    current_price = np.where(ticked[book.symbol_index], vector[book.symbol_index], book.current_price)
+    difference, volume = current_price - book.open_price, book.volume
+    if difference.dtype != object and volume.dtype != object and len(volume) and \
+            float(np.abs(difference).max()) * float(np.abs(volume).max()) >= 2 ** 62:
+        # the product could overflow int64
+        difference, volume = difference.astype(object), volume.astype(object)
+    # price * volume has PRICE_PLACES + VOLUME_PLACES decimal places, rounded to cents
+    profit_loss = round_half_even(difference * volume, 10 ** (PRICE_PLACES + VOLUME_PLACES - AMOUNT_PLACES))
+    profit_loss = profit_loss * book.direction
+    return current_price, profit_loss, _sum_per_user(book, profit_loss), _sum_per_user(book, book.margin)
+
+
+def _sum_per_user(book, values):
+    sums = np.zeros(len(book.users), dtype=values.dtype)
+    np.add.at(sums, book.user_index, values)
+    return sums
+
+
+def _reprice_users(user_ids, prices):
+    """reprice the open positions of `user_ids` and refresh their summaries, returns the positions repriced"""
+    with transaction.atomic():
+        book = PositionBook.load(
+            Position.objects.select_for_update().filter(user_id__in=user_ids, closed_at__isnull=True))
+        if not len(book):
+            return 0
+        summaries = list(AccountSummary.objects.select_for_update().filter(user_id__in=user_ids).order_by("pk"))
+        current_price, profit_loss, user_profit_loss, user_margin = mark_to_market(book, prices)
+
+        positions = [
+            Position(pk=pk, current_price=to_decimal(price, PRICE_PLACES), profit_loss=to_decimal(pl, AMOUNT_PLACES))
+            for pk, price, pl in zip(book.ids.tolist(), current_price.tolist(), profit_loss.tolist())
+        ]
+        Position.objects.bulk_update(positions, ["current_price", "profit_loss"], batch_size=1000)
+
+        # users without a summary are skipped, the next balance or position change creates it
+        held = set(book.users.tolist())
+        summaries = [summary for summary in summaries if summary.user_id in held]
+        index = np.searchsorted(book.users, [summary.user_id for summary in summaries])
+        for summary, pl, margin in zip(summaries, user_profit_loss[index].tolist(), user_margin[index].tolist()):
+            summary.profit_loss, summary.margin = to_decimal(pl, AMOUNT_PLACES), to_decimal(margin, AMOUNT_PLACES)
+            for field, value in derived_figures(summary.balance, summary.profit_loss, summary.margin).items():
+                setattr(summary, field, value)
+            summary.updated_at = Now()
+        AccountSummary.objects.bulk_update(
+            summaries, ["profit_loss", "margin", "equity", "free_margin", "margin_level", "updated_at"],
+            batch_size=1000)
+        invalidate_users(book.users.tolist())
+        return len(book)
+
+
+def reprice(prices, chunk_size=CHUNK_SIZE):
+    """apply a {symbol: price} tick to every open position, returns the number of positions repriced"""
+    user_ids = list(Position.objects.filter(closed_at__isnull=True, symbol__in=list(prices))
+                    .order_by("user_id").values_list("user_id", flat=True).distinct())
+    return sum(_reprice_users(user_ids[i:i + chunk_size], prices) for i in range(0, len(user_ids), chunk_size))
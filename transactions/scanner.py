@@ -0,0 +1,98 @@
+"""
+Margin call and stop out scanner.
+
+an account with open positions is in margin call when its margin level is below MARGIN_CALL_LEVEL
+and stopped out below STOP_OUT_LEVEL. the scanner announces every account that falls below one of them
+with the margin_call / stop_out signals of transactions.signals and a warning in the log, once:
+it has to climb back above the level to be announced again. acting on it (closing positions,
+mailing the user) is up to the receivers.
+
+each pass reads only the summaries changed since the previous one (AccountSummary.updated_at is indexed)
+and compares them with the last margin level seen of the accounts below MARGIN_CALL_LEVEL, kept in the
+`watchlist` dict. at start it is filled from the partial margin_level index, so nothing scans the table
+and an account is announced at most one pass (MARGIN_SCANNER_INTERVAL) after its summary changes.
+run it with `manage.py run_margin_scanner`, a restart announces the accounts already below a level again
+"""
+import collections
+import datetime
+import logging
+
+from django.conf import settings
+from django.db.models import Max
+
+from . import signals
+from .models import AccountSummary
+
+logger = logging.getLogger(__name__)
+
+# states of an account, worse is greater
+HEALTHY, MARGIN_CALL, STOP_OUT = range(3)
+
+MarginEvent = collections.namedtuple("MarginEvent", "kind user_id margin_level equity margin")
+
+SUMMARY_COLUMNS = ("user_id", "margin_level", "equity", "margin", "updated_at")
+
+
+class MarginScanner:
+
+    def __init__(self, margin_call_level=None, stop_out_level=None, overlap=None):
+        self.margin_call_level = settings.MARGIN_CALL_LEVEL if margin_call_level is None else margin_call_level
+        self.stop_out_level = settings.STOP_OUT_LEVEL if stop_out_level is None else stop_out_level
+        self.overlap = datetime.timedelta(
+            seconds=settings.MARGIN_SCANNER_OVERLAP if overlap is None else overlap)
+        self.watchlist = {}  # user id: margin level, of the accounts below the margin call level
+        self.cursor = None  # the latest updated_at read
+
+    def state(self, margin_level):
+        if margin_level is None or margin_level >= self.margin_call_level:
+            return HEALTHY
+        return STOP_OUT if margin_level < self.stop_out_level else MARGIN_CALL
+
+    def start(self):
+        """fill the watchlist with the accounts below the margin call level, returns their events"""
+        self.cursor = AccountSummary.objects.aggregate(latest=Max("updated_at"))["latest"]
+        at_risk = AccountSummary.objects.filter(margin__gt=0, margin_level__lt=self.margin_call_level)
+        return self._observe(at_risk.order_by().values_list(*SUMMARY_COLUMNS))
+
+    def scan(self):
+        """one pass over the summaries changed since the last one, returns the events sent"""
+        if self.cursor is None:
+            return self.start()
+        changed = AccountSummary.objects.filter(updated_at__gt=self.cursor - self.overlap)
+        return self._observe(changed.order_by().values_list(*SUMMARY_COLUMNS))
+
+    def _observe(self, rows):
+        events = []
+        for user_id, margin_level, equity, margin, updated_at in rows:
+            if self.cursor is None or updated_at > self.cursor:
+                self.cursor = updated_at
+            event = self.observe(user_id, margin_level if margin > 0 else None, equity, margin)
+            if event:
+                events.append(event)
+        # the worst accounts go first
+        events.sort(key=lambda event: event.margin_level)
+        for event in events:
+            self.send(event)
+        return events
+
+    def observe(self, user_id, margin_level, equity=None, margin=None):
+        """
+        update the account's margin level (None without open positions),
+        returns its MarginEvent when that takes it below a level it wasn't already below
+        """
+        previous = self.state(self.watchlist.get(user_id))
+        state = self.state(margin_level)
+        if state == HEALTHY:
+            self.watchlist.pop(user_id, None)
+        else:
+            self.watchlist[user_id] = margin_level
+        if state > previous:
+            kind = "stop_out" if state == STOP_OUT else "margin_call"
+            return MarginEvent(kind, user_id, margin_level, equity, margin)
+        return None
+
+    def send(self, event):
+        logger.warning("%s: user %s at margin level %s%% (equity %s, margin %s)",
+                       event.kind.replace("_", " "), event.user_id, event.margin_level, event.equity, event.margin)
+        getattr(signals, event.kind).send(sender=self.__class__, user_id=event.user_id,
+                                          margin_level=event.margin_level, equity=event.equity, margin=event.margin)
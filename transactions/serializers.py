@@ -1,11 +1,42 @@
+from django.db import models
 from rest_framework import serializers
 from .models import Deposit, Withdrawal, Balance, AccountSummary
 
 
+class UserdataListSerializer(serializers.ListSerializer):
+    '''
+    fast path for many=True: rows coming from a .values() queryset (see FlatListMixin in views)
+    are turned into dicts directly, skipping model instances and the SerializerMethodField,
+    while producing the same json as BaseUserdataSerializer
+    '''
+
+    def to_representation(self, data):
+        rows = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        if not rows or not isinstance(rows[0], dict):
+            return super().to_representation(rows)
+
+        fields = [(field.field_name, field.source, field.to_representation)
+                  for field in self.child._readable_fields]
+        representation = []
+        for row in rows:
+            item = {}
+            for name, source, to_representation in fields:
+                if name == 'user_data':
+                    item[name] = {"id": row['user_id'], "user_email": row['user_email']}
+                else:
+                    value = row[source]
+                    item[name] = None if value is None else to_representation(value)
+            representation.append(item)
+        return representation
+
+
 class BaseUserdataSerializer(serializers.ModelSerializer):
     ''' inherit user data from here to be more readable '''
     user_data = serializers.SerializerMethodField()
 
+    class Meta:
+        list_serializer_class = UserdataListSerializer
+
     def get_user_data(self, obj):
         return {
             "id": obj.user.id,
@@ -15,7 +46,7 @@ class BaseUserdataSerializer(serializers.ModelSerializer):
 
 class ManagerDepositSerializer(BaseUserdataSerializer):
 
-    class Meta:
+    class Meta(BaseUserdataSerializer.Meta):
         model = Deposit
         fields = ['id', 'user_data', 'amount', 'is_verified', 'timestamp']
         read_only_fields = ('id', 'user_data')
@@ -23,7 +54,7 @@ class ManagerDepositSerializer(BaseUserdataSerializer):
 
 class ManagerWithdrawalSerializer(BaseUserdataSerializer):
 
-    class Meta:
+    class Meta(BaseUserdataSerializer.Meta):
         model = Withdrawal
         fields = ['id', 'user_data', 'amount', 'is_verified', 'timestamp']
         read_only_fields = ('id', 'user_data')
@@ -31,7 +62,7 @@ class ManagerWithdrawalSerializer(BaseUserdataSerializer):
 
 class ManageBalanceSerializer(BaseUserdataSerializer):
 
-    class Meta:
+    class Meta(BaseUserdataSerializer.Meta):
         model = Balance
         fields = ('id', 'user_data', 'amount')
         read_only_fields = ('id', 'user_data')
@@ -39,8 +70,39 @@ class ManageBalanceSerializer(BaseUserdataSerializer):
 
 class ManageAccountSummarySerializer(BaseUserdataSerializer):
 
-    class Meta:
+    class Meta(BaseUserdataSerializer.Meta):
         model = AccountSummary
-        fields = ['id', 'user_data', 'profit_loss', 'opened_position',
+        fields = ['id', 'user_data', 'balance', 'profit_loss', 'equity', 'opened_position',
                   'margin', 'free_margin', 'margin_level']
-        read_only_fields = ('id', 'user_data')
+        # derived from the balance and positions, see transactions.margin
+        read_only_fields = fields
+
+
+class BulkVerifyFilterSerializer(serializers.Serializer):
+    user = serializers.IntegerField(required=False)
+    timestamp_after = serializers.DateTimeField(required=False)
+    timestamp_before = serializers.DateTimeField(required=False)
+
+
+class BulkVerifySerializer(serializers.Serializer):
+    ''' pick the rows to verify either by id or by a filter, not both '''
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False, max_length=10000)
+    filter = BulkVerifyFilterSerializer(required=False)
+
+    def validate(self, data):
+        if ('ids' in data) == ('filter' in data):
+            raise serializers.ValidationError("Provide either ids or filter.")
+        return data
+
+    def filter_queryset(self, queryset):
+        if 'ids' in self.validated_data:
+            return queryset.filter(pk__in=self.validated_data['ids'])
+
+        filters = self.validated_data['filter']
+        if 'user' in filters:
+            queryset = queryset.filter(user_id=filters['user'])
+        if 'timestamp_after' in filters:
+            queryset = queryset.filter(timestamp__gte=filters['timestamp_after'])
+        if 'timestamp_before' in filters:
+            queryset = queryset.filter(timestamp__lt=filters['timestamp_before'])
+        return queryset
@@ -0,0 +1,5 @@
+from django.dispatch import Signal
+
+# sent by transactions.scanner once per crossing, with user_id, margin_level, equity and margin
+margin_call = Signal()
+stop_out = Signal()
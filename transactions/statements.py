@@ -0,0 +1,51 @@
+from decimal import Decimal
+from django.db.models import Sum, Count
+from django.db.models.functions import TruncDay, TruncWeek, TruncMonth
+from .models import Deposit, Withdrawal
+
+PERIODS = {
+    'day': TruncDay,
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+
+
+def _empty_bucket(period_start):
+    bucket = {'period': period_start}
+    for kind in ('deposits', 'withdrawals'):
+        for state in ('verified', 'pending'):
+            bucket[f'{kind}_{state}'] = Decimal(0)
+            bucket[f'{kind}_{state}_count'] = 0
+    return bucket
+
+
+def build_statement(user, period='day', start=None, end=None):
+    """
+    Per-period deposit and withdrawal totals for a user, bucketed by day, week or month
+    in the current timezone, with one grouped query per table.
+    only periods with activity are returned, oldest first
+    """
+    trunc = PERIODS[period]
+    buckets = {}
+
+    for model, kind in ((Deposit, 'deposits'), (Withdrawal, 'withdrawals')):
+        queryset = model.objects.filter(user=user)
+        if start:
+            queryset = queryset.filter(timestamp__gte=start)
+        if end:
+            queryset = queryset.filter(timestamp__lt=end)
+
+        rows = (queryset.order_by()
+                .annotate(period_start=trunc('timestamp'))
+                .values('period_start', 'is_verified')
+                .annotate(total=Sum('amount'), count=Count('id')))
+        for row in rows:
+            bucket = buckets.setdefault(row['period_start'], _empty_bucket(row['period_start']))
+            state = 'verified' if row['is_verified'] else 'pending'
+            bucket[f'{kind}_{state}'] += row['total']
+            bucket[f'{kind}_{state}_count'] += row['count']
+
+    statement = [buckets[period_start] for period_start in sorted(buckets)]
+    for bucket in statement:
+        bucket['net_flow'] = bucket['deposits_verified'] - bucket['withdrawals_verified']
+    return statement
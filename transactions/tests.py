@@ -1,3 +1,560 @@
+import csv
+import datetime
+import importlib.util
+import io
+import json
+import random
+from decimal import Decimal
+from unittest import mock, skipUnless
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.db.models import F
+from django.core.management import call_command
 from django.test import TestCase
+from django.utils import timezone
+from django.contrib.auth import get_user_model
+from rest_framework import serializers
+from rest_framework.test import APIClient
+from .pagination import EstimatedCountPaginator
+from .models import Deposit, Withdrawal, Balance, LedgerEntry, AccountSummary, Position
+from .serializers import ManagerDepositSerializer
+from . import ledger, margin
+from .scanner import MarginScanner, STOP_OUT
+from .signals import margin_call, stop_out
 
-# Create your tests here.
+User = get_user_model()
+
+
+class LedgerTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(email="trader@example.com", password="password123")
+
+    def test_verify_deposit_credits_balance_once(self):
+        deposit = Deposit.objects.create(user=self.user, amount=Decimal("150.00"))
+
+        entry = ledger.verify_deposit(deposit)
+        self.assertEqual(entry.sequence, 1)
+        self.assertEqual(entry.balance_after, Decimal("150.00"))
+
+        # a second verification of the same deposit is a no-op
+        self.assertIsNone(ledger.verify_deposit(Deposit.objects.get(pk=deposit.pk)))
+        self.assertEqual(Balance.objects.get(user=self.user).amount, Decimal("150.00"))
+
+    def test_saves_append_entries_in_sequence(self):
+        deposit = Deposit.objects.create(user=self.user, amount=Decimal("100.00"))
+        deposit.is_verified = True
+        deposit.save()
+        deposit.amount = Decimal("80.00")
+        deposit.save()
+
+        withdrawal = Withdrawal.objects.create(user=self.user, amount=Decimal("30.00"))
+        ledger.verify_withdrawal(withdrawal)
+
+        entries = list(LedgerEntry.objects.filter(user=self.user).values_list("sequence", "amount", "balance_after"))
+        self.assertEqual(entries, [
+            (1, Decimal("100.00"), Decimal("100.00")),
+            (2, Decimal("-20.00"), Decimal("80.00")),
+            (3, Decimal("-30.00"), Decimal("50.00")),
+        ])
+        balance = Balance.objects.get(user=self.user)
+        self.assertEqual(balance.amount, Decimal("50.00"))
+        self.assertEqual(balance.sequence, 3)
+
+    def test_reverse_deposit(self):
+        deposit = Deposit.objects.create(user=self.user, amount=Decimal("40.00"))
+        ledger.verify_deposit(deposit)
+
+        entry = ledger.reverse_deposit(deposit)
+        self.assertEqual(entry.kind, LedgerEntry.Kind.REVERSAL)
+        self.assertEqual(Balance.objects.get(user=self.user).amount, Decimal("0.00"))
+
+
+class BulkVerifyTests(TestCase):
+
+    def setUp(self):
+        self.staff = User.objects.create_user(email="staff@example.com", password="password123", is_staff=True)
+        self.users = [User.objects.create_user(email=f"user{i}@example.com", password="password123") for i in range(3)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def test_bulk_verify_deposits_by_ids(self):
+        deposits = [Deposit.objects.create(user=user, amount=Decimal("10.00"))
+                    for user in self.users for _ in range(2)]
+        ledger.verify_deposit(deposits[0])
+        ids = [deposit.id for deposit in deposits] + [999999]
+
+        # the query count depends on the number of users, not the number of deposits.
+        # two users get their first balance, which creates their account summary as well
+        with self.assertNumQueries(34):
+            response = self.client.post("/api/manage/deposits/bulk-verify/", {"ids": ids}, format="json")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["verified"], 5)
+        statuses = {row["id"]: row["status"] for row in response.data["results"]}
+        self.assertEqual(statuses[deposits[0].id], "already_verified")
+        self.assertEqual(statuses[deposits[1].id], "verified")
+        self.assertEqual(statuses[999999], "not_found")
+        for user in self.users:
+            self.assertEqual(Balance.objects.get(user=user).amount, Decimal("20.00"))
+        self.assertEqual(list(LedgerEntry.objects.filter(user=self.users[0]).values_list("sequence", flat=True)), [1, 2])
+
+    def test_bulk_verify_withdrawals_by_filter(self):
+        for user in self.users:
+            Balance.objects.create(user=user, amount=Decimal("100.00"))
+            Withdrawal.objects.create(user=user, amount=Decimal("25.00"))
+
+        response = self.client.post("/api/manage/withdrawals/bulk-verify/",
+                                    {"filter": {"user": self.users[1].id}}, format="json")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["verified"], 1)
+        self.assertEqual(Balance.objects.get(user=self.users[1]).amount, Decimal("75.00"))
+        self.assertEqual(Balance.objects.get(user=self.users[0]).amount, Decimal("100.00"))
+
+    def test_ids_or_filter_required(self):
+        response = self.client.post("/api/manage/deposits/bulk-verify/", {}, format="json")
+        self.assertEqual(response.status_code, 400)
+
+
+@skipUnless(connection.vendor == "sqlite", "query plans are checked with sqlite's EXPLAIN QUERY PLAN")
+class IndexUsageTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(email="trader@example.com", password="password123")
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan, plan)
+
+    def test_user_history_uses_user_timestamp_index(self):
+        self.assertUsesIndex(Deposit.objects.filter(user=self.user).order_by("-timestamp", "-id"),
+                             "deposit_user_ts_idx")
+        self.assertUsesIndex(Withdrawal.objects.filter(user=self.user).order_by("-timestamp", "-id"),
+                             "withdrawal_user_ts_idx")
+
+    def test_staff_list_uses_timestamp_index(self):
+        self.assertUsesIndex(Deposit.objects.order_by("-timestamp"), "deposit_ts_idx")
+        self.assertUsesIndex(Withdrawal.objects.order_by("-timestamp"), "withdrawal_ts_idx")
+
+    def test_pending_queue_uses_pending_index(self):
+        # the sql mysql gets for filter(is_verified=False): django writes `is_verified = false` there so the
+        # index can be used, on sqlite it writes `NOT is_verified`, which no index matches
+        for model, index_name in ((Deposit, "deposit_pending_idx"), (Withdrawal, "withdrawal_pending_idx")):
+            with connection.cursor() as cursor:
+                cursor.execute(f"EXPLAIN QUERY PLAN SELECT id FROM {model._meta.db_table} "
+                               f"WHERE is_verified = 0 ORDER BY timestamp DESC")
+                plan = str(cursor.fetchall())
+            self.assertIn(index_name, plan, plan)
+
+    def test_margin_scanner_queries_use_indexes(self):
+        self.assertUsesIndex(AccountSummary.objects.filter(margin__gt=0, margin_level__lt=100),
+                             "summary_margin_level_idx")
+        self.assertUsesIndex(AccountSummary.objects.filter(updated_at__gt=timezone.now()), "updated_at")
+
+
+class ExportTests(TestCase):
+
+    def setUp(self):
+        self.staff = User.objects.create_user(email="staff@example.com", password="password123", is_staff=True)
+        self.users = [User.objects.create_user(email=f"user{i}@example.com", password="password123") for i in range(2)]
+        for user in self.users:
+            for amount in ("10.00", "20.50"):
+                Deposit.objects.create(user=user, amount=Decimal(amount))
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def test_csv_export_streams_every_row(self):
+        response = self.client.get("/api/manage/deposits/export/?ordering=timestamp")
+
+        self.assertEqual(response["Content-Type"], "text/csv")
+        self.assertTrue(response.streaming)
+        rows = list(csv.reader(io.StringIO(b"".join(response.streaming_content).decode())))
+        self.assertEqual(rows[0], ["id", "user_id", "user_email", "amount", "is_verified", "timestamp"])
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[1][2:5], ["user0@example.com", "10.00", "False"])
+
+    def test_ndjson_export_reuses_search(self):
+        response = self.client.get("/api/manage/deposits/export/", {"export_format": "ndjson", "search": "user1@"})
+
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual(len(rows), 2)
+        self.assertEqual({row["user_email"] for row in rows}, {"user1@example.com"})
+
+    def test_unknown_format(self):
+        response = self.client.get("/api/manage/balances/export/?export_format=xml")
+        self.assertEqual(response.status_code, 400)
+
+
+class FlatListSerializerTests(TestCase):
+
+    def setUp(self):
+        self.staff = User.objects.create_user(email="staff@example.com", password="password123", is_staff=True)
+        for i in range(3):
+            user = User.objects.create_user(email=f"user{i}@example.com", password="password123")
+            Deposit.objects.create(user=user, amount=Decimal("12.50"))
+
+    def test_flat_rows_have_the_same_shape_as_instances(self):
+        instances = Deposit.objects.select_related("user").order_by("id")
+        rows = Deposit.objects.order_by("id").values("user_id", "id", "amount", "is_verified", "timestamp",
+                                                     user_email=F("user__email"))
+
+        expected = serializers.ListSerializer(child=ManagerDepositSerializer(), instance=instances).data
+        self.assertEqual(ManagerDepositSerializer(rows, many=True).data, expected)
+
+    def test_manage_list_reads_only_emitted_columns(self):
+        client = APIClient()
+        client.force_authenticate(self.staff)
+
+        with self.assertNumQueries(1):
+            response = client.get("/api/manage/deposits/")
+
+        row = response.data["results"][0]
+        self.assertEqual(list(row), ["id", "user_data", "amount", "is_verified", "timestamp"])
+        self.assertEqual(row["user_data"]["user_email"], "user2@example.com")
+
+    def test_manage_list_pages_by_timestamp_only(self):
+        client = APIClient()
+        client.force_authenticate(self.staff)
+        ledger.verify_deposit(Deposit.objects.order_by("id")[1])
+
+        ids, url = [], "/api/manage/deposits/?ordering=is_verified&page_size=1"
+        while url:
+            with CaptureQueriesContext(connection) as captured:
+                response = client.get(url)
+            self.assertNotIn("OFFSET", captured[-1]["sql"])
+            ids += [row["id"] for row in response.data["results"]]
+            url = response.data["next"]
+        expected = Deposit.objects.order_by("-timestamp", "-id").values_list("id", flat=True)
+        self.assertEqual(ids, list(expected))
+
+
+class MarginEngineTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(email="trader@example.com", password="password123")
+        ledger.post_entry(self.user.id, Decimal("1000.00"), LedgerEntry.Kind.DEPOSIT)
+
+    def summary(self):
+        return AccountSummary.objects.filter(user=self.user).values(*margin.SUMMARY_FIELDS).get()
+
+    def open_position(self, side=Position.Side.BUY, volume="2", price="100", leverage=10):
+        return Position.objects.create(user=self.user, symbol="EURUSD", side=side, volume=Decimal(volume),
+                                       leverage=leverage, open_price=Decimal(price), current_price=Decimal(price))
+
+    def test_figures_follow_positions_and_balance(self):
+        position = self.open_position()
+        position.current_price = Decimal("105")
+        position.save()
+        self.assertEqual(self.summary(), {
+            "balance": Decimal("1000.00"), "profit_loss": Decimal("10.00"), "equity": Decimal("1010.00"),
+            "margin": Decimal("20.00"), "free_margin": Decimal("990.00"), "margin_level": Decimal("5050.00"),
+            "opened_position": 1,
+        })
+
+        # sells gain when the price falls, whole amounts don't divide as integers
+        sell = self.open_position(side=Position.Side.SELL, volume="1", price="10", leverage=1)
+        sell.current_price = Decimal("9")
+        sell.save()
+        deposit = Deposit.objects.create(user=self.user, amount=Decimal("19.00"))
+        ledger.verify_deposit(deposit)
+        summary = self.summary()
+        self.assertEqual(summary["equity"], Decimal("1030.00"))
+        self.assertEqual(summary["margin"], Decimal("30.00"))
+        self.assertEqual(summary["margin_level"], Decimal("3433.33"))
+
+        position.closed_at = timezone.now()
+        position.save()
+        sell.delete()
+        self.assertEqual(self.summary(), {
+            "balance": Decimal("1019.00"), "profit_loss": Decimal("0.00"), "equity": Decimal("1019.00"),
+            "margin": Decimal("0.00"), "free_margin": Decimal("1019.00"), "margin_level": Decimal("0.00"),
+            "opened_position": 0,
+        })
+
+    def test_incremental_updates_match_a_recompute(self):
+        for price in ("100", "50", "20"):
+            self.open_position(price=price)
+        withdrawal = Withdrawal.objects.create(user=self.user, amount=Decimal("100.00"))
+        ledger.bulk_verify_withdrawals(Withdrawal.objects.filter(pk=withdrawal.pk))
+        Position.objects.filter(open_price=Decimal("50")).get().delete()
+
+        incremental = self.summary()
+        self.assertEqual(margin.recompute_summaries([self.user.id]), 0)
+        self.assertEqual(self.summary(), incremental)
+        self.assertEqual(incremental["balance"], Decimal("900.00"))
+        self.assertEqual(incremental["opened_position"], 2)
+
+    def test_recompute_command_repairs_summaries(self):
+        self.open_position()
+        other = User.objects.create_user(email="other@example.com", password="password123")
+        Balance.objects.create(user=other, amount=Decimal("50.00"))
+        AccountSummary.objects.filter(user=self.user).update(margin=0, free_margin=0, margin_level=0)
+
+        out = io.StringIO()
+        call_command("recompute_account_summaries", "--batch-size", "1", stdout=out)
+        self.assertIn("account summaries updated: 1", out.getvalue())
+        self.assertEqual(self.summary()["margin_level"], Decimal("5000.00"))
+        self.assertEqual(AccountSummary.objects.get(user=other).equity, Decimal("50.00"))
+
+    def test_summaries_are_read_only_for_staff(self):
+        staff = User.objects.create_user(email="staff@example.com", password="password123", is_staff=True)
+        client = APIClient()
+        client.force_authenticate(staff)
+        summary = AccountSummary.objects.get(user=self.user)
+        response = client.patch(f"/api/manage/account-summaries/{summary.pk}/", {"margin": "1.00"}, format="json")
+        self.assertEqual(response.status_code, 405)
+        response = client.get("/api/manage/account-summaries/")
+        self.assertEqual(response.data["results"][0]["equity"], "1000.00")
+
+
+@skipUnless(importlib.util.find_spec("numpy"), "repricing needs numpy")
+class RepricingTests(TestCase):
+
+    def setUp(self):
+        self.users = [User.objects.create_user(email=f"user{i}@example.com", password="password123") for i in range(3)]
+        for user in self.users:
+            ledger.post_entry(user.id, Decimal("1000.00"), LedgerEntry.Kind.DEPOSIT)
+        positions = [
+            (0, "EURUSD", Position.Side.BUY, "1000", "1.085"),
+            (0, "XAUUSD", Position.Side.SELL, "2", "2300"),
+            (1, "EURUSD", Position.Side.SELL, "5000", "1.09"),
+            (2, "XAUUSD", Position.Side.BUY, "1", "2290.5"),
+            (2, "BTCUSD", Position.Side.BUY, "0.01", "60000"),
+        ]
+        for user, symbol, side, volume, price in positions:
+            Position.objects.create(user=self.users[user], symbol=symbol, side=side, volume=Decimal(volume),
+                                    leverage=50, open_price=Decimal(price), current_price=Decimal(price))
+
+    def test_reprice_matches_the_margin_engine(self):
+        from . import pricing
+
+        self.assertEqual(pricing.reprice({"EURUSD": Decimal("1.0875"), "XAUUSD": Decimal("2312.25")}, chunk_size=2), 5)
+
+        for position in Position.objects.all():
+            _, profit_loss = margin.position_figures(position.side, position.volume, position.leverage,
+                                                     position.open_price, position.current_price)
+            self.assertEqual(position.profit_loss, profit_loss)
+        self.assertEqual(Position.objects.get(symbol="BTCUSD").current_price, Decimal("60000"))
+        self.assertEqual(AccountSummary.objects.get(user=self.users[1]).profit_loss, Decimal("12.50"))
+
+        # the summaries are what a full recompute gives
+        repriced = list(AccountSummary.objects.order_by("user_id").values(*margin.SUMMARY_FIELDS))
+        self.assertEqual(margin.recompute_summaries(), 0)
+        self.assertEqual(list(AccountSummary.objects.order_by("user_id").values(*margin.SUMMARY_FIELDS)), repriced)
+
+    def test_mark_to_market_rounds_like_the_margin_engine(self):
+        from . import pricing
+
+        # half cent ties, which float rounding gets wrong, and amounts that overflow int64 in fixed point
+        cases = [
+            (Position.Side.BUY, "1", "0.7", "0.705"),
+            (Position.Side.BUY, "1", "1.08", "1.115"),
+            (Position.Side.SELL, "1", "1.08", "1.115"),
+            (Position.Side.SELL, "1", "0.7", "0.705"),
+            (Position.Side.BUY, "0.5", "1.25", "1.26"),
+            (Position.Side.BUY, "0.0001", "2300", "2350.25"),
+            (Position.Side.SELL, "1000000", "99999999.999999", "1.000005"),
+        ]
+        # the ties alone stay in int64, with the last case the whole book is Python ints
+        for positions in (cases[:-1], cases):
+            book = pricing.PositionBook(
+                ids=range(len(positions)), user_ids=range(len(positions)),
+                symbols=[f"S{i}" for i in range(len(positions))], sides=[side for side, *_ in positions],
+                volumes=[Decimal(volume) for _, volume, _, _ in positions],
+                open_prices=[Decimal(price) for *_, price, _ in positions],
+                current_prices=[Decimal(0)] * len(positions), margins=[Decimal(0)] * len(positions))
+            ticks = {f"S{i}": Decimal(tick) for i, (*_, tick) in enumerate(positions)}
+            _, profit_loss, user_profit_loss, _ = pricing.mark_to_market(book, ticks)
+
+            for i, (side, volume, open_price, tick) in enumerate(positions):
+                _, expected = margin.position_figures(side, volume, 1, open_price, tick)
+                with self.subTest(case=positions[i], dtype=profit_loss.dtype):
+                    self.assertEqual(pricing.to_decimal(profit_loss[i], pricing.AMOUNT_PLACES), expected)
+                    self.assertEqual(pricing.to_decimal(user_profit_loss[i], pricing.AMOUNT_PLACES), expected)
+
+    def test_reprice_command(self):
+        out = io.StringIO()
+        call_command("reprice_positions", "XAUUSD=2280", stdout=out)
+        self.assertIn("positions repriced: 4", out.getvalue())
+        self.assertEqual(AccountSummary.objects.get(user=self.users[2]).profit_loss, Decimal("-10.50"))
+
+
+class MarginScannerTests(TestCase):
+    """
+    replays price paths of one symbol through the margin engine, MARGIN_CALL_LEVEL 100 and STOP_OUT_LEVEL 50.
+    long: a 1000 balance buying 1 at 2000 with leverage 2, margin level (price - 1000) / 10
+    short: the same selling, margin level (3000 - price) / 10
+    safe: a position far too small to matter
+    """
+
+    def setUp(self):
+        self.users = {}
+        for name, side, volume, leverage in (("long", Position.Side.BUY, "1", 2),
+                                             ("short", Position.Side.SELL, "1", 2),
+                                             ("safe", Position.Side.BUY, "0.1", 100)):
+            user = User.objects.create_user(email=f"{name}@example.com", password="password123")
+            ledger.post_entry(user.id, Decimal("1000.00"), LedgerEntry.Kind.DEPOSIT)
+            Position.objects.create(user=user, symbol="XAUUSD", side=side, volume=Decimal(volume),
+                                    leverage=leverage, open_price=Decimal("2000"), current_price=Decimal("2000"))
+            self.users[user.id] = name
+        self.scanner = MarginScanner(margin_call_level=Decimal(100), stop_out_level=Decimal(50))
+        self.assertEqual(self.scanner.start(), [])
+
+        self.received = []
+        for signal in (margin_call, stop_out):
+            signal.connect(self.receive)
+            self.addCleanup(signal.disconnect, self.receive)
+
+    def receive(self, signal, user_id, margin_level, **kwargs):
+        self.received.append(("stop_out" if signal is stop_out else "margin_call", self.users[user_id]))
+
+    def replay(self, path):
+        """apply every price of the path and scan after each one, returns [(step, kind, account)]"""
+        events = []
+        for step, price in enumerate(path):
+            for position in Position.objects.filter(closed_at__isnull=True):
+                position.current_price = Decimal(price)
+                position.save()
+            events += [(step, event.kind, self.users[event.user_id]) for event in self.scanner.scan()]
+        return events
+
+    def states(self):
+        """the state of every account from a full read of the summaries"""
+        return {self.users[user_id]: self.scanner.state(level if margin > 0 else None)
+                for user_id, level, margin in AccountSummary.objects.values_list("user_id", "margin_level", "margin")}
+
+    def test_announces_each_crossing_once(self):
+        long_id = AccountSummary.objects.get(user__email="long@example.com").user_id
+        path = ["2000", "1990", "1980", "1400", "1450", "1600", "1450", "2100", "2600", "2000", "2400"]
+        with self.assertLogs("transactions.scanner", "WARNING") as logs:
+            events = self.replay(path)
+        self.assertEqual(logs.records[0].getMessage(),
+                         f"margin call: user {long_id} at margin level 99.00% (equity 990.00, margin 1000.00)")
+        self.assertEqual(events, [
+            (1, "margin_call", "long"),
+            (3, "stop_out", "long"),
+            # back in margin call at 1600, so falling under 50% again is a new stop out
+            (6, "stop_out", "long"),
+            (7, "margin_call", "short"),
+            (8, "stop_out", "short"),
+            (10, "margin_call", "short"),
+        ])
+        self.assertEqual(self.received, [(kind, account) for _, kind, account in events])
+        short = AccountSummary.objects.get(user__email="short@example.com")
+        self.assertEqual(self.scanner.watchlist, {short.user_id: short.margin_level})
+
+    def test_random_walks_match_a_full_scan(self):
+        rng = random.Random(7)
+        price, path = 2000.0, []
+        for _ in range(120):
+            price = min(max(price * (1 + rng.gauss(0, 0.04)), 1100), 2900)
+            path.append(f"{price:.2f}")
+
+        previous = self.states()
+        events, expected = [], []
+        with self.assertLogs("transactions.scanner", "WARNING"):
+            for step, price in enumerate(path):
+                events += [(step, kind, account) for _, kind, account in self.replay([price])]
+                current = self.states()
+                expected += [(step, "stop_out" if state == STOP_OUT else "margin_call", account)
+                             for account, state in current.items() if state > previous[account]]
+                previous = current
+        self.assertEqual(sorted(events), sorted(expected))
+        self.assertIn("stop_out", {kind for _, kind, _ in events})
+
+    def test_scan_reads_only_changed_summaries(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.scanner.scan(), [])
+        self.scanner.overlap = datetime.timedelta(0)
+        self.scanner.scan()
+        with self.assertNumQueries(1) as queries:
+            self.scanner.scan()
+        self.assertIn("updated_at", queries.captured_queries[0]["sql"])
+
+    def test_restart_announces_accounts_already_below_a_level(self):
+        with self.assertLogs("transactions.scanner", "WARNING") as logs:
+            self.replay(["1300"])
+            out = io.StringIO()
+            call_command("run_margin_scanner", "--once", stdout=out)
+        self.assertEqual(len(logs.records), 2)
+        self.assertIn("accounts below the margin call level: 1, stopped out: 1", out.getvalue())
+
+
+class AdminChangelistTests(TestCase):
+    """every changelist runs the same queries whatever the number of rows and users on the page"""
+    # session, user, count, rows, two permission lookups (+ the date hierarchy's min/max and dates)
+    CHANGELISTS = {"deposit": 8, "withdrawal": 8, "ledgerentry": 8, "accountsummary": 6, "position": 6, "balance": 6}
+
+    def setUp(self):
+        admin = User.objects.create_superuser(email="admin@example.com", password="password123")
+        self.client.force_login(admin)
+        self.add_users(2)
+
+    def add_users(self, count):
+        start = User.objects.count()
+        for i in range(start, start + count):
+            user = User.objects.create_user(email=f"user{i}@example.com", password="password123")
+            ledger.post_entry(user.id, Decimal("100.00"), LedgerEntry.Kind.DEPOSIT)
+            Deposit.objects.create(user=user, amount=Decimal("5.00"))
+            Withdrawal.objects.create(user=user, amount=Decimal("5.00"))
+            Position.objects.create(user=user, symbol="EURUSD", side=Position.Side.BUY, volume=Decimal("1"),
+                                    leverage=10, open_price=Decimal("1.08"), current_price=Decimal("1.08"))
+
+    def test_query_count_does_not_grow_with_rows(self):
+        for rows in range(2):
+            for model, queries in self.CHANGELISTS.items():
+                with self.subTest(model=model, rows=rows), self.assertNumQueries(queries):
+                    response = self.client.get(f"/admin/transactions/{model}/")
+                    self.assertEqual(response.status_code, 200)
+            self.add_users(6)
+
+    def test_search_matches_the_start_of_the_email_without_a_full_count(self):
+        for model, queries in self.CHANGELISTS.items():
+            with self.subTest(model=model), CaptureQueriesContext(connection) as captured:
+                response = self.client.get(f"/admin/transactions/{model}/", {"q": "user1@"})
+            self.assertEqual(response.context["cl"].result_count, 1)
+            self.assertEqual(len(captured), queries)
+            counts = [query["sql"] for query in captured if "COUNT(*)" in query["sql"]]
+            self.assertEqual(len(counts), 1)
+            self.assertIn("LIKE 'user1@%'", counts[0])
+
+        response = self.client.get("/admin/transactions/deposit/", {"q": "ser1@"})
+        self.assertEqual(response.context["cl"].result_count, 0)
+
+    def test_margin_status_filter(self):
+        user = User.objects.get(email="user1@example.com")
+        position = Position.objects.get(user=user)
+        # a margin of 1080 on an equity of 10, a margin level under 1%
+        position.volume, position.leverage, position.current_price = Decimal("1000"), 1, Decimal("0.99")
+        position.save()
+        response = self.client.get("/admin/transactions/accountsummary/", {"margin_status": "margin_call"})
+        self.assertEqual([summary.user_id for summary in response.context["cl"].result_list], [user.id])
+
+    def test_deleting_selected_balances_and_positions_recomputes_the_summaries(self):
+        users = list(User.objects.filter(email__startswith="user").order_by("pk"))
+        for model in (Position, Balance):
+            response = self.client.post(f"/admin/transactions/{model._meta.model_name}/", {
+                "action": "delete_selected", "post": "yes",
+                "_selected_action": list(model.objects.filter(user__in=users).values_list("pk", flat=True)),
+            })
+            self.assertEqual(response.status_code, 302)
+            self.assertFalse(model.objects.filter(user__in=users).exists())
+
+        for user in users:
+            summary = AccountSummary.objects.get(user=user)
+            self.assertEqual((summary.balance, summary.margin, summary.opened_position), (0, 0, 0))
+
+    def test_unfiltered_lists_use_the_estimated_count(self):
+        with mock.patch("transactions.pagination.estimated_count", return_value=250000) as estimate:
+            response = self.client.get("/admin/transactions/deposit/")
+            self.assertEqual(response.context["cl"].result_count, 250000)
+            response = self.client.get("/admin/transactions/deposit/", {"is_verified__exact": "0"})
+            self.assertEqual(response.context["cl"].result_count, 2)
+        estimate.assert_called_once_with(Deposit, "default")
+
+        # small tables and databases without statistics are counted
+        with mock.patch("transactions.pagination.estimated_count", return_value=500):
+            self.assertEqual(EstimatedCountPaginator(Deposit.objects.order_by("pk"), 10).count, 2)
+        self.assertEqual(EstimatedCountPaginator(Deposit.objects.order_by("pk"), 10).count, 2)
@@ -1,74 +1,184 @@
+from django.db.models import F
+from django.http import StreamingHttpResponse
 from django.utils.decorators import method_decorator
+from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
-from rest_framework.viewsets import  ModelViewSet
+from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from rest_framework import status
 from .models import Deposit, Withdrawal, Balance, AccountSummary
-from .serializers import ManagerDepositSerializer, ManagerWithdrawalSerializer, ManageBalanceSerializer, ManageAccountSummarySerializer
+from .serializers import (ManagerDepositSerializer, ManagerWithdrawalSerializer, ManageBalanceSerializer,
+                          ManageAccountSummarySerializer, BulkVerifySerializer)
 from .permissions import IsStaffOnly
+from .pagination import TimestampCursorPagination
+from base.db_router import ReplicaReadMixin
+from .export import EXPORT_FORMATS, STREAMERS
+from . import ledger
 
 
-class BalanceViewSet(ModelViewSet):
+class ExportMixin:
+    '''
+    adds GET export/ which streams the whole filtered queryset (same search and
+    ordering parameters as the list) as csv or ndjson without loading it in memory.
+    `export_fields` is a list of (column name, queryset lookup)
+    '''
+    export_fields = ()
+    export_chunk_size = 2000
+
+    @swagger_auto_schema(tags=['manage'], manual_parameters=[
+        openapi.Parameter('export_format', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                          enum=list(EXPORT_FORMATS), default='csv'),
+    ])
+    @action(detail=False, methods=['GET'])
+    def export(self, request):
+        export_format = request.query_params.get('export_format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            return Response({"error": f"export_format must be one of {', '.join(EXPORT_FORMATS)}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        # rows are read while streaming, after the view returned, so fix the database now
+        queryset = queryset.using(queryset.db)
+        header = [name for name, lookup in self.export_fields]
+        rows = queryset.values_list(*[lookup for name, lookup in self.export_fields]).iterator(
+            chunk_size=self.export_chunk_size)
+
+        response = StreamingHttpResponse(STREAMERS[export_format](header, rows),
+                                         content_type=EXPORT_FORMATS[export_format])
+        response['Content-Disposition'] = f'attachment; filename="{self.basename}.{export_format}"'
+        return response
+
+
+class FlatListMixin:
+    '''
+    list actions read only the emitted columns with .values() so UserdataListSerializer
+    can serialize plain dicts, other actions load the user with only the fields shown
+    '''
+    flat_fields = ()
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            return queryset.values('user_id', *self.flat_fields, user_email=F('user__email'))
+        return queryset.only('user', *self.flat_fields, 'user__id', 'user__email')
+
+
+class BulkVerifyMixin:
+    '''
+    adds POST bulk-verify/ to a deposit or withdrawal viewset,
+    `bulk_verify_rows` does the actual set-wise verification
+    '''
+    bulk_verify_rows = None
+
+    @swagger_auto_schema(tags=['manage'], request_body=BulkVerifySerializer)
+    @action(detail=False, methods=['POST'], url_path='bulk-verify')
+    def bulk_verify(self, request):
+        serializer = BulkVerifySerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        queryset = serializer.filter_queryset(self.get_queryset())
+        verified = self.bulk_verify_rows(queryset)
+
+        if 'ids' in serializer.validated_data:
+            verified_ids = set(verified)
+            existing_ids = set(queryset.order_by().values_list('id', flat=True))
+            results = [
+                {"id": pk,
+                 "status": "verified" if pk in verified_ids
+                 else "already_verified" if pk in existing_ids
+                 else "not_found"}
+                for pk in dict.fromkeys(serializer.validated_data['ids'])
+            ]
+        else:
+            results = [{"id": pk, "status": "verified"} for pk in verified]
+
+        return Response({"verified": len(verified), "results": results}, status=status.HTTP_200_OK)
+
+
+class BalanceViewSet(ReplicaReadMixin, FlatListMixin, ExportMixin, ModelViewSet):
     '''
     only super user can access
     filter by timestamp and is verified,
-    search by user username
+    search by user email
     '''
     queryset = Balance.objects.select_related('user')
     permission_classes = [IsStaffOnly]
     serializer_class = ManageBalanceSerializer
     filter_backends = [SearchFilter, OrderingFilter]
-    search_fields = ['user__username']
+    search_fields = ['user__email']
+    flat_fields = ('id', 'amount')
+    export_fields = [('id', 'id'), ('user_id', 'user_id'), ('user_email', 'user__email'), ('amount', 'amount')]
+    replica_actions = ('list', 'retrieve', 'export')
 
 for method in ['list', 'retrieve', 'create', 'partial_update', 'update', 'destroy']:
     BalanceViewSet = method_decorator(name=method, decorator=swagger_auto_schema(tags=['manage']))(BalanceViewSet)
 
 
-class DepositViewSet(ModelViewSet):
+class DepositViewSet(ReplicaReadMixin, FlatListMixin, BulkVerifyMixin, ExportMixin, ModelViewSet):
     '''
     only super user can access
     filter by timestamp and is verified,
-    search by user username
+    search by user email
     '''
     queryset = Deposit.objects.select_related('user')
+    bulk_verify_rows = staticmethod(ledger.bulk_verify_deposits)
     permission_classes = [IsStaffOnly]
     serializer_class = ManagerDepositSerializer
     filter_backends = [SearchFilter, OrderingFilter]
-    search_fields = ['user__username']
-    ordering_fields = ['timestamp', 'is_verified']
+    search_fields = ['user__email']
+    # the cursor's position, a boolean would leave nearly every row tied and the pages offset scanned
+    ordering_fields = ['timestamp']
+    pagination_class = TimestampCursorPagination
+    flat_fields = ('id', 'amount', 'is_verified', 'timestamp')
+    export_fields = [('id', 'id'), ('user_id', 'user_id'), ('user_email', 'user__email'),
+                     ('amount', 'amount'), ('is_verified', 'is_verified'), ('timestamp', 'timestamp')]
+    replica_actions = ('list', 'retrieve', 'export')
 
 for method in ['list', 'retrieve', 'create', 'partial_update', 'update', 'destroy']:
     DepositViewSet = method_decorator(name=method, decorator=swagger_auto_schema(tags=['manage']))(DepositViewSet)
 
 
-class WithdrawalViewSet(ModelViewSet):
+class WithdrawalViewSet(ReplicaReadMixin, FlatListMixin, BulkVerifyMixin, ExportMixin, ModelViewSet):
     '''
     only super user can access
     filter by timestamp and is verified,
-    search by user username
+    search by user email
     '''
     queryset = Withdrawal.objects.select_related('user')
+    bulk_verify_rows = staticmethod(ledger.bulk_verify_withdrawals)
     serializer_class = ManagerWithdrawalSerializer
     permission_classes = [IsStaffOnly]
     filter_backends = [SearchFilter, OrderingFilter]
-    search_fields = ['user__username']
-    ordering_fields = ['timestamp', 'is_verified']
+    search_fields = ['user__email']
+    # the cursor's position, a boolean would leave nearly every row tied and the pages offset scanned
+    ordering_fields = ['timestamp']
+    pagination_class = TimestampCursorPagination
+    flat_fields = ('id', 'amount', 'is_verified', 'timestamp')
+    export_fields = [('id', 'id'), ('user_id', 'user_id'), ('user_email', 'user__email'),
+                     ('amount', 'amount'), ('is_verified', 'is_verified'), ('timestamp', 'timestamp')]
+    replica_actions = ('list', 'retrieve', 'export')
 
 for method in ['list', 'retrieve', 'create', 'partial_update', 'update', 'destroy']:
     WithdrawalViewSet = method_decorator(name=method, decorator=swagger_auto_schema(tags=['manage']))(WithdrawalViewSet)
 
 
-class AccountSummaryViewSet(ModelViewSet):
+class AccountSummaryViewSet(ReplicaReadMixin, FlatListMixin, ReadOnlyModelViewSet):
     """
     This views shows the admin the account summary including details like
-    profit_loss, opened_position and they can modify the details
+    profit_loss, opened_position. they are derived from the balance and positions
+    (transactions.margin) so they are read only
     """
     queryset = AccountSummary.objects.select_related('user')
     serializer_class = ManageAccountSummarySerializer
     permission_classes = [IsStaffOnly]
     filter_backends = [SearchFilter, OrderingFilter]
-    search_fields = ['user__username']
+    search_fields = ['user__email']
     ordering_fields = [ 'opened_position', 'margin', 'opened_position']
+    flat_fields = ('id', 'balance', 'profit_loss', 'equity', 'opened_position', 'margin', 'free_margin',
+                   'margin_level')
 
-for method in ['list', 'retrieve', 'create', 'partial_update', 'update', 'destroy']:
+for method in ['list', 'retrieve']:
     AccountSummaryViewSet = method_decorator(
         name=method, decorator=swagger_auto_schema(tags=['manage']))(AccountSummaryViewSet)